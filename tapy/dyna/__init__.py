@@ -1 +1,2 @@
 from tapy.dyna.dynatapy import DynaTapy
+from tapy.dyna.pool import DynaTapyPool
@@ -0,0 +1,354 @@
+"""
+A local, indexed catalog of the systems in a tenant, for services that look systems up many times per second.
+
+A SystemsCatalog holds the result of systems.getSystems in memory, with secondary indexes on common fields (host, owner,
+systemType and enabled by default; fields holding lists, such as tags, are indexed by each of their items), and answers
+get() and find() queries without any request. It is loaded on first use and refreshed from a background thread every
+refresh_interval seconds; a refresh only updates the systems that changed, were added or were removed since the last
+one, along with their index entries. When the client it is attached to (the systems_catalog parameter of DynaTapy)
+creates, updates or deletes a system, or changes its owner, the system is invalidated: it is fetched again with
+systems.getSystemByName right away in the background, and get() fetches it synchronously if it is asked for in the
+meantime.
+
+With a path, the catalog is also stored in a SQLite database, from which a new catalog (e.g., in a restarted process)
+is loaded at once, before being refreshed in the background.
+
+The results returned by queries are shared, so they should not be modified.
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+import tapy.errors
+from tapy.dyna.dynatapy import TapisResult, _to_dict
+
+# the fields indexed by default.
+INDEXED_FIELDS = ('host', 'owner', 'systemType', 'enabled', )
+
+# the systems operations that change a system; the system is invalidated when one of them is called through the client.
+WRITE_OPERATIONS = ('createSystem', 'updateSystem', 'deleteSystemByName', 'changeSystemOwner', )
+
+
+def _fingerprint(record):
+    return hashlib.sha1(json.dumps(record, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _index_values(value):
+    # lists are indexed by each of their (hashable) items.
+    values = value if isinstance(value, list) else [value]
+    return [v for v in values if isinstance(v, (str, int, float, bool, type(None)))]
+
+
+class SystemsCatalog(object):
+    """
+    An in-memory, indexed and incrementally refreshed catalog of the result of systems.getSystems.
+    """
+    def __init__(self, client=None, refresh_interval=60, indexes=INDEXED_FIELDS, path=None):
+        """
+        :param client: (DynaTapy) The client to fetch the systems with; set by DynaTapy when the catalog is passed as
+        its systems_catalog.
+        :param refresh_interval: (float) The number of seconds between refreshes; None to only refresh on demand.
+        :param indexes: (list) The fields to index.
+        :param path: (str) A SQLite database to store the catalog in and load it from.
+        """
+        self.client = client
+        self.refresh_interval = refresh_interval
+        self.indexes = list(indexes)
+        self.path = path
+        # the systems, as TapisResults, their fingerprints, and their values of each indexed field, by name.
+        self._systems = {}
+        self._fingerprints = {}
+        self._indexed = {}
+        # the names of the systems with each value of each indexed field: {field: {value: set(names)}}.
+        self._index = {field: {} for field in self.indexes}
+        # the systems invalidated since they were last fetched, with the count of invalidations when they were, so
+        # that an invalidation made while a system is being fetched is not lost.
+        self._invalidated = {}
+        # the count of invalidations when each system was last invalidated, so that a refresh does not apply a listing
+        # of a system made before its latest invalidation.
+        self._last_invalidated = {}
+        self._loaded = False
+        self._refresh_requested = False
+        self._lock = threading.RLock()
+        self._wakeup = threading.Event()
+        self._closed = threading.Event()
+        self._thread = None
+        self.refreshes = 0
+        self.last_refresh = None
+        self.refresh_errors = 0
+        self.invalidations = 0
+
+    def __getstate__(self):
+        # the systems are fetched again by the unpickled catalog.
+        return {'refresh_interval': self.refresh_interval, 'indexes': self.indexes, 'path': self.path}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def __repr__(self):
+        return f'<SystemsCatalog: {len(self._systems)} systems>'
+
+    def __len__(self):
+        self._ensure_loaded()
+        return len(self._systems)
+
+    # ---------------------
+    # Queries -
+    # ---------------------
+
+    def get(self, name):
+        """
+        Returns a system by name, or None if there is no such system.
+        """
+        self._ensure_loaded()
+        if name in self._invalidated:
+            self._fetch(name)
+        return self._systems.get(name)
+
+    def find(self, **criteria):
+        """
+        Returns the systems whose fields have the given values, e.g., find(host='login.example.org', owner='jdoe'),
+        sorted by name. A criterion on a field holding a list, such as tags, matches the systems whose list contains
+        the value. Indexed fields are looked up in their indexes and the other fields are compared system by system.
+        :return: (list) The systems.
+        """
+        self._ensure_loaded()
+        with self._lock:
+            names = None
+            for field, value in criteria.items():
+                if field in self._index:
+                    matches = self._index[field].get(value, set())
+                    names = matches if names is None else names & matches
+            if names is None:
+                names = self._systems.keys()
+            systems = [self._systems[name] for name in sorted(names)]
+        scanned = {field: value for field, value in criteria.items() if field not in self._index}
+        if scanned:
+            systems = [system for system in systems if all(value in _index_values(getattr(system, field, None))
+                                                           for field, value in scanned.items())]
+        return systems
+
+    def names(self):
+        """
+        Returns the names of all of the systems.
+        """
+        self._ensure_loaded()
+        return sorted(self._systems)
+
+    # ---------------------
+    # Maintenance -
+    # ---------------------
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            # a stored catalog is used right away and refreshed in the background; otherwise, the first query waits.
+            if not self._systems and self.path and self._load():
+                self._refresh_requested = True
+                self._wakeup.set()
+            else:
+                self.refresh()
+            self._loaded = True
+            if not (self._thread and self._thread.is_alive()):
+                self._thread = threading.Thread(target=self._refresh_loop, daemon=True)
+                self._thread.start()
+
+    def _refresh_loop(self):
+        while True:
+            woken = self._wakeup.wait(self.refresh_interval)
+            self._wakeup.clear()
+            if self._closed.is_set():
+                return
+            try:
+                for name in list(self._invalidated):
+                    self._fetch(name)
+                if not woken or self._refresh_requested:
+                    self._refresh_requested = False
+                    self.refresh()
+            except Exception:
+                self.refresh_errors += 1
+
+    def _put(self, name, system, fingerprint):
+        # must be called with the lock held; only updates the index entries of fields whose values changed.
+        record = _to_dict(system)
+        values = {field: _index_values(record.get(field)) for field in self.indexes}
+        old_values = self._indexed.get(name, {})
+        for field in self.indexes:
+            if old_values.get(field) == values[field]:
+                continue
+            for value in old_values.get(field, []):
+                self._unindex(field, value, name)
+            for value in values[field]:
+                self._index[field].setdefault(value, set()).add(name)
+        self._systems[name] = system
+        self._fingerprints[name] = fingerprint
+        self._indexed[name] = values
+
+    def _unindex(self, field, value, name):
+        names = self._index[field].get(value)
+        if names is not None:
+            names.discard(name)
+            if not names:
+                del self._index[field][value]
+
+    def _remove(self, name):
+        # must be called with the lock held.
+        for field, values in self._indexed.pop(name, {}).items():
+            for value in values:
+                self._unindex(field, value, name)
+        self._systems.pop(name, None)
+        self._fingerprints.pop(name, None)
+
+    def refresh(self):
+        """
+        Fetch all of the systems and apply the changes since the last refresh.
+        :return: (dict) The numbers of systems added, updated and removed.
+        """
+        with self._lock:
+            pending = dict(self._invalidated)
+            started = self.invalidations
+        systems = self.client.systems.getSystems()
+        if isinstance(systems, TapisResult):
+            systems = [systems]
+        elif not isinstance(systems, list):
+            # an empty result is returned as the raw JSON.
+            systems = []
+        fetched = {}
+        for system in systems:
+            fetched[system.name] = (system, _fingerprint(_to_dict(system)))
+        changes = {'added': 0, 'updated': 0, 'removed': 0}
+        changed, removed = [], []
+        with self._lock:
+            # the systems invalidated since the listing started may have been fetched again already; the listing is
+            # stale for them.
+            stale = {name for name, count in self._last_invalidated.items() if count > started}
+            for name, (system, fingerprint) in fetched.items():
+                if name in stale:
+                    continue
+                if name not in self._fingerprints:
+                    changes['added'] += 1
+                elif self._fingerprints[name] != fingerprint:
+                    changes['updated'] += 1
+                else:
+                    continue
+                self._put(name, system, fingerprint)
+                changed.append(name)
+            for name in [name for name in self._systems if name not in fetched and name not in stale]:
+                self._remove(name)
+                removed.append(name)
+                changes['removed'] += 1
+            # the systems invalidated while the list was being fetched are fetched again.
+            for name, count in pending.items():
+                if self._invalidated.get(name) == count:
+                    del self._invalidated[name]
+            self.refreshes += 1
+            self.last_refresh = time.time()
+        if self.path:
+            self._store(changed, removed)
+        return changes
+
+    def _fetch(self, name):
+        """
+        Fetch a single system again, e.g., after it was invalidated.
+        """
+        count = self._invalidated.get(name)
+        try:
+            system = self.client.systems.getSystemByName(systemName=name)
+        except tapy.errors.InvalidInputError as e:
+            # a 404 means the system was deleted; a 400 is raised as is, and the system stays invalidated.
+            if e.response is None or e.response.status_code != 404:
+                raise
+            system = None
+        with self._lock:
+            if self._invalidated.get(name) == count:
+                self._invalidated.pop(name, None)
+            if system is None:
+                self._remove(name)
+            else:
+                self._put(name, system, _fingerprint(_to_dict(system)))
+        if self.path:
+            self._store([name] if system is not None else [], [name] if system is None else [])
+
+    def invalidate(self, name=None):
+        """
+        Mark a system, or all of them, as stale; it is fetched again right away in the background, and by get() if
+        it is asked for first.
+        :param name: (str) The name of the system; None to refresh the whole catalog.
+        """
+        with self._lock:
+            self.invalidations += 1
+            if name is None:
+                self._loaded = False
+                return
+            self._invalidated[name] = self.invalidations
+            self._last_invalidated[name] = self.invalidations
+        self._wakeup.set()
+
+    def call(self, operation, kwargs):
+        """
+        Make a systems operation call that changes a system, and invalidate the system. Called by Operation.__call__
+        for the systems operations of clients with a systems catalog.
+        :param operation: (Operation) The systems operation.
+        :param kwargs: (dict) The arguments to the operation.
+        """
+        if operation.operation_id not in WRITE_OPERATIONS:
+            return operation(_tapis_cache=False, **kwargs)
+        try:
+            return operation(_tapis_cache=False, **kwargs)
+        finally:
+            # the state of the system is unknown even if the call failed.
+            name = kwargs.get('systemName', kwargs.get('name'))
+            if name is not None:
+                self.invalidate(name)
+
+    def close(self):
+        self._closed.set()
+        self._wakeup.set()
+
+    def stats(self):
+        return {'systems': len(self._systems),
+                'refreshes': self.refreshes,
+                'last_refresh': self.last_refresh,
+                'refresh_errors': self.refresh_errors,
+                'invalidations': self.invalidations,
+                'invalidated': len(self._invalidated)}
+
+    # ---------------------
+    # Storage -
+    # ---------------------
+
+    def _connect(self):
+        db = sqlite3.connect(self.path)
+        db.execute('CREATE TABLE IF NOT EXISTS systems (name TEXT PRIMARY KEY, fingerprint TEXT, record TEXT)')
+        return db
+
+    def _load(self):
+        """
+        Load the catalog from its database.
+        :return: (bool) Whether any systems were loaded.
+        """
+        db = self._connect()
+        try:
+            rows = db.execute('SELECT name, fingerprint, record FROM systems').fetchall()
+        finally:
+            db.close()
+        for name, fingerprint, record in rows:
+            self._put(name, TapisResult(**json.loads(record)), fingerprint)
+        return bool(rows)
+
+    def _store(self, changed, removed):
+        with self._lock:
+            rows = [(name, self._fingerprints[name], json.dumps(_to_dict(self._systems[name]), default=str))
+                    for name in changed if name in self._systems]
+        db = self._connect()
+        try:
+            with db:
+                db.executemany('INSERT OR REPLACE INTO systems VALUES (?, ?, ?)', rows)
+                db.executemany('DELETE FROM systems WHERE name = ?', [(name, ) for name in removed])
+        finally:
+            db.close()
@@ -0,0 +1,84 @@
+"""
+Coalescing of identical concurrent GET requests.
+
+When a DynaTapy client is created with coalesce_requests=True (or with a Coalescer shared by several clients), an
+operation called with a GET while an identical GET is already in flight does not make a request of its own: it waits
+for the request in flight and returns the same result (or raises the same exception). Requests are identical when they
+have the same URL, including the query parameters, and the same headers, which include the identity headers
+(X-Tapis-Token, X-Tapis-Tenant and X-Tapis-User), so calls made on behalf of different users are never coalesced.
+
+Nothing is cached: a call made after the request in flight has completed makes a new request. The result is the same
+object for all of the callers that shared the request, so it should not be modified.
+"""
+from concurrent.futures import Future
+import threading
+
+
+class Coalescer(object):
+    """
+    Shares one request, and its decoded result, between identical concurrent GET calls.
+    """
+    def __init__(self):
+        # futures for the results of the requests in flight, by key.
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        # the number of requests made, and of calls that shared a request made by another call.
+        self.requests = 0
+        self.coalesced = 0
+
+    def __getstate__(self):
+        return {}
+
+    def __setstate__(self, state):
+        self.__init__()
+
+    def __repr__(self):
+        return f'<Coalescer: {len(self._in_flight)} requests in flight>'
+
+    @staticmethod
+    def key(request):
+        """
+        Returns the key identifying identical requests.
+        :param request: (requests.PreparedRequest) The request.
+        """
+        return request.method, request.url, tuple(sorted((k.lower(), v) for k, v in request.headers.items()))
+
+    def call(self, request, send):
+        """
+        Make a request, unless an identical one is in flight, in which case wait for its result.
+        :param request: (requests.PreparedRequest) The request.
+        :param send: (callable) Makes the request and returns its decoded result; only called if no identical request
+        is in flight.
+        :return: The result.
+        """
+        key = self.key(request)
+        with self._lock:
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._in_flight[key] = future
+                self.requests += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            return future.result()
+        try:
+            result = send()
+        except BaseException as e:
+            self._done(key)
+            future.set_exception(e)
+            raise
+        # calls made from now on make a new request.
+        self._done(key)
+        future.set_result(result)
+        return result
+
+    def _done(self, key):
+        with self._lock:
+            self._in_flight.pop(key, None)
+
+    def stats(self):
+        return {'requests': self.requests,
+                'coalesced': self.coalesced,
+                'in_flight': len(self._in_flight)}
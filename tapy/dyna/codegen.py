@@ -0,0 +1,194 @@
+"""
+Ahead-of-time generation of the DynaTapy resources from the spec files bundled with the SDK.
+
+Building a client from the spec files means importing yaml and openapi_core and parsing every spec, which takes most of
+the time spent creating the first client in a process. This module parses the specs once, at build time, and writes a
+module per resource to tapy/dyna/generated with a StaticResource subclass describing its operations as literals. The
+generated resources are used by DynaTapy in place of the dynamic ones (see the use_generated_resources parameter) as
+long as the spec files they were generated from are unchanged; they create the same Operation objects, so the calls
+they make are identical. A .pyi stub is written next to each module, with a method per operation and its parameters,
+for editors and type checkers.
+
+Run it with:
+    python -m tapy.dyna.codegen [--specs-dir DIR] [--output DIR]
+"""
+import argparse
+import hashlib
+import keyword
+import os
+import sys
+
+from tapy.dyna.dynatapy import RESOURCES, _spec_path
+from tapy.dyna.validation import _value, operation_schemas
+
+# the directory the generated modules are written to by default.
+GENERATED_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'generated')
+
+# python types for the OpenAPI schema types of parameters, used in the stubs.
+STUB_TYPES = {'string': 'str', 'integer': 'int', 'number': 'float', 'boolean': 'bool', 'array': 'list',
+              'object': 'dict'}
+
+HEADER = '# Generated by tapy.dyna.codegen from {spec_file}; do not edit.\n'
+
+
+def _load_spec(spec_path):
+    from openapi_core import create_spec
+    import yaml
+    with open(spec_path, 'rb') as f:
+        content = f.read()
+    return hashlib.sha1(content).hexdigest(), create_spec(yaml.safe_load(content))
+
+
+def _operations(spec):
+    """
+    Generator over the operations of a spec that have an operation id, in the order DynaTapy creates them.
+    """
+    for _, path_desc in spec.paths.items():
+        for _, op_desc in path_desc.operations.items():
+            if op_desc.operation_id:
+                yield op_desc
+
+
+def _request_body(op_desc):
+    """
+    Returns the request body of an operation in the form taken by OperationDescription.
+    """
+    if op_desc.request_body is None:
+        return None
+    content = {}
+    for content_type, media_type in op_desc.request_body.content.items():
+        schema = getattr(media_type, 'schema', None)
+        properties = list((getattr(schema, 'properties', None) or {}).keys())
+        required = list(getattr(schema, 'required', None) or [])
+        content[content_type] = (properties, required)
+    return content
+
+
+def describe_operation(op_desc):
+    """
+    Returns the arguments to OperationDescription describing an operation, as literals.
+    :param op_desc: (openapi_core.schema.operations.models.Operation) The operation.
+    """
+    parameters = [(p.name, _value(p.location), bool(p.required)) for _, p in op_desc.parameters.items()]
+    return {'operation_id': op_desc.operation_id, 'http_method': op_desc.http_method, 'path_name': op_desc.path_name,
+            'parameters': parameters, 'request_body': _request_body(op_desc), 'schemas': operation_schemas(op_desc)}
+
+
+def _class_name(resource_name):
+    return f'{resource_name.capitalize()}Resource'
+
+
+def render_module(resource_name, spec_file, digest, spec):
+    """
+    Returns the source of the generated module for a resource.
+    """
+    lines = [HEADER.format(spec_file=spec_file),
+             'from tapy.dyna.dynatapy import OperationDescription, StaticResource',
+             '',
+             '',
+             f'class {_class_name(resource_name)}(StaticResource):',
+             f'    resource_name = {resource_name!r}',
+             f'    spec_digest = {digest!r}',
+             '    operations = {']
+    for op_desc in _operations(spec):
+        description = describe_operation(op_desc)
+        lines.append(f'        {op_desc.operation_id!r}: OperationDescription(')
+        lines.append(f'            {op_desc.operation_id!r}, {op_desc.http_method!r}, {op_desc.path_name!r},')
+        lines.append(f'            parameters={description["parameters"]!r},')
+        lines.append(f'            request_body={description["request_body"]!r},')
+        # the schemas, for validating arguments in strict mode.
+        lines.append(f'            schemas={description["schemas"]!r}),')
+    lines.append('    }')
+    return '\n'.join(lines) + '\n'
+
+
+def _stub_parameters(op_desc):
+    """
+    Returns the keyword parameters of the stub for an operation, required parameters first.
+    """
+    parameters = [(p.name, STUB_TYPES.get(_value(getattr(p.schema, 'type', None)), 'Any'), bool(p.required))
+                  for _, p in op_desc.parameters.items()]
+    body = _request_body(op_desc) or {}
+    for content_type, (properties, required) in body.items():
+        if content_type in ('application/json', '*/*') and not properties:
+            parameters.append(('request_body', 'Any', True))
+        else:
+            parameters.extend((name, 'Any', name in required) for name in properties)
+        break
+    seen = set()
+    result = []
+    for name, type_name, required in sorted(parameters, key=lambda p: not p[2]):
+        # parameters that are not valid python identifiers can only be passed with **kwargs.
+        if name in seen or not name.isidentifier() or keyword.iskeyword(name):
+            continue
+        seen.add(name)
+        result.append(f'{name}: {type_name}' if required else f'{name}: {type_name} = ...')
+    return result
+
+
+def render_stub(resource_name, spec_file, spec):
+    """
+    Returns the source of the .pyi stub for the generated module of a resource.
+    """
+    lines = [HEADER.format(spec_file=spec_file),
+             'from typing import Any, Dict',
+             '',
+             'from tapy.dyna.dynatapy import OperationDescription, StaticResource',
+             '',
+             '',
+             f'class {_class_name(resource_name)}(StaticResource):',
+             '    resource_name: str',
+             '    spec_digest: str',
+             '    operations: Dict[str, OperationDescription]']
+    for op_desc in _operations(spec):
+        if not op_desc.operation_id.isidentifier() or keyword.iskeyword(op_desc.operation_id):
+            continue
+        parameters = _stub_parameters(op_desc)
+        parameters = ', '.join(['self'] + (['*'] + parameters if parameters else []) + ['**kwargs: Any'])
+        lines.append(f'    def {op_desc.operation_id}({parameters}) -> Any: ...')
+    return '\n'.join(lines) + '\n'
+
+
+def generate(specs_dir=None, output=GENERATED_DIR):
+    """
+    Generate the modules for all of the resources.
+    :param specs_dir: (str) The directory holding the spec files; defaults to the one DynaTapy loads them from. The
+    generated resources are only used if the spec files DynaTapy loads are identical to these.
+    :param output: (str) The directory (package) to write the modules to.
+    :return: (list) The names of the resources generated.
+    """
+    os.makedirs(output, exist_ok=True)
+    generated = []
+    for resource_name, _ in RESOURCES:
+        spec_path = _spec_path(resource_name)
+        if specs_dir:
+            spec_path = os.path.join(specs_dir, os.path.basename(spec_path))
+        digest, spec = _load_spec(spec_path)
+        spec_file = os.path.basename(spec_path)
+        with open(os.path.join(output, f'{resource_name}.py'), 'w') as f:
+            f.write(render_module(resource_name, spec_file, digest, spec))
+        with open(os.path.join(output, f'{resource_name}.pyi'), 'w') as f:
+            f.write(render_stub(resource_name, spec_file, spec))
+        generated.append(resource_name)
+    lines = ['# Generated by tapy.dyna.codegen; do not edit.']
+    lines.extend(f'from .{name} import {_class_name(name)}' for name in generated)
+    lines.append('')
+    lines.append('RESOURCE_CLASSES = {')
+    lines.extend(f'    {name!r}: {_class_name(name)},' for name in generated)
+    lines.append('}')
+    with open(os.path.join(output, '__init__.py'), 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    return generated
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate the DynaTapy resources from the bundled spec files.')
+    parser.add_argument('--specs-dir', help='directory holding the spec files')
+    parser.add_argument('--output', default=GENERATED_DIR, help='directory to write the generated modules to')
+    args = parser.parse_args(argv)
+    for resource_name in generate(args.specs_dir, args.output):
+        print(f'generated {resource_name}')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
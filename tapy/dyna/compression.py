@@ -0,0 +1,145 @@
+"""
+Compression of the request bodies sent, and negotiation of compressed responses, for a DynaTapy client.
+
+Not every Tapis service accepts compressed request bodies, so request compression is configured per resource ("meta",
+"streams", ...) and, optionally, per operation ("sk.grantUserPermission"): bodies of at least min_size bytes sent to
+the configured resources are compressed with gzip or zstd and sent with a Content-Encoding header. Streamed bodies
+(files, generators) are sent as they are.
+
+Every request sent by a client with a Compression also advertises, in its Accept-Encoding header, the encodings the
+client can decode (gzip and deflate, plus br and zstd when the brotli and zstd packages are installed), so services
+and proxies that support them can compress large responses. The responses are decoded as they are read, including
+streamed ones, by urllib3 (or httpx, with the HTTP2Transport).
+"""
+import gzip
+import threading
+
+import urllib3.util.request
+
+import tapy.errors
+
+try:
+    # python 3.14+, or the backports.zstd package
+    try:
+        from compression import zstd as _zstd
+    except ImportError:
+        from backports import zstd as _zstd
+except ImportError:
+    _zstd = None
+try:
+    import zstandard
+except ImportError:
+    # zstd compression is optional and requires one of the packages above.
+    zstandard = None
+
+# the encodings the client can decode responses in, as advertised in the Accept-Encoding header.
+ACCEPT_ENCODING = urllib3.util.request.ACCEPT_ENCODING
+
+# the default compression level of each encoding.
+DEFAULT_LEVELS = {'gzip': 6, 'zstd': 3}
+
+
+def compress(data, encoding, level=None):
+    """
+    Compress bytes with an encoding.
+    :param data: (bytes) The data.
+    :param encoding: (str) "gzip" or "zstd".
+    :param level: (int) The compression level; defaults to DEFAULT_LEVELS.
+    :return: (bytes)
+    """
+    level = DEFAULT_LEVELS[encoding] if level is None else level
+    if encoding == 'gzip':
+        # mtime=0 makes the output deterministic, so that recorded requests can be matched on replay.
+        return gzip.compress(data, compresslevel=level, mtime=0)
+    if _zstd is not None:
+        return _zstd.compress(data, level=level)
+    return zstandard.ZstdCompressor(level=level).compress(data)
+
+
+def _encoding(encoding):
+    if encoding not in (None, 'gzip', 'zstd'):
+        raise tapy.errors.TapyClientConfigurationError(msg=f'Unsupported request compression encoding: {encoding}; '
+                                                           f'use "gzip" or "zstd".')
+    if encoding == 'zstd' and _zstd is None and zstandard is None:
+        raise tapy.errors.TapyClientConfigurationError(msg='zstd compression requires the zstandard package; install '
+                                                           'it with: pip install zstandard')
+    return encoding
+
+
+class Compression(object):
+    """
+    The compression settings of a client. See the compression parameter of the DynaTapy constructor.
+    """
+    def __init__(self, resources=None, default=None, min_size=1024, level=None, accept_encoding=ACCEPT_ENCODING):
+        """
+        :param resources: (dict) The encoding ("gzip", "zstd" or None) of the request bodies sent to each resource,
+        keyed by resource name (e.g., "meta") or by resource name and operation id (e.g., "sk.grantUserPermission"); an
+        operation setting overrides the setting of its resource.
+        :param default: (str) The encoding of the request bodies sent to the resources not in resources; by default,
+        they are not compressed.
+        :param min_size: (int) Bodies smaller than this number of bytes are not compressed.
+        :param level: (int) The compression level; defaults to DEFAULT_LEVELS.
+        :param accept_encoding: (str) The Accept-Encoding header sent with every request; None to not send one, in
+        which case responses are not compressed.
+        """
+        self.resources = {key: _encoding(encoding) for key, encoding in (resources or {}).items()}
+        self.default = _encoding(default)
+        self.min_size = min_size
+        self.level = level
+        self.accept_encoding = accept_encoding
+        self._lock = threading.Lock()
+        # the number of bodies compressed, and their sizes before and after compression.
+        self.compressed = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def __getstate__(self):
+        return {'resources': self.resources, 'default': self.default, 'min_size': self.min_size, 'level': self.level,
+                'accept_encoding': self.accept_encoding}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def __repr__(self):
+        return f'<Compression resources={self.resources} default={self.default} min_size={self.min_size}>'
+
+    def encoding_for(self, resource_name, operation_id):
+        """
+        Returns the encoding of the request bodies sent to an operation, or None.
+        """
+        key = f'{resource_name}.{operation_id}'
+        if key in self.resources:
+            return self.resources[key]
+        return self.resources.get(resource_name, self.default)
+
+    def prepare(self, request, resource_name, operation_id):
+        """
+        Set the Accept-Encoding header of a prepared request and compress its body, in place, as configured.
+        :param request: (requests.PreparedRequest) The request.
+        :param resource_name: (str) The resource the request is for, such as "meta".
+        :param operation_id: (str) The operation the request is for.
+        """
+        if self.accept_encoding and 'Accept-Encoding' not in request.headers:
+            request.headers['Accept-Encoding'] = self.accept_encoding
+        encoding = self.encoding_for(resource_name, operation_id)
+        body = request.body
+        if not encoding or 'Content-Encoding' in request.headers or not isinstance(body, (str, bytes, bytearray)):
+            return
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        if len(body) < self.min_size:
+            return
+        data = compress(bytes(body), encoding, self.level)
+        with self._lock:
+            self.compressed += 1
+            self.bytes_in += len(body)
+            self.bytes_out += len(data)
+        request.body = data
+        request.headers['Content-Encoding'] = encoding
+        request.headers['Content-Length'] = str(len(data))
+
+    def stats(self):
+        return {'compressed': self.compressed,
+                'bytes_in': self.bytes_in,
+                'bytes_out': self.bytes_out,
+                'ratio': self.bytes_out / self.bytes_in if self.bytes_in else None}
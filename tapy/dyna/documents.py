@@ -0,0 +1,269 @@
+"""
+Bulk import and export of documents in Meta collections.
+
+import_documents() streams documents from an NDJSON or JSON array file (or any iterable) into a collection, posting
+them to meta.createDocument in batches from a thread pool; reading pauses while max_in_flight batches are outstanding,
+so files of any size are imported in bounded memory. export_documents() pages through meta.listDocuments, fetching the
+next pages while the current one is written, and writes the documents to an NDJSON file as they arrive. Both return a
+BulkStats object with the number of documents and batches processed, the errors, and the throughput.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import json
+import threading
+import time
+
+from tapy.dyna.dynatapy import TapisResult, _to_dict
+
+# the number of bytes read at a time when parsing a JSON array file.
+READ_CHUNK_SIZE = 1024 * 1024
+
+
+def _documents(result):
+    """
+    Returns the documents in a page returned by meta.listDocuments. The Meta API returns raw JSON rather than the
+    standard Tapis stanzas, which the operation returns as bytes or as the decoded JSON, depending on the content type.
+    """
+    if isinstance(result, (bytes, str)):
+        result = json.loads(result) if result else []
+    if isinstance(result, TapisResult):
+        result = getattr(result, 'result', [])
+    if not isinstance(result, list):
+        return []
+    return [_to_dict(document) for document in result]
+
+
+def iter_documents(source):
+    """
+    Generator over the documents in a file, either NDJSON with one document per line or a JSON array of documents.
+    JSON arrays are parsed incrementally, so neither format is read into memory at once.
+    :param source: (str or file) The path of the file, or a text file object.
+    """
+    if isinstance(source, str):
+        with open(source, 'r') as f:
+            yield from iter_documents(f)
+        return
+    decoder = json.JSONDecoder()
+    buffer = source.read(READ_CHUNK_SIZE)
+    stripped = buffer.lstrip()
+    if not stripped.startswith('['):
+        # NDJSON; the first chunk has already been read, so put it back in front of the remaining lines.
+        pending = ''
+        while buffer:
+            lines = (pending + buffer).split('\n')
+            pending = lines.pop()
+            for line in lines:
+                if line.strip():
+                    yield json.loads(line)
+            buffer = source.read(READ_CHUNK_SIZE)
+        if pending.strip():
+            yield json.loads(pending)
+        return
+    buffer = stripped[1:]
+    eof = False
+    while True:
+        buffer = buffer.lstrip().lstrip(',').lstrip()
+        if buffer.startswith(']'):
+            return
+        try:
+            document, end = decoder.raw_decode(buffer)
+        except ValueError:
+            # the next document is not complete in the buffer yet.
+            if eof:
+                raise
+            chunk = source.read(READ_CHUNK_SIZE)
+            eof = not chunk
+            buffer += chunk
+            continue
+        if end == len(buffer) and not eof:
+            # a number at the end of the buffer could still be truncated; read more before accepting it.
+            chunk = source.read(READ_CHUNK_SIZE)
+            if chunk:
+                buffer += chunk
+                continue
+            eof = True
+        yield document
+        buffer = buffer[end:]
+
+
+class BulkStats(object):
+    """
+    Statistics for a bulk import or export.
+    """
+    def __init__(self, max_errors_kept=100):
+        # the number of documents, and of batches (imports) or pages (exports), processed successfully
+        self.documents = 0
+        self.batches = 0
+
+        # the number of documents and batches that could not be written or read
+        self.failed_documents = 0
+        self.failed_batches = 0
+
+        # the number of documents read but not written because the import stopped after an error, and whether it did;
+        # the documents of the source that were not read yet are not counted.
+        self.skipped_documents = 0
+        self.stopped = False
+
+        # (index of the first document of the batch, exception) for the first max_errors_kept failed batches
+        self.errors = []
+        self.max_errors_kept = max_errors_kept
+
+        self.started = time.monotonic()
+        self.elapsed = 0
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f'<BulkStats {self.as_dict()}>'
+
+    def _succeeded(self, count):
+        with self._lock:
+            self.documents += count
+            self.batches += 1
+
+    def _failed(self, start, count, exception):
+        with self._lock:
+            self.failed_documents += count
+            self.failed_batches += 1
+            if len(self.errors) < self.max_errors_kept:
+                self.errors.append((start, exception))
+
+    def _finish(self):
+        self.elapsed = time.monotonic() - self.started
+
+    @property
+    def throughput(self):
+        """
+        The number of documents processed per second.
+        """
+        elapsed = self.elapsed or time.monotonic() - self.started
+        return self.documents / elapsed if elapsed else 0
+
+    def as_dict(self):
+        return {'documents': self.documents,
+                'batches': self.batches,
+                'failed_documents': self.failed_documents,
+                'failed_batches': self.failed_batches,
+                'skipped_documents': self.skipped_documents,
+                'stopped': self.stopped,
+                'elapsed': self.elapsed,
+                'throughput': self.throughput}
+
+
+def import_documents(client, db, collection, source, batch_size=500, max_in_flight=8, stop_on_error=False):
+    """
+    Create the documents from a file or an iterable in a collection, in concurrent batches.
+    :param client: (DynaTapy) The client to make requests with.
+    :param db: (str) The database of the collection.
+    :param collection: (str) The collection to create the documents in.
+    :param source: The path of an NDJSON or JSON array file, a text file object, or an iterable of documents; see
+    iter_documents().
+    :param batch_size: (int) The number of documents created by each meta.createDocument request.
+    :param max_in_flight: (int) The maximum number of batches being written at the same time; reading the source
+    pauses beyond that.
+    :param stop_on_error: (bool) Whether to stop reading the source after the first failed batch; batches already
+    submitted are still written. The documents read but not submitted are counted as skipped_documents, and stopped
+    is set; the rest of the source is not read, so it is not counted.
+    :return: (BulkStats)
+    """
+    if isinstance(source, str) or hasattr(source, 'read'):
+        source = iter_documents(source)
+    stats = BulkStats()
+    slots = threading.BoundedSemaphore(max_in_flight)
+    stopped = threading.Event()
+
+    def _write(start, batch):
+        try:
+            # the Meta API creates every document of an array posted to a collection. The spec only describes a
+            # single document as the body, so a batch is not validated against it, even in strict mode.
+            client.meta.createDocument(db=db, collection=collection, request_body=batch, _tapis_validate=False)
+        except Exception as e:
+            stats._failed(start, len(batch), e)
+            if stop_on_error:
+                stopped.set()
+        else:
+            stats._succeeded(len(batch))
+        finally:
+            slots.release()
+
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        batch = []
+        start = 0
+        for index, document in enumerate(source):
+            if not batch:
+                start = index
+            batch.append(document)
+            if len(batch) < batch_size:
+                continue
+            slots.acquire()
+            if stopped.is_set():
+                slots.release()
+                stats.skipped_documents += len(batch)
+                stats.stopped = True
+                batch = []
+                break
+            executor.submit(_write, start, batch)
+            batch = []
+        if batch:
+            slots.acquire()
+            if stopped.is_set():
+                slots.release()
+                stats.skipped_documents += len(batch)
+                stats.stopped = True
+            else:
+                executor.submit(_write, start, batch)
+    stats._finish()
+    return stats
+
+
+def export_documents(client, db, collection, dest, filter=None, keys=None, pagesize=1000, prefetch=2):
+    """
+    Write the documents of a collection to an NDJSON file, one page of meta.listDocuments at a time.
+    :param client: (DynaTapy) The client to make requests with.
+    :param db: (str) The database of the collection.
+    :param collection: (str) The collection to export.
+    :param dest: (str or file) The path of the file to write, or a text file object.
+    :param filter: (str or dict) A filter on the documents to export, as accepted by listDocuments.
+    :param keys: (list) The keys of the documents to export, as accepted by listDocuments.
+    :param pagesize: (int) The number of documents requested per page.
+    :param prefetch: (int) The number of pages requested ahead of the page being written.
+    :return: (BulkStats) Pages are counted as batches.
+    """
+    if isinstance(dest, str):
+        with open(dest, 'w') as f:
+            return export_documents(client, db, collection, f, filter=filter, keys=keys, pagesize=pagesize,
+                                    prefetch=prefetch)
+    kwargs = {'db': db, 'collection': collection, 'pagesize': pagesize}
+    if filter is not None:
+        kwargs['filter'] = filter if isinstance(filter, str) else json.dumps(filter)
+    if keys is not None:
+        kwargs['keys'] = keys
+    stats = BulkStats()
+
+    def _fetch(page):
+        return _documents(client.meta.listDocuments(page=page, **kwargs))
+
+    with ThreadPoolExecutor(max_workers=prefetch + 1) as executor:
+        pending = [executor.submit(_fetch, page) for page in range(1, prefetch + 2)]
+        next_page = prefetch + 2
+        page = 1
+        while pending:
+            future = pending.pop(0)
+            try:
+                documents = future.result()
+            except Exception as e:
+                # a page that cannot be read ends the export, since the end of the collection is unknown.
+                stats._failed((page - 1) * pagesize, pagesize, e)
+                break
+            for document in documents:
+                dest.write(json.dumps(document))
+                dest.write('\n')
+            stats._succeeded(len(documents))
+            if len(documents) < pagesize:
+                # the last page; pages requested beyond it are empty.
+                break
+            pending.append(executor.submit(_fetch, next_page))
+            next_page += 1
+            page += 1
+        for future in pending:
+            future.cancel()
+    stats._finish()
+    return stats
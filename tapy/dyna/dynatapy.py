@@ -1,13 +1,23 @@
 from base64 import b64encode
-from collections.abc import Sequence
+from collections.abc import Iterator, Mapping, Sequence
+from concurrent.futures import ThreadPoolExecutor
+import copy
 import datetime
+import hashlib
 import json
+import os
+import threading
+import weakref
 import requests
-from openapi_core import create_spec
-from openapi_core.schema.parameters.enums import ParameterLocation
-import yaml
 
 import tapy.errors
+from tapy.dyna.coalesce import Coalescer
+from tapy.dyna.compression import Compression
+from tapy.dyna.ratelimit import RateLimiter
+from tapy.dyna.routing import RoutingTransport
+from tapy.dyna.scheduler import PriorityScheduler
+from tapy.dyna.transport import KeepAliveTransport, SessionTransport
+from tapy.dyna.validation import validator_for
 
 def _seq_but_not_str(obj):
     """
@@ -18,6 +28,16 @@ def _seq_but_not_str(obj):
     return isinstance(obj, Sequence) and not isinstance(obj, (str, bytes, bytearray))
 
 
+def _is_binary_body(obj):
+    """
+    Determine if an object can be sent as a raw (application/octet-stream) request body as is, i.e., it is a bytes-like
+    object, a file-like object or an iterator (such as a generator) of bytes.
+    :param obj: Any python object.
+    :return:
+    """
+    return isinstance(obj, (bytes, bytearray, memoryview, Iterator)) or hasattr(obj, 'read')
+
+
 RESOURCES = [('actors', 'https://raw.githubusercontent.com/TACC/abaco/master/docs/specs/openapi_v3.yml'),
              ('authenticator', 'https://raw.githubusercontent.com/tapis-project/authenticator/dev/service/resources/openapi_v3.yml'),
              ('meta','https://raw.githubusercontent.com/tapis-project/tapis-client-java/master/meta-client/src/main/resources/metav3-openapi.yaml'),
@@ -28,38 +48,257 @@ RESOURCES = [('actors', 'https://raw.githubusercontent.com/TACC/abaco/master/doc
              ('tenants', 'https://raw.githubusercontent.com/tapis-project/tenants-api/master/service/resources/openapi_v3.yml'),
              ('tokens','https://raw.githubusercontent.com/tapis-project/tokens-api/master/service/resources/openapi_v3.yml'),]
 
-def _getspec(resource_name, resource_url, download_spec=False):
+# the operations used to probe the health of an endpoint, when a client has several (see the endpoints parameter).
+HEALTH_CHECK_OPERATIONS = (('systems', 'readyCheck'), ('files', 'healthCheck'), )
+
+def _spec_path(resource_name):
     """
-    Returns the openapi spec
+    Returns the path of the spec file bundled with the SDK for a resource.
+    """
+    # for now, hardcode the paths; we could look these up based on a canonical URL once that is
+    # established.
+    return f'/home/tapis/tapy/dyna/resources/openapi_v3-{resource_name}.yml'
+
+
+def _getspec(resource_name):
+    """
+    Returns the openapi spec bundled with the SDK for a resource; see refresh_latest_specs() for the latest specs.
     :param resource_name: (str) the name of the resource.
-    :param resource_url: (str) URL to download the resource spec file.
     :return: (openapi_core.schema.specs.models.Spec) The Spec object associated with this resource.
     """
-    if download_spec:
-        try:
-            response = requests.get(resource_url)
-            if response.status_code == 200:
-               try:
-                   spec_dict = yaml.load(response.content)
-                   return create_spec(spec_dict)
-        # for now, if there are errors trying to fetch the latest spec, we fall back to the spec files defined in the
-        # the python-sdk package;
-               except:
-                   pass
-        except:
-            pass
-
+    # yaml and openapi_core are imported here rather than at the top of the module so that clients using the
+    # generated resources (see tapy.dyna.codegen) never import them.
+    from openapi_core import create_spec
+    import yaml
     try:
-        # for now, hardcode the paths; we could look these up based on a canonical URL once that is
-        # established.
-        spec_path = f'/home/tapis/tapy/dyna/resources/openapi_v3-{resource_name}.yml'
+        spec_path = _spec_path(resource_name)
         spec_dict = yaml.load(open(spec_path, 'r'))
         return create_spec(spec_dict)
     except Exception as e:
         print(f"Got exception trying to load spec_path: {spec_path}; exception: {e}")
         raise e
 
-RESOURCE_SPECS = {resource[0]: _getspec(resource[0], resource[1]) for resource in RESOURCES}
+class _ResourceSpecs(Mapping):
+    """
+    The specs bundled with the SDK, keyed by resource name. The spec files are only parsed the first time a spec is
+    needed, which is never for clients that only use generated resources.
+    """
+    def __init__(self):
+        self._specs = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            if self._specs is None:
+                self._specs = {resource[0]: _getspec(resource[0]) for resource in RESOURCES}
+        return self._specs
+
+    def __getitem__(self, resource_name):
+        return self._load()[resource_name]
+
+    def __iter__(self):
+        return iter(self._load())
+
+    def __len__(self):
+        return len(self._load())
+
+
+RESOURCE_SPECS = _ResourceSpecs()
+
+# default directory for caching downloaded spec files, used when download_latest_specs is True.
+SPEC_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.tapy', 'specs')
+
+# the latest specs downloaded by any client in this process, as a dictionary mapping resource name to a tuple
+# (content digest, spec object); new clients start on these instead of downloading and parsing again.
+LATEST_SPECS = {}
+_LATEST_SPECS_LOCK = threading.Lock()
+
+
+def _fetch_spec(resource_name, resource_url, cache_dir, timeout):
+    """
+    Returns the raw content of the latest spec file for a resource, using the on-disk cache in cache_dir. The cached
+    copy is revalidated with a conditional GET (ETag/If-Modified-Since) so an unchanged spec is not downloaded again.
+    :param resource_name: (str) the name of the resource.
+    :param resource_url: (str) URL to download the resource spec file.
+    :param cache_dir: (str) directory holding the cached spec files and their validators.
+    :param timeout: (float) timeout, in seconds, for the download.
+    :return: (bytes) The content of the spec file.
+    """
+    spec_path = _cached_spec_path(resource_name, cache_dir)
+    meta_path = os.path.join(cache_dir, f'openapi_v3-{resource_name}.json')
+    headers = {}
+    if os.path.exists(spec_path) and os.path.exists(meta_path):
+        try:
+            with open(meta_path, 'r') as f:
+                meta = json.load(f)
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+        except Exception:
+            # an unreadable validators file just means we download the spec again.
+            headers = {}
+    response = requests.get(resource_url, headers=headers, timeout=timeout)
+    if response.status_code == 304:
+        with open(spec_path, 'rb') as f:
+            return f.read()
+    response.raise_for_status()
+    # write to temporary files and rename them into place so that concurrent processes never read a partial file.
+    os.makedirs(cache_dir, exist_ok=True)
+    for path, content in ((spec_path, response.content),
+                          (meta_path, json.dumps({'etag': response.headers.get('ETag'),
+                                                  'last_modified': response.headers.get('Last-Modified')}).encode())):
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+    return response.content
+
+
+def _cached_spec_path(resource_name, cache_dir):
+    return os.path.join(cache_dir, f'openapi_v3-{resource_name}.yml')
+
+
+def _parse_latest_spec(resource_name, content):
+    """
+    Parse the content of a spec file and make it the latest spec for a resource, unless it matches the spec already in
+    LATEST_SPECS.
+    :return: (openapi_core.schema.specs.models.Spec) The new Spec object, or None if the spec has not changed.
+    """
+    digest = hashlib.sha1(content).hexdigest()
+    current = LATEST_SPECS.get(resource_name)
+    if current and current[0] == digest:
+        return None
+    from openapi_core import create_spec
+    import yaml
+    spec = create_spec(yaml.safe_load(content))
+    with _LATEST_SPECS_LOCK:
+        LATEST_SPECS[resource_name] = (digest, spec)
+    return spec
+
+
+def load_cached_specs(cache_dir=SPEC_CACHE_DIR):
+    """
+    Make the spec files cached in cache_dir by an earlier download, in this process or another, the latest specs of
+    the resources that do not have one in LATEST_SPECS yet. No requests are made; specs that cannot be read or parsed
+    are skipped.
+    :param cache_dir: (str) directory holding the cached spec files.
+    :return: (list) The names of the resources whose cached specs were loaded.
+    """
+    loaded = []
+    for resource_name, _ in RESOURCES:
+        if resource_name in LATEST_SPECS:
+            continue
+        try:
+            with open(_cached_spec_path(resource_name, cache_dir), 'rb') as f:
+                content = f.read()
+            if _parse_latest_spec(resource_name, content):
+                loaded.append(resource_name)
+        except Exception:
+            # the bundled spec is used instead; the next download replaces the cached file.
+            continue
+    return loaded
+
+
+def _load_latest_spec(resource_name, resource_url, cache_dir, timeout):
+    """
+    Fetch the latest spec for a resource and parse it, unless its content matches the spec already in LATEST_SPECS.
+    :return: (openapi_core.schema.specs.models.Spec) The new Spec object, or None if the spec has not changed.
+    """
+    return _parse_latest_spec(resource_name, _fetch_spec(resource_name, resource_url, cache_dir, timeout))
+
+
+def refresh_latest_specs(cache_dir=SPEC_CACHE_DIR, timeout=10):
+    """
+    Concurrently fetch, and parse where changed, the latest spec files for all resources.
+    :param cache_dir: (str) directory holding the cached spec files.
+    :param timeout: (float) timeout, in seconds, for each download.
+    :return: (tuple) A dictionary of the new Spec objects keyed by resource name, for the specs that changed, and a
+    dictionary of the exceptions raised, keyed by resource name, for the specs that could not be loaded.
+    """
+    updated = {}
+    errors = {}
+    with ThreadPoolExecutor(max_workers=len(RESOURCES)) as executor:
+        futures = {resource_name: executor.submit(_load_latest_spec, resource_name, resource_url, cache_dir, timeout)
+                   for resource_name, resource_url in RESOURCES}
+        for resource_name, future in futures.items():
+            try:
+                spec = future.result()
+            except Exception as e:
+                errors[resource_name] = e
+                continue
+            if spec:
+                updated[resource_name] = spec
+    return updated, errors
+
+
+def _token_expires_at(token):
+    """
+    Returns the expiry of an access or refresh token as a timezone-aware datetime, or None if it cannot be determined.
+    :param token: (TapisResult) An access or refresh token.
+    """
+    expires_at = getattr(token, 'expires_at', None)
+    if isinstance(expires_at, str):
+        try:
+            expires_at = datetime.datetime.fromisoformat(expires_at)
+        except ValueError:
+            return None
+    if not isinstance(expires_at, datetime.datetime):
+        return None
+    if not expires_at.tzinfo:
+        expires_at = expires_at.replace(tzinfo=datetime.timezone.utc)
+    return expires_at
+
+
+def _token_to_dict(token, jwt_attr):
+    """
+    Returns a JSON-serializable description of an access or refresh token from which an equivalent TapisResult can be
+    constructed.
+    :param token: (TapisResult) An access or refresh token.
+    :param jwt_attr: (str) The attribute holding the JWT itself, i.e., "access_token" or "refresh_token".
+    """
+    if not token:
+        return None
+    expires_at = _token_expires_at(token)
+    # set_access_token() replaces expires_in with a function and keeps the TTL from the API as original_ttl.
+    ttl = getattr(token, 'original_ttl', getattr(token, 'expires_in', None))
+    return {jwt_attr: getattr(token, jwt_attr, None),
+            'jti': getattr(token, 'jti', None),
+            'expires_at': expires_at.isoformat() if expires_at else None,
+            'expires_in': ttl if type(ttl) in (int, float) else None}
+
+
+def _raise_for_error_response(resp, request):
+    """
+    Raise the appropriate tapy error for a non-20x response from a Tapis API.
+    :param resp: (requests.Response) The response.
+    :param request: (requests.PreparedRequest) The request the response is for.
+    :return: (str) The version reported in the response, if any.
+    """
+    # try to get the error message and version from the Tapis request:
+    try:
+        error_msg = resp.json().get('message')
+    except:
+        error_msg = resp.content
+    try:
+        version = resp.json().get('version')
+    except:
+        version = None
+    # for any kind of non-20x response, we need to raise an error.
+    if resp.status_code in (400, 404):
+        raise tapy.errors.InvalidInputError(msg=error_msg, version=version, request=request, response=resp)
+    if resp.status_code in (401, 403):
+        raise tapy.errors.NotAuthorizedError(msg=error_msg, version=version, request=request, response=resp)
+    if resp.status_code in (429, ):
+        raise tapy.errors.TooManyRequestsError(msg=error_msg, version=version, request=request, response=resp)
+    if resp.status_code in (500, ):
+        raise tapy.errors.ServerDownError(msg=error_msg, version=version, request=request, response=resp)
+    if resp.status_code in (503, ):
+        raise tapy.errors.ServiceUnavailableError(msg=error_msg, version=version, request=request, response=resp)
+    # catch-all for any other non-20x response:
+    if resp.status_code >= 300:
+        raise tapy.errors.BaseTapyException(msg=error_msg, version=version, request=request, response=resp)
+    return version
 
 
 def get_basic_auth_header(username, password):
@@ -90,8 +329,27 @@ class DynaTapy(object):
                  service_password=None,
                  client_id=None,
                  client_key=None,
-                 download_latest_specs=False
+                 download_latest_specs=False,
+                 transport=None,
+                 spec_cache_dir=None,
+                 block_on_spec_download=False,
+                 token_cache=None,
+                 secret_cache=None,
+                 prefetch_secrets=None,
+                 rate_limits=None,
+                 warmup_connections=0,
+                 use_generated_resources=True,
+                 compression=None,
+                 validate_requests=False,
+                 endpoints=None,
+                 coalesce_requests=False,
+                 scheduler=None,
+                 systems_catalog=None
                  ):
+        # with several equivalent endpoints, the first one is the base_url unless a base_url is passed.
+        if endpoints and not base_url:
+            base_url = endpoints[0]
+
         # the base_url for the server this Tapis client should interact with
         self.base_url = base_url
 
@@ -130,29 +388,140 @@ class DynaTapy(object):
         # the client key of an OAuth2 client to use for generating tokens
         self.client_key = client_key
 
+        # an optional token cache, such as a tapy.dyna.tokencache.FileTokenCache, shared with other clients (possibly
+        # in other processes) for the same identity. get_tokens() and refresh_tokens() use unexpired tokens from the
+        # cache when there are any, and store the tokens they generate in it.
+        self.token_cache = token_cache
+
+        # an optional tapy.dyna.secrets.SecretCache; sk.readSecret() calls made with this client are then answered
+        # from memory while the secret is fresh, and the client's writes to a secret invalidate it.
+        self.secret_cache = secret_cache
+
+        # the secrets to read into the secret_cache as soon as the client has a token, as a list of dictionaries of
+        # arguments to sk.readSecret(). They are read concurrently in a background thread; errors are kept in
+        # secret_prefetch_errors.
+        self.prefetch_secrets = prefetch_secrets
+        self.secret_prefetch_errors = []
+        self._secret_prefetch = None
+
+        # set on the threads generating tokens while holding the token_cache lock, whose token calls must not try to
+        # refresh the expiring access token: that would wait for the same lock.
+        self._token_call = threading.local()
+
         # the requests.Session object this client will use to prepare requests
         self.requests_session = requests.Session()
 
+        # the number of keep-alive connections to open to the base_url when the client is created, before its first
+        # request, so that the requests do not pay for TCP and TLS setup. This requires a transport with a warmup()
+        # method; a tapy.dyna.transport.KeepAliveTransport is used when no transport is passed.
+        self.warmup_connections = warmup_connections
+        if transport is None and warmup_connections:
+            transport = KeepAliveTransport(self.requests_session, pool_maxsize=max(10, warmup_connections))
+
+        # the transport used to send every request made by this client; any object with a send(prepared_request,
+        # **kwargs) method returning a requests.Response works, e.g., the RecordingTransport and ReplayTransport
+        # classes in tapy.dyna.transport. By default, requests are sent with the requests_session above.
+        self.transport = transport or SessionTransport(self.requests_session)
+
+        # the base URLs of equivalent endpoints serving the same tenants as the base_url, such as site-local gateways
+        # and a central one. Requests to any of them are routed to the healthiest, fastest endpoint by a
+        # tapy.dyna.routing.RoutingTransport wrapping the transport, and idempotent requests fail over to the others.
+        self.endpoints = endpoints
+        if endpoints:
+            if base_url.rstrip('/') not in [endpoint.rstrip('/') for endpoint in endpoints]:
+                endpoints = [base_url] + list(endpoints)
+            self.transport = RoutingTransport(endpoints, self.transport)
+
+        # an optional tapy.dyna.ratelimit.RateLimiter, or a dictionary of limits to create one from, capping the rate
+        # and number in flight of the requests this client makes, per resource and per operation, across all threads.
+        if rate_limits is not None and not isinstance(rate_limits, RateLimiter):
+            rate_limits = RateLimiter(rate_limits)
+        self.rate_limits = rate_limits
+
+        # an optional tapy.dyna.compression.Compression, or a dictionary of request body encodings ("gzip" or "zstd") by
+        # resource name to create one from. Request bodies sent to those resources are compressed above a size
+        # threshold, and all requests accept compressed responses.
+        if compression is not None and not isinstance(compression, Compression):
+            compression = Compression(compression)
+        self.compression = compression
+
+        # whether to check the arguments to every operation against the schemas in its spec before making a request,
+        # raising a tapy.errors.RequestValidationError for invalid calls instead of sending them to the service. This
+        # can also be set per call with the _tapis_validate argument.
+        self.validate_requests = validate_requests
+
+        # whether identical GET calls in flight at the same time share one request and its result; True, or a
+        # tapy.dyna.coalesce.Coalescer to share with other clients. Nothing is cached.
+        if coalesce_requests is True:
+            coalesce_requests = Coalescer()
+        self.coalesce_requests = coalesce_requests or None
+
+        # an optional tapy.dyna.scheduler.PriorityScheduler, or a dictionary of arguments to create one from, capping
+        # the number of requests in flight and reserving part of that capacity for the higher priority classes (e.g.,
+        # for interactive calls over batch sweeps). The class of a call can be set with the _tapis_priority argument.
+        if scheduler is not None and not isinstance(scheduler, PriorityScheduler):
+            scheduler = PriorityScheduler(**scheduler)
+        self.scheduler = scheduler
+
+        # an optional tapy.dyna.catalog.SystemsCatalog, True, or a dictionary of arguments to create one with, answering
+        # queries for systems by name, host, owner, etc. from a local, indexed copy of systems.getSystems that is
+        # refreshed in the background. The client's writes to a system invalidate it.
+        if systems_catalog is True:
+            systems_catalog = {}
+        if isinstance(systems_catalog, dict):
+            # avoid circular imports by nesting this import here - the catalog module imports dynatapy.
+            from tapy.dyna.catalog import SystemsCatalog
+            systems_catalog = SystemsCatalog(**systems_catalog)
+        if systems_catalog is not None and systems_catalog.client is None:
+            systems_catalog.client = self
+        self.systems_catalog = systems_catalog
+
         # use the following two parameters to set headers to make requests on behalf of a different
         # tenant_id and username.
         self.x_tenant_id = x_tenant_id
         self.x_username = x_username
 
         # whether to dowload the very latest OpenAPI v3 definition files for the services -- setting this to True
-        # could result in "live updates" to your code without warning. It also adds significant overhead to this method.
-        # Use at your own risk!
+        # could result in "live updates" to your code without warning. Use at your own risk!
         self.download_latest_specs = download_latest_specs
 
+        # the directory where downloaded spec files are cached and revalidated from, when download_latest_specs is True.
+        self.spec_cache_dir = spec_cache_dir or SPEC_CACHE_DIR
+
+        # by default, the latest specs are downloaded in a background thread while the client starts on the specs it
+        # already has, and the resources are swapped out when the download finishes. Set this to True to wait for the
+        # download in the constructor instead.
+        self.block_on_spec_download = block_on_spec_download
+
+        # exceptions raised trying to download the latest specs, keyed by resource name.
+        self.spec_download_errors = {}
+
+        # whether to use the resources generated ahead of time by tapy.dyna.codegen, when they have been generated and
+        # are up to date with the bundled spec files; they behave like the dynamic resources but do not require the
+        # spec files to be parsed.
+        self.use_generated_resources = use_generated_resources
+
+        self._create_resources()
+        _CLIENTS.add(self)
+
+        # the endpoints are probed with the health checks of the services.
+        if isinstance(self.transport, RoutingTransport) and not self.transport.probe_paths:
+            self.transport.probe_paths = [getattr(getattr(self, resource_name), operation_id).path
+                                          for resource_name, operation_id in HEALTH_CHECK_OPERATIONS]
+
         if self.download_latest_specs:
-            resource_specs = {resource[0]: _getspec(resource[0], resource[1], download_spec=True)
-                              for resource in RESOURCES}
-        else:
-            resource_specs= RESOURCE_SPECS
+            if self.block_on_spec_download:
+                self.update_specs()
+            else:
+                threading.Thread(target=self.update_specs, daemon=True).start()
 
-        # create resources for each API defined above. In the future we could make this more dynamic in multiple ways.
-        for resource_name, spec in resource_specs.items():
-            # each API is a top-level attribute on the DynaTapy object, a Resource object constructed as follows:
-            setattr(self, resource_name, Resource(resource_name, spec.paths, self))
+        if self.warmup_connections and self.base_url and hasattr(self.transport, 'warmup'):
+            warmup = threading.Thread(target=self.transport.warmup, args=(self.base_url, self.warmup_connections),
+                                      kwargs={'verify': self.verify}, daemon=True)
+            warmup.start()
+            # the first request waits for the connections to be opened, but for no longer than the warmup timeout; an
+            # unreachable server is then found out by the request itself.
+            warmup.join(getattr(self.transport, 'warmup_timeout', 5))
 
         # if the user passed just base_url, try to get the list of tenants and derive the tenant_id from it.
         if base_url and not tenant_id:
@@ -168,14 +537,202 @@ class DynaTapy(object):
                 self.x_tenant_id = self.tenant_id
                 self.x_username = self.username
 
+        self._start_secret_prefetch()
+
+    def _create_resources(self, operation_tables=None):
+        """
+        Create the Resource objects for this client from the specs already loaded in this process.
+        :param operation_tables: (dict) The OperationDescriptions of the operations of resources to create without
+        their specs, by operation id, keyed by resource name; see tapy.dyna.snapshot.
+        """
+        operation_tables = operation_tables or {}
+        latest_specs = {}
+        if self.download_latest_specs:
+            # start on the latest specs any client in this process has already downloaded, if any, or else on those
+            # cached on disk by an earlier download.
+            load_cached_specs(self.spec_cache_dir)
+            latest_specs = {resource_name: spec for resource_name, (_, spec) in LATEST_SPECS.items()}
+        generated = _generated_resources() if self.use_generated_resources else {}
+
+        # create resources for each API defined above. In the future we could make this more dynamic in multiple ways.
+        for resource_name, _ in RESOURCES:
+            # each API is a top-level attribute on the DynaTapy object: the resource generated ahead of time from the
+            # bundled spec, if there is one, or a Resource object built from the spec.
+            if resource_name in operation_tables:
+                resource = _static_resource_class(resource_name, operation_tables[resource_name])(self)
+            elif resource_name in latest_specs:
+                resource = Resource(resource_name, latest_specs[resource_name].paths, self)
+            elif resource_name in generated:
+                resource = generated[resource_name](self)
+            else:
+                resource = Resource(resource_name, RESOURCE_SPECS[resource_name].paths, self)
+            setattr(self, resource_name, resource)
+
+    # attributes that make up the state of a pickled client; everything else, such as the resources, the requests
+    # session and the tokens, is rebuilt when the client is unpickled.
+    STATE_ATTRIBUTES = ('base_url', 'username', 'password', 'tenant_id', 'account_type', 'jwt', 'verify',
+                        'service_password', 'client_id', 'client_key', 'x_tenant_id', 'x_username',
+                        'download_latest_specs', 'spec_cache_dir', 'block_on_spec_download', 'token_cache',
+                        'secret_cache', 'prefetch_secrets', 'rate_limits', 'warmup_connections',
+                        'use_generated_resources', 'compression', 'validate_requests', 'endpoints',
+                        'coalesce_requests', 'scheduler', 'systems_catalog', )
+
+    def __getstate__(self):
+        """
+        Returns the compact, picklable state of the client: its configuration, identity and tokens. The default
+        transport is not included, so every unpickled client gets its own connection pool.
+        """
+        state = {attr: getattr(self, attr, None) for attr in self.STATE_ATTRIBUTES}
+        state['access_token'] = _token_to_dict(self.access_token, 'access_token')
+        state['refresh_token'] = _token_to_dict(self.refresh_token, 'refresh_token')
+        if not isinstance(self.transport, SessionTransport):
+            state['transport'] = self.transport
+        return state
+
+    def __setstate__(self, state):
+        """
+        Restore a pickled client. The resources are created from the specs already loaded in this process and no
+        requests are made.
+        """
+        access_token = state.pop('access_token', None)
+        refresh_token = state.pop('refresh_token', None)
+        transport = state.pop('transport', None)
+        operation_tables = state.pop('operation_tables', None)
+        self.__dict__.update(state)
+        self.requests_session = requests.Session()
+        self.transport = transport or SessionTransport(self.requests_session)
+        self.spec_download_errors = {}
+        self.secret_prefetch_errors = []
+        self._secret_prefetch = None
+        self._token_call = threading.local()
+        self.access_token = None
+        self.refresh_token = None
+        if access_token:
+            self.set_access_token(TapisResult(**access_token))
+        if refresh_token:
+            self.set_refresh_token(TapisResult(**refresh_token))
+        self._create_resources(operation_tables)
+        if getattr(self, 'systems_catalog', None) is not None and self.systems_catalog.client is None:
+            self.systems_catalog.client = self
+        _CLIENTS.add(self)
+
+    def _reset_connections(self):
+        """
+        Replace the connection pool of this client with a new, empty one. Called in the child process after a fork,
+        since the sockets in a pool inherited from the parent are shared with it.
+        """
+        self.requests_session = requests.Session()
+        if isinstance(self.transport, SessionTransport):
+            self.transport = SessionTransport(self.requests_session)
+        elif hasattr(self.transport, 'reset'):
+            self.transport.reset()
+
+    def update_specs(self):
+        """
+        Download the latest spec files and replace the resources on this client whose specs have changed. Each
+        resource is swapped with a single attribute assignment, so calls in flight on other threads are not affected.
+        :return: (list) The names of the resources that were updated.
+        """
+        _, self.spec_download_errors = refresh_latest_specs(cache_dir=self.spec_cache_dir)
+        # compare against LATEST_SPECS rather than just the specs changed by this refresh, since another client in
+        # this process may have downloaded newer specs after this client was constructed.
+        updated = []
+        for resource_name, (_, spec) in list(LATEST_SPECS.items()):
+            if getattr(self, resource_name).resource_spec is not spec.paths:
+                setattr(self, resource_name, Resource(resource_name, spec.paths, self))
+                updated.append(resource_name)
+        return updated
+
     def get_tokens(self, **kwargs):
         """
         Convenience wrapper to get either service tokens (tokengen Tokens API) or user tokens (Authenticator/OAuth2 API)
         based on the account_type on this client instance.
         """
         if self.account_type == 'service':
-            return self.get_service_tokens(**kwargs)
-        return self.get_user_tokens(**kwargs)
+            get = self.get_service_tokens
+        else:
+            get = self.get_user_tokens
+        # the cache only holds tokens for the client's own identity, so bypass it when any argument is overridden.
+        if self.token_cache and not kwargs:
+            result = self._cached_token_call(get)
+        else:
+            result = get(**kwargs)
+        # the secrets declared for prefetching can be read now that the client has a token.
+        self._start_secret_prefetch()
+        return result
+
+    def _start_secret_prefetch(self):
+        """
+        Start reading the secrets in prefetch_secrets into the secret_cache in a background thread, if the client has
+        a token to read them with and they have not been read already.
+        """
+        if self.secret_cache is None or not self.prefetch_secrets or self._secret_prefetch:
+            return
+        if not self.get_access_jwt():
+            return
+        self._secret_prefetch = threading.Thread(target=self._prefetch_secrets, daemon=True)
+        self._secret_prefetch.start()
+
+    def _prefetch_secrets(self):
+        self.secret_prefetch_errors = self.secret_cache.prefetch(self, self.prefetch_secrets)
+
+    def _token_cache_key(self):
+        """
+        Returns the key for this client's identity in the token cache.
+        """
+        return (self.base_url, self.tenant_id, self.username, self.account_type)
+
+    def _load_cached_tokens(self, key, stale_jti=None):
+        """
+        Set the tokens on this client from the token cache if the cache has an access token valid for at least the
+        next 5 seconds.
+        :param key: (tuple) The token cache key.
+        :param stale_jti: (str) The jti of an access token to disregard even if it has not expired yet.
+        :return: (bool) Whether tokens were loaded from the cache.
+        """
+        tokens = self.token_cache.get(key)
+        if not tokens or not tokens.get('access_token'):
+            return False
+        access_token = TapisResult(**tokens['access_token'])
+        if stale_jti and access_token.jti == stale_jti:
+            return False
+        expires_at = _token_expires_at(access_token)
+        if not expires_at or expires_at - datetime.datetime.now(datetime.timezone.utc) < datetime.timedelta(seconds=5):
+            return False
+        self.set_access_token(access_token)
+        self.refresh_token = None
+        if tokens.get('refresh_token'):
+            self.set_refresh_token(TapisResult(**tokens['refresh_token']))
+        return True
+
+    def _cached_token_call(self, get):
+        """
+        Get tokens through the token cache; only one client at a time, across all processes sharing the cache, calls
+        get() for a given identity while the others wait for and then use its result.
+        :param get: (callable) The method that generates new tokens and sets them on this client.
+        """
+        key = self._token_cache_key()
+        # tokens held by this client when we are asked for new ones are presumed stale -
+        stale_jti = getattr(self.access_token, 'jti', None)
+        if self._load_cached_tokens(key, stale_jti=stale_jti):
+            return
+        with self.token_cache.lock(key):
+            # another client may have stored tokens while we were waiting for the lock -
+            if self._load_cached_tokens(key, stale_jti=stale_jti):
+                return
+            self._token_call.active = True
+            try:
+                get()
+            finally:
+                self._token_call.active = False
+            self.token_cache.put(key, {'access_token': _token_to_dict(self.access_token, 'access_token'),
+                                       'refresh_token': _token_to_dict(self.refresh_token, 'refresh_token')})
+
+    def _in_token_call(self):
+        """
+        Whether the current thread is generating tokens while holding the token_cache lock.
+        """
+        return getattr(self._token_call, 'active', False)
 
 
     def get_user_tokens(self, **kwargs):
@@ -282,9 +839,12 @@ class DynaTapy(object):
         if not self.refresh_token:
             raise tapy.errors.TapyClientConfigurationError(msg="No refresh token found.")
         if self.account_type == 'service':
-            return self.refresh_service_tokens()
+            refresh = self.refresh_service_tokens
         else:
-            return self.refresh_user_tokens()
+            refresh = self.refresh_user_tokens
+        if self.token_cache:
+            return self._cached_token_call(refresh)
+        return refresh()
 
     def refresh_user_tokens(self):
         """
@@ -363,19 +923,43 @@ class DynaTapy(object):
             self.x_tenant_id = tenant_id
         self.base_url = base_url
 
-    def upload(self, source_file_path, system_id, dest_file_path, **kwargs):
+    def _send(self, request, resource_name, operation_id, priority=None, **kwargs):
         """
-        Convenience method for uploading a file at a local path to a system
+        Send a prepared request with the client's transport, once the scheduler, if any, has a slot for it, and within
+        the rate limits for the operation, if any. The request body is compressed first if the client is configured to
+        do so.
+        :param request: (requests.PreparedRequest) The request.
+        :param resource_name: (str) The resource the request is for, such as "files".
+        :param operation_id: (str) The operation the request is for.
+        :param priority: (str) The priority class of the request, if given for the call; see PriorityScheduler.
+        :param kwargs: Additional arguments to the transport's send() method.
+        :return: (requests.Response)
+        """
+        if self.compression is not None:
+            self.compression.prepare(request, resource_name, operation_id)
+        if self.scheduler is None:
+            return self._send_limited(request, resource_name, operation_id, **kwargs)
+        # the scheduler slot is taken first, so that requests waiting in its queues do not hold rate limit permits
+        # (in particular, in-flight slots) that requests of higher priority classes need.
+        with self.scheduler.slot(resource_name, operation_id, priority):
+            return self._send_limited(request, resource_name, operation_id, **kwargs)
+
+    def _send_limited(self, request, resource_name, operation_id, **kwargs):
+        """
+        Send a prepared request with the client's transport, holding a rate limit permit, if any, while it is sent.
+        """
+        if self.rate_limits is None:
+            return self.transport.send(request, verify=self.verify, **kwargs)
+        with self.rate_limits.limit(resource_name, operation_id) as permit:
+            permit.response = self.transport.send(request, verify=self.verify, **kwargs)
+            return permit.response
+
+    def _files_request_headers(self, kwargs):
+        """
+        Returns the http headers for the upload() and download() convenience methods, refreshing the access token if it
+        is about to expire.
+        :param kwargs: (dict) The arguments passed to the method; the special "headers" argument is popped from it.
         """
-        url = f'{self.base_url}/v3/files/ops/{system_id}/{dest_file_path}'
-        # check for the _tapis_debug flag for generating debug data
-        debug = False
-        if '_tapis_debug' in kwargs:
-            debug = kwargs.get('_tapis_debug', False)
-            # ignore non-boolean values for the debug flag and set it to False.
-            if not type(debug) == bool:
-                debug = False
-        # construct the http headers -
         headers = {}
         # set the X-Tapis-Token header using the client
         if self.get_access_jwt():
@@ -383,23 +967,18 @@ class DynaTapy(object):
             # plenty of time remaining.
             time_remaining = datetime.timedelta(days=10)
             try:
-                time_remaining = self.tapis_client.access_token.expires_in()
+                time_remaining = self.access_token.expires_in()
             except:
                 # it is possible the access_token does not have an expires_in attribute and/or that it is not
                 # callable. we just pass on these exceptions and do not try to refresh the token.
                 pass
-            if datetime.timedelta(seconds=5) > time_remaining:
-                # if the access token is about to expire, try to use refresh, unless this is a call to
-                # refresh (otherwise this would never terminate!)
-                if self.resource_name == 'tokens' and self.operation_id == 'refresh_token':
+            if datetime.timedelta(seconds=5) > time_remaining and not self._in_token_call():
+                try:
+                    self.refresh_tokens()
+                except:
+                    # for now, if we get an error trying to refresh the tokens,s, we ignore it and try the
+                    # request anyway.
                     pass
-                else:
-                    try:
-                        self.tapis_client.refresh_tokens()
-                    except:
-                        # for now, if we get an error trying to refresh the tokens,s, we ignore it and try the
-                        # request anyway.
-                        pass
             headers = {'X-Tapis-Token': self.get_access_jwt(), }
 
         headers['Accept'] = 'application/json'
@@ -415,37 +994,68 @@ class DynaTapy(object):
             headers.update(kwargs.pop('headers', {}))
         except ValueError:
             raise tapy.errors.InvalidInputError(msg="The headers argument, if passed, must be a dictionary-like object.")
+        return headers
 
-        r = requests.Request('POST',
-                             url,
-                             files={"file": open(source_file_path, 'rb')},
-                             headers=headers).prepare()
-        # make the request and return the response object -
+    def download(self, system_id, source_file_path, dest_file_path, chunk_size=1024 * 1024, **kwargs):
+        """
+        Convenience method for downloading a file on a system to a local path. The content is streamed to the local
+        file in chunks rather than read into memory.
+        :param system_id: (str) The system the file is on.
+        :param source_file_path: (str) The path of the file on the system.
+        :param dest_file_path: (str) The local path to write the file to.
+        :param chunk_size: (int) The number of bytes to read from the response at a time.
+        :return: (int) The number of bytes written.
+        """
+        url = f'{self.base_url}/v3/files/content/{system_id}/{source_file_path}'
+        priority = kwargs.pop('_tapis_priority', None)
+        headers = self._files_request_headers(kwargs)
+        headers['Accept'] = '*/*'
+        r = requests.Request('GET', url, headers=headers).prepare()
         try:
-            resp = self.requests_session.send(r, verify=self.verify)
+            resp = self._send(r, 'files', 'download', priority=priority, stream=True)
         except Exception as e:
-            # todo - handle different types of requests exceptions
             msg = f"Unable to make request to Tapis server. Exception: {e}"
             raise tapy.errors.BaseTapyException(msg=msg, request=r)
-        # try to get the error message and version from the Tapis request:
         try:
-            error_msg = resp.json().get('message')
-        except:
-            error_msg = resp.content
+            _raise_for_error_response(resp, r)
+            written = 0
+            with open(dest_file_path, 'wb') as f:
+                for chunk in resp.iter_content(chunk_size=chunk_size):
+                    f.write(chunk)
+                    written += len(chunk)
+            return written
+        finally:
+            resp.close()
+
+    def upload(self, source_file_path, system_id, dest_file_path, **kwargs):
+        """
+        Convenience method for uploading a file at a local path to a system
+        """
+        url = f'{self.base_url}/v3/files/ops/{system_id}/{dest_file_path}'
+        # check for the _tapis_debug flag for generating debug data
+        debug = False
+        if '_tapis_debug' in kwargs:
+            debug = kwargs.get('_tapis_debug', False)
+            # ignore non-boolean values for the debug flag and set it to False.
+            if not type(debug) == bool:
+                debug = False
+        priority = kwargs.pop('_tapis_priority', None)
+        headers = self._files_request_headers(kwargs)
+        with open(source_file_path, 'rb') as f:
+            # preparing the request reads the file into the multipart body.
+            r = requests.Request('POST',
+                                 url,
+                                 files={"file": f},
+                                 headers=headers).prepare()
+        # make the request and return the response object -
         try:
-            version = resp.json().get('version')
-        except:
-            version = None
-        # for any kind of non-20x response, we need to raise an error.
-        if resp.status_code in (400, 404):
-            raise tapy.errors.InvalidInputError(msg=error_msg, version=version, request=r, response=resp)
-        if resp.status_code in (401, 403):
-            raise tapy.errors.NotAuthorizedError(msg=error_msg, version=version, request=r, response=resp)
-        if resp.status_code in (500, ):
-            raise tapy.errors.ServerDownError(msg=error_msg, version=version, request=r, response=resp)
-        # catch-all for any other non-20x response:
-        if resp.status_code >= 300:
-            raise tapy.errors.BaseTapyException(msg=error_msg, version=version, request=r, response=resp)
+            resp = self._send(r, 'files', 'upload', priority=priority)
+        except Exception as e:
+            # todo - handle different types of requests exceptions
+            msg = f"Unable to make request to Tapis server. Exception: {e}"
+            raise tapy.errors.BaseTapyException(msg=msg, request=r)
+        # raise an error for any kind of non-20x response and get the version from the Tapis request:
+        version = _raise_for_error_response(resp, r)
 
         # generate the debug_data object
         debug_data = Debug(request=r, response=resp)
@@ -510,6 +1120,52 @@ class DynaTapy(object):
 
 
 
+# all the DynaTapy clients in this process, so that their connection pools can be reset after a fork.
+_CLIENTS = weakref.WeakSet()
+
+
+def _reset_clients_after_fork():
+    for client in list(_CLIENTS):
+        client._reset_connections()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_clients_after_fork)
+
+
+# the classes generated by tapy.dyna.codegen that can be used in place of the dynamic resources, keyed by resource name;
+# loaded on first use by _generated_resources().
+_GENERATED_RESOURCES = None
+_GENERATED_RESOURCES_LOCK = threading.Lock()
+
+
+def _generated_resources():
+    """
+    Returns the resource classes generated by tapy.dyna.codegen whose spec files have not changed since they were
+    generated, keyed by resource name; an empty dictionary if the resources have not been generated.
+    """
+    global _GENERATED_RESOURCES
+    with _GENERATED_RESOURCES_LOCK:
+        if _GENERATED_RESOURCES is None:
+            try:
+                from tapy.dyna.generated import RESOURCE_CLASSES
+            except ImportError:
+                RESOURCE_CLASSES = {}
+            resources = {}
+            for resource_name, resource_class in RESOURCE_CLASSES.items():
+                try:
+                    with open(_spec_path(resource_name), 'rb') as f:
+                        digest = hashlib.sha1(f.read()).hexdigest()
+                except OSError:
+                    # without the spec file, the generated class is all there is to go on.
+                    digest = resource_class.spec_digest
+                # a module generated from an older spec file is ignored and the dynamic resource is used instead.
+                if digest == resource_class.spec_digest:
+                    resources[resource_name] = resource_class
+            _GENERATED_RESOURCES = resources
+        return _GENERATED_RESOURCES
+
+
 class Resource(object):
     """
     Represents a top-level API "resource" defined by an OpenAPI spec file. 
@@ -547,6 +1203,117 @@ class Resource(object):
                 setattr(self, op_desc.operation_id, Operation(self.resource_name, op_desc, self.tapis_client))
 
 
+def _location(parameter):
+    """
+    Returns the location ("path", "query", ...) of an operation parameter, either an openapi_core Parameter, whose
+    location is an enum, or a ParameterDescription.
+    """
+    return getattr(parameter.location, 'value', parameter.location)
+
+
+class ParameterDescription(object):
+    """
+    Describes a parameter of an operation in a generated resource module; has the attributes of the openapi_core
+    Parameter objects used by Operation.
+    """
+    def __init__(self, name, location, required=False):
+        self.name = name
+        self.location = location
+        self.required = required
+
+
+class SchemaDescription(object):
+    """
+    Describes the schema of a request body in a generated resource module: the names of its properties and of the
+    required ones.
+    """
+    def __init__(self, properties=(), required=()):
+        self.properties = {name: None for name in properties}
+        self.required = list(required)
+
+
+class MediaTypeDescription(object):
+    """
+    Describes one content type of a request body in a generated resource module.
+    """
+    def __init__(self, properties=(), required=()):
+        self.schema = SchemaDescription(properties, required)
+
+
+class RequestBodyDescription(object):
+    """
+    Describes the request body of an operation in a generated resource module.
+    """
+    def __init__(self, content):
+        """
+        :param content: (dict) The (property names, required property names) of the body, by content type.
+        """
+        self.content = {content_type: MediaTypeDescription(*schema) for content_type, schema in content.items()}
+
+
+class OperationDescription(object):
+    """
+    Describes an operation in a generated resource module. It has the attributes of the openapi_core Operation objects
+    used by Operation, so generated and dynamic resources create and call their operations the same way.
+    """
+    def __init__(self, operation_id, http_method, path_name, parameters=(), request_body=None, schemas=None):
+        """
+        :param operation_id: (str) The operationId.
+        :param http_method: (str) The http method, such as "get".
+        :param path_name: (str) The URL template of the operation, relative to the base_url.
+        :param parameters: (list) The (name, location, required) of each parameter.
+        :param request_body: (dict) The request body; see RequestBodyDescription.
+        :param schemas: (dict) The schemas of the parameters and request body, for validation; see
+        tapy.dyna.validation.operation_schemas().
+        """
+        self.operation_id = operation_id
+        self.http_method = http_method
+        self.path_name = path_name
+        self.parameters = {name: ParameterDescription(name, location, required)
+                           for name, location, required in parameters}
+        self.request_body = RequestBodyDescription(request_body) if request_body is not None else None
+        self.schemas = schemas
+
+
+class StaticResource(Resource):
+    """
+    Base class for the resources generated ahead of time from the bundled spec files by tapy.dyna.codegen. The
+    operations of a generated resource are described by literals in its module, so no spec has to be loaded, and each
+    Operation is only created the first time it is used.
+    """
+    # set by the generated subclasses -
+    resource_name = None
+    spec_digest = None
+    operations = {}
+
+    def __init__(self, tapis_client):
+        # NOTE: Resource.__init__ is intentionally not called; there is no spec to walk.
+        self.resource_spec = None
+        self.tapis_client = tapis_client
+
+    def __getattr__(self, name):
+        # only called for operations that have not been used yet -
+        op_desc = type(self).operations.get(name)
+        if op_desc is None:
+            raise AttributeError(name)
+        operation = Operation(self.resource_name, op_desc, self.tapis_client)
+        setattr(self, name, operation)
+        return operation
+
+    def __dir__(self):
+        return sorted(set(super().__dir__()) | set(type(self).operations))
+
+
+def _static_resource_class(resource_name, operations):
+    """
+    Returns a StaticResource subclass for a resource whose operations have been described without a generated module,
+    e.g., by a snapshot of a client.
+    :param operations: (dict) The OperationDescription of each operation, by operation id.
+    """
+    return type(f'{resource_name.capitalize()}Resource', (StaticResource, ),
+                {'resource_name': resource_name, 'operations': operations})
+
+
 class Operation(object):
     """
     Represents a single operation on an API resource defined by an OpenAPI spec file.
@@ -568,10 +1335,74 @@ class Operation(object):
         # derived attributes - for convenience
         self.operation_id = op_desc.operation_id
         self.http_method = op_desc.http_method
-        self.path_parameters = [p for _, p in op_desc.parameters.items() if p.location == ParameterLocation.PATH]
-        self.query_parameters = [p for _, p in op_desc.parameters.items() if p.location == ParameterLocation.QUERY]
+        self.path_parameters = [p for _, p in op_desc.parameters.items() if _location(p) == 'path']
+        self.query_parameters = [p for _, p in op_desc.parameters.items() if _location(p) == 'query']
         self.request_body = op_desc.request_body
 
+    def bind(self, tapis_client):
+        """
+        Returns a copy of this operation that makes its requests with a different client, sharing everything derived
+        from the spec with this operation.
+        :param tapis_client: The client the copy should use.
+        """
+        op = copy.copy(self)
+        op.tapis_client = tapis_client
+        return op
+
+    @property
+    def path(self):
+        """
+        The URL template of this operation, relative to the base_url.
+        """
+        # some API definitions, such as SK, chose to not include the "/v3/" at the beginning of their paths, so we add it in:
+        if not self.op_desc.path_name.startswith('/v3/'):
+            return f'/v3{self.op_desc.path_name}'
+        return self.op_desc.path_name
+
+    @property
+    def validator(self):
+        """
+        The compiled tapy.dyna.validation.OperationValidator for this operation, shared by all of its copies.
+        """
+        return validator_for(self.op_desc)
+
+    def validate(self, **kwargs):
+        """
+        Check arguments to this operation against the schemas of its parameters and request body, without making a
+        request. Raises a tapy.errors.RequestValidationError listing every problem found.
+        :param kwargs: The arguments, as they would be passed to the operation.
+        """
+        content_type = None
+        if hasattr(self.op_desc.request_body, 'content') and hasattr(self.op_desc.request_body.content, 'keys'):
+            content_type = self._request_content_type(self.op_desc.request_body.content.keys(),
+                                                      kwargs.get('headers') or {}, kwargs)
+        self.validator.validate(kwargs, content_type, f'{self.resource_name}.{self.operation_id}')
+
+    def _request_content_type(self, content_types, headers, kwargs):
+        """
+        Choose the content type of the request body from those the operation accepts, based on the arguments passed.
+        :param content_types: The content types of the request body in the spec.
+        :param headers: (dict) The headers of the request; an explicit Content-Type header is used if it is accepted.
+        :param kwargs: (dict) The arguments passed to the operation.
+        :return: (str) The content type, or None.
+        """
+        for name, value in headers.items():
+            if name.lower() == 'content-type' and value in content_types:
+                return value
+        if 'application/octet-stream' in content_types and _is_binary_body(kwargs.get('request_body')):
+            return 'application/octet-stream'
+        if 'application/json' in content_types or '*/*' in content_types:
+            # a JSON body without defined properties is passed as request_body; otherwise, if the operation also
+            # accepts a form, its fields are passed as arguments.
+            if 'request_body' not in kwargs and 'application/x-www-form-urlencoded' in content_types \
+                    and self.op_desc.request_body.content['application/json'].schema.properties == {}:
+                return 'application/x-www-form-urlencoded'
+            return 'application/json'
+        for content_type in ('application/x-www-form-urlencoded', 'application/octet-stream', 'multipart/form-data'):
+            if content_type in content_types:
+                return content_type
+        return None
+
     def __call__(self, **kwargs):
         """
         Turns the operation object into a callable. Arguments must be passed as kwargs, where the name of each kwarg 
@@ -582,15 +1413,31 @@ class Operation(object):
          
         :return: 
         """
+        # sk calls go through the client's secret cache, if it has one, and writes to systems through its systems
+        # catalog, if it has one, unless the cache or catalog is making the call itself.
+        if kwargs.pop('_tapis_cache', True):
+            if self.resource_name == 'sk' and getattr(self.tapis_client, 'secret_cache', None) is not None:
+                return self.tapis_client.secret_cache.call(self, kwargs)
+            if self.resource_name == 'systems' and getattr(self.tapis_client, 'systems_catalog', None) is not None \
+                    and self.http_method.upper() != 'GET':
+                return self.tapis_client.systems_catalog.call(self, kwargs)
+
+        # in strict mode, invalid calls are rejected before any request is made.
+        if kwargs.pop('_tapis_validate', getattr(self.tapis_client, 'validate_requests', False)):
+            self.validate(**kwargs)
+
+        # the priority class of the call, for the client's scheduler, if it has one.
+        priority = kwargs.pop('_tapis_priority', None)
+        scheduler = getattr(self.tapis_client, 'scheduler', None)
+        if priority is not None and scheduler is not None:
+            # reject unknown classes here rather than when the request is sent.
+            scheduler.priority_for(self.resource_name, self.operation_id, priority)
+
         # the http method is defined by the operation -
         http_method = self.http_method.upper()
 
         # construct the http path -
-        # some API definitions, such as SK, chose to not include the "/v3/" at the beginning of their paths, so we add it in:
-        if not self.op_desc.path_name.startswith('/v3/'):
-            self.url = f'{self.tapis_client.base_url}/v3{self.op_desc.path_name}' # base url
-        else:
-            self.url = f'{self.tapis_client.base_url}{self.op_desc.path_name}'  # base url
+        self.url = f'{self.tapis_client.base_url}{self.path}'
         url = self.url
         for param in self.path_parameters:
             # look for the name in the kwargs
@@ -643,6 +1490,9 @@ class Operation(object):
                 # refresh (otherwise this would never terminate!)
                 if self.resource_name == 'tokens' and self.operation_id == 'refresh_token':
                     pass
+                # nor while this thread is generating tokens under the token cache lock (this is that call).
+                elif self.tapis_client._in_token_call():
+                    pass
                 else:
                     try:
                         self.tapis_client.refresh_tokens()
@@ -669,8 +1519,28 @@ class Operation(object):
         data = None
         # these are the list of allowable request body content types; ex., 'application/json'.
         if hasattr(self.op_desc.request_body, 'content') and hasattr(self.op_desc.request_body.content, 'keys'):
-            if 'application/json' in self.op_desc.request_body.content.keys() \
-                    or '*/*' in self.op_desc.request_body.content.keys():
+            content_type = self._request_content_type(self.op_desc.request_body.content.keys(), headers, kwargs)
+            if content_type == 'application/octet-stream':
+                if 'request_body' not in kwargs:
+                    raise tapy.errors.InvalidInputError(msg='request_body is a required argument.')
+                headers['Content-Type'] = 'application/octet-stream'
+                # bytes-like, file-like and iterator bodies are handed to requests as they are, so they are streamed
+                # to the server without being copied; iterators of unknown length are sent with chunked encoding.
+                data = kwargs['request_body']
+                if isinstance(data, memoryview):
+                    data = data.cast('B')
+                elif isinstance(data, str):
+                    data = data.encode('utf-8')
+            elif content_type == 'application/x-www-form-urlencoded':
+                schema = self.op_desc.request_body.content['application/x-www-form-urlencoded'].schema
+                data = {}
+                for p_name in schema.properties.keys():
+                    if p_name in kwargs:
+                        data[p_name] = kwargs[p_name]
+                    elif p_name in schema.required:
+                        raise tapy.errors.InvalidInputError(msg=f'{p_name} is a required argument.')
+                # requests form-encodes the dictionary and sets the Content-Type header.
+            elif content_type in ('application/json', '*/*'):
                 headers['Content-Type'] = 'application/json'
                 required_fields = self.op_desc.request_body.content['application/json'].schema.required
                 data = {}
@@ -687,7 +1557,7 @@ class Operation(object):
                             raise tapy.errors.InvalidInputError(msg=f'{p_name} is a required argument.')
                     # serialize data before passing it to the request
                 data = json.dumps(data)
-            if 'multipart/form-data' in self.op_desc.request_body.content.keys():
+            elif content_type == 'multipart/form-data':
                 # todo - iterate over parts in self.op_desc.request_body.content['multipart/form-data'].schema.properties
                 raise NotImplementedError
         # todo - handle other body content types..
@@ -713,32 +1583,28 @@ class Operation(object):
                 # set the object on the request
                 basic_auth_header(r)
 
+        # identical GETs in flight at the same time share one request and its result, if the client coalesces them.
+        coalescer = getattr(self.tapis_client, 'coalesce_requests', None)
+        if coalescer is not None and http_method == 'GET' and not debug:
+            return coalescer.call(r, lambda: self._call(r, debug, priority))
+        return self._call(r, debug, priority)
+
+    def _call(self, r, debug, priority=None):
+        """
+        Send the prepared request for a call to this operation and return the result.
+        :param r: (requests.PreparedRequest) The request.
+        :param debug: (bool) Whether to return the debug data along with the result.
+        :param priority: (str) The priority class of the call, if given.
+        """
         # make the request and return the response object -
         try:
-            resp = self.tapis_client.requests_session.send(r, verify=self.tapis_client.verify)
+            resp = self.tapis_client._send(r, self.resource_name, self.operation_id, priority=priority)
         except Exception as e:
             # todo - handle different types of requests exceptions
             msg = f"Unable to make request to Tapis server. Exception: {e}"
             raise tapy.errors.BaseTapyException(msg=msg, request=r)
-        # try to get the error message and version from the Tapis request:
-        try:
-            error_msg = resp.json().get('message')
-        except:
-            error_msg = resp.content
-        try:
-            version = resp.json().get('version')
-        except:
-            version = None
-        # for any kind of non-20x response, we need to raise an error.
-        if resp.status_code in (400, 404):
-            raise tapy.errors.InvalidInputError(msg=error_msg, version=version, request=r, response=resp)
-        if resp.status_code in (401, 403):
-            raise tapy.errors.NotAuthorizedError(msg=error_msg, version=version, request=r, response=resp)
-        if resp.status_code in (500, ):
-            raise tapy.errors.ServerDownError(msg=error_msg, version=version, request=r, response=resp)
-        # catch-all for any other non-20x response:
-        if resp.status_code >= 300:
-            raise tapy.errors.BaseTapyException(msg=error_msg, version=version, request=r, response=resp)
+        # raise an error for any kind of non-20x response and get the version from the Tapis request:
+        version = _raise_for_error_response(resp, r)
 
         # generate the debug_data object
         debug_data = Debug(request=r, response=resp)
@@ -850,6 +1716,17 @@ class TapisResult(object):
         return str(self)
 
 
+def _to_dict(obj):
+    """
+    Convert a (possibly nested) TapisResult back to the JSON-serializable structure it was built from.
+    """
+    if isinstance(obj, TapisResult):
+        return {k: _to_dict(v) for k, v in vars(obj).items()}
+    if isinstance(obj, (list, tuple)):
+        return [_to_dict(item) for item in obj]
+    return obj
+
+
 class Debug(object):
     """
     Debug data for an API request.
@@ -0,0 +1,211 @@
+"""
+Helpers for driving Abaco actors at scale: sending many messages concurrently and waiting for the resulting executions.
+
+ActorMessenger sends messages with actors.sendMessage from a thread pool, with a bound on the number of messages in
+flight, and returns an ExecutionHandle for each one. ExecutionWaiter tracks any number of executions from a single
+scheduler thread, polling actors.getExecution with intervals that back off (with jitter) while an execution's status is
+not changing, and fetches the execution logs once an execution has finished.
+"""
+from concurrent.futures import Future, ThreadPoolExecutor
+import concurrent.futures
+import threading
+
+from tapy.dyna.polling import PollingScheduler
+
+# statuses of an execution that has finished.
+TERMINAL_STATUSES = ('COMPLETE', 'ERROR', )
+
+
+class ExecutionHandle(object):
+    """
+    Tracks a single actor execution. The future attribute is a concurrent.futures.Future that resolves to the handle
+    itself once the execution has finished (or, when not waiting on executions, once the message has been accepted),
+    or to the exception that prevented that.
+    """
+    def __init__(self, actor_id, execution_id=None):
+        # the actor the message was sent to
+        self.actor_id = actor_id
+
+        # the id of the execution; None until the message has been accepted, and for synchronous messages.
+        self.execution_id = execution_id
+
+        # the last known status of the execution
+        self.status = None
+
+        # the last execution description returned by actors.getExecution()
+        self.execution = None
+
+        # the logs of the execution, fetched once it has finished
+        self.logs = None
+
+        # the result returned by the actor, for messages sent with _abaco_synchronous
+        self.result = None
+
+        self.future = Future()
+
+    def __repr__(self):
+        return f'<ExecutionHandle {self.actor_id}/{self.execution_id}: {self.status}>'
+
+    def done(self):
+        return self.future.done()
+
+    def wait(self, timeout=None):
+        """
+        Block until the execution has finished and return the handle; raises the exception that prevented that, if any.
+        :param timeout: (float) Maximum number of seconds to wait.
+        """
+        return self.future.result(timeout=timeout)
+
+
+class ExecutionWaiter(PollingScheduler):
+    """
+    Waits for many actor executions at once from a single scheduler thread (see tapy.dyna.polling).
+
+    Each execution is polled with actors.getExecution; the polling interval backs off while the status of the execution
+    does not change and starts over when it does. Once an execution has finished, its logs are fetched, if fetch_logs
+    is set, and the future of its handle is resolved.
+    """
+    def __init__(self, client, fetch_logs=True, **kwargs):
+        """
+        :param client: (DynaTapy) The client to make requests with.
+        :param fetch_logs: (bool) Whether to fetch the logs of each execution once it has finished.
+        :param kwargs: Polling parameters; see PollingScheduler.
+        """
+        super().__init__(**kwargs)
+        self.client = client
+        self.fetch_logs = fetch_logs
+
+    def watch(self, handle):
+        """
+        Start waiting for an execution.
+        :param handle: (ExecutionHandle) A handle whose execution_id is set; see also watch_execution().
+        :return: (ExecutionHandle) The handle.
+        """
+        self.track(handle)
+        return handle
+
+    def watch_execution(self, actor_id, execution_id):
+        """
+        Start waiting for an execution by its ids.
+        :return: (ExecutionHandle) A new handle for the execution.
+        """
+        return self.watch(ExecutionHandle(actor_id, execution_id))
+
+    def wait(self, handles, timeout=None):
+        """
+        Block until all of the executions have finished, or the timeout expires.
+        :param handles: (list) ExecutionHandle objects.
+        :param timeout: (float) Maximum number of seconds to wait.
+        :return: (tuple) The lists of finished and not finished handles.
+        """
+        by_future = {handle.future: handle for handle in handles}
+        done, not_done = concurrent.futures.wait(by_future.keys(), timeout=timeout)
+        return [by_future[f] for f in done], [by_future[f] for f in not_done]
+
+    def poll(self, handle):
+        execution = self.client.actors.getExecution(actor_id=handle.actor_id, execution_id=handle.execution_id)
+        handle.execution = execution
+        handle.status = getattr(execution, 'status', None)
+        if handle.status not in TERMINAL_STATUSES:
+            return False, handle.status
+        if self.fetch_logs:
+            try:
+                handle.logs = getattr(self.client.actors.getExecutionLogs(actor_id=handle.actor_id,
+                                                                          execution_id=handle.execution_id),
+                                      'logs', None)
+            except Exception as e:
+                handle.future.set_exception(e)
+                return True, handle.status
+        handle.future.set_result(handle)
+        return True, handle.status
+
+    def failed(self, handle, exception):
+        handle.future.set_exception(exception)
+
+    def abandoned(self, handle):
+        # the waiter was closed before the execution finished; wait() raises CancelledError rather than blocking.
+        handle.future.cancel()
+
+
+class ActorMessenger(object):
+    """
+    Sends messages to actors concurrently, with at most max_in_flight sendMessage requests outstanding at a time.
+
+    If a waiter is used (the default), the future of each returned handle resolves once the execution has finished;
+    otherwise, it resolves as soon as the message has been accepted.
+    """
+    def __init__(self, client, max_in_flight=16, wait=True, waiter=None, **waiter_kwargs):
+        """
+        :param client: (DynaTapy) The client to make requests with.
+        :param max_in_flight: (int) Maximum number of messages being sent at the same time; send() blocks beyond that.
+        :param wait: (bool) Whether to wait for the executions to finish.
+        :param waiter: (ExecutionWaiter) The waiter to use; one is created, with waiter_kwargs, if not passed.
+        """
+        self.client = client
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight)
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self.waiter = None
+        if wait:
+            self.waiter = waiter or ExecutionWaiter(client, **waiter_kwargs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _send(self, handle, kwargs, synchronous):
+        try:
+            if synchronous:
+                # the actor's result is returned directly in the response; there is nothing to wait for.
+                handle.result = self.client.actors.sendMessage(actor_id=handle.actor_id, _abaco_synchronous='true',
+                                                               **kwargs)
+                handle.status = 'COMPLETE'
+                handle.future.set_result(handle)
+                return
+            result = self.client.actors.sendMessage(actor_id=handle.actor_id, **kwargs)
+        except Exception as e:
+            handle.future.set_exception(e)
+            return
+        finally:
+            self._slots.release()
+        handle.execution_id = getattr(result, 'executionId', None)
+        handle.status = 'SUBMITTED'
+        if self.waiter and handle.execution_id:
+            self.waiter.watch(handle)
+        else:
+            handle.future.set_result(handle)
+
+    def send(self, actor_id, synchronous=False, **kwargs):
+        """
+        Send a message to an actor without waiting for the response.
+        :param actor_id: (str) The actor to send the message to.
+        :param synchronous: (bool) Whether to use a synchronous execution (_abaco_synchronous); the result of the actor
+        is then available as handle.result once the future resolves.
+        :param kwargs: The arguments to actors.sendMessage(), e.g., message or request_body.
+        :return: (ExecutionHandle)
+        """
+        handle = ExecutionHandle(actor_id)
+        self._slots.acquire()
+        self._executor.submit(self._send, handle, kwargs, synchronous)
+        return handle
+
+    def send_many(self, actor_id, messages, synchronous=False):
+        """
+        Send many messages to an actor.
+        :param actor_id: (str) The actor to send the messages to.
+        :param messages: An iterable of dictionaries of arguments to actors.sendMessage(); it is consumed lazily, as
+        the number of messages in flight allows.
+        :param synchronous: (bool) Whether to use synchronous executions.
+        :return: (list) An ExecutionHandle for each message, in order.
+        """
+        return [self.send(actor_id, synchronous=synchronous, **message) for message in messages]
+
+    def close(self):
+        """
+        Wait for the messages being sent, and stop waiting for executions; the futures of the executions that have not
+        finished yet are cancelled.
+        """
+        self._executor.shutdown(wait=True)
+        if self.waiter:
+            self.waiter.close()
@@ -0,0 +1,171 @@
+"""
+A scheduler for polling the state of many long-running Tapis objects (actor executions, transfer tasks, etc.) at once.
+
+Rather than running one polling loop per object, a PollingScheduler keeps all of the objects it is tracking in a heap
+ordered by the time of their next poll and uses a single thread to dispatch the polls that are due to a small thread
+pool. The interval between polls of an object adapts to it: it starts at min_interval, is multiplied by backoff up to
+max_interval while the object's state is not changing, and starts over when the state changes. Every interval is
+randomized by +/- jitter (a fraction) so that objects submitted together are not polled in lock step.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import heapq
+import itertools
+import random
+import threading
+import time
+
+
+class _Entry(object):
+    """
+    The polling state of one tracked item.
+    """
+    def __init__(self, item, interval):
+        self.item = item
+        self.interval = interval
+        self.state = None
+        self.errors = 0
+
+
+class PollingScheduler(object):
+    """
+    Base class for polling many items from a single scheduler thread. Subclasses implement poll(), and can override
+    failed() to handle items that could not be polled max_errors times in a row, and abandoned() to handle items still
+    being tracked when the scheduler is closed.
+    """
+    def __init__(self, min_interval=0.5, max_interval=30, backoff=1.5, jitter=0.2, max_in_flight=8, max_errors=5):
+        """
+        :param min_interval: (float) Initial number of seconds between polls of an item.
+        :param max_interval: (float) Maximum number of seconds between polls of an item.
+        :param backoff: (float) Factor the interval grows by while the state of an item does not change.
+        :param jitter: (float) Fraction of each interval to randomize by.
+        :param max_in_flight: (int) Maximum number of polls made concurrently.
+        :param max_errors: (int) Number of consecutive failed polls after which an item is given up on.
+        """
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.jitter = jitter
+        self.max_errors = max_errors
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight)
+        # heap of (next poll time, sequence number, entry); the sequence number breaks ties between equal times.
+        self._schedule = []
+        self._sequence = itertools.count()
+        # the entries of the items being tracked, whether they are waiting for a poll or being polled.
+        self._entries = set()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def poll(self, item):
+        """
+        Poll an item once. Must be implemented by subclasses.
+        :param item: The item being tracked.
+        :return: (tuple) Whether the item is finished (and should no longer be polled), and its current state, which is
+        compared with the previous one to adapt the polling interval.
+        """
+        raise NotImplementedError
+
+    def next_interval(self, item, previous_state, state, interval):
+        """
+        Returns the number of seconds until the next poll of an item, before jitter. Subclasses can override this to
+        adapt the interval to the item; by default, it starts over at min_interval when the state of the item changed,
+        and is multiplied by backoff, up to max_interval, when it did not.
+        :param previous_state: The state of the item at the previous poll.
+        :param state: The state of the item returned by poll().
+        :param interval: (float) The interval before this poll.
+        """
+        if state != previous_state:
+            return self.min_interval
+        return min(interval * self.backoff, self.max_interval)
+
+    def failed(self, item, exception):
+        """
+        Called when polling an item failed max_errors times in a row; the item is no longer polled.
+        """
+        pass
+
+    def abandoned(self, item):
+        """
+        Called by close() for each item still being tracked; the item is no longer polled.
+        """
+        pass
+
+    def track(self, item):
+        """
+        Start polling an item.
+        """
+        entry = _Entry(item, self.min_interval)
+        with self._condition:
+            if self._closed:
+                raise RuntimeError(f'The {type(self).__name__} has been closed.')
+            self._entries.add(entry)
+        self._push(entry)
+
+    def _untrack(self, entry):
+        with self._condition:
+            self._entries.discard(entry)
+
+    def _push(self, entry):
+        delay = entry.interval * (1 + random.uniform(-self.jitter, self.jitter))
+        with self._condition:
+            heapq.heappush(self._schedule, (time.monotonic() + delay, next(self._sequence), entry))
+            if not self._thread:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._closed and (not self._schedule or self._schedule[0][0] > time.monotonic()):
+                    timeout = self._schedule[0][0] - time.monotonic() if self._schedule else None
+                    self._condition.wait(timeout=timeout)
+                if self._closed:
+                    return
+                now = time.monotonic()
+                due = []
+                while self._schedule and self._schedule[0][0] <= now:
+                    due.append(heapq.heappop(self._schedule)[2])
+            for entry in due:
+                self._executor.submit(self._poll, entry)
+
+    def _poll(self, entry):
+        if self._closed:
+            return
+        try:
+            finished, state = self.poll(entry.item)
+        except Exception as e:
+            entry.errors += 1
+            if entry.errors >= self.max_errors:
+                self._untrack(entry)
+                self.failed(entry.item, e)
+                return
+            entry.interval = min(entry.interval * self.backoff, self.max_interval)
+            self._push(entry)
+            return
+        entry.errors = 0
+        if finished:
+            self._untrack(entry)
+            return
+        entry.interval = self.next_interval(entry.item, entry.state, state, entry.interval)
+        entry.state = state
+        self._push(entry)
+
+    def close(self):
+        """
+        Stop polling, and call abandoned() for each item still being tracked.
+        """
+        with self._condition:
+            self._closed = True
+            entries = list(self._entries)
+            self._entries.clear()
+            self._condition.notify()
+        self._executor.shutdown(wait=False)
+        for entry in entries:
+            self.abandoned(entry.item)
@@ -0,0 +1,182 @@
+"""
+A pool of lightweight DynaTapy client views for services that make requests on behalf of many tenants and users.
+
+Rather than calling set_tenant() on a shared client, or constructing a new DynaTapy for each tenant, a service hands
+out views from a DynaTapyPool. Each view has its own tenant_id, base_url and X-Tapis-Tenant/X-Tapis-User identity, but
+shares the connection pool, tokens and operation registry of the client the pool was created with, so creating a view
+involves no spec processing or network requests and views can be used concurrently from different threads.
+"""
+from collections import OrderedDict
+import threading
+import time
+
+import tapy.errors
+from tapy.dyna.dynatapy import DynaTapy, Operation, Resource
+
+
+class ResourceView(object):
+    """
+    A resource whose operations are bound to a client view. Operations are bound on first use and then reused.
+    """
+    def __init__(self, resource, tapis_client):
+        self.resource = resource
+        self.resource_name = resource.resource_name
+        self.resource_spec = resource.resource_spec
+        self.tapis_client = tapis_client
+
+    def __getattr__(self, name):
+        value = getattr(self.resource, name)
+        if isinstance(value, Operation):
+            value = value.bind(self.tapis_client)
+            setattr(self, name, value)
+        return value
+
+
+class DynaTapyView(DynaTapy):
+    """
+    A DynaTapy client for a specific tenant and user that delegates everything but its identity to another client.
+    """
+    def __init__(self, client, tenant_id, base_url, x_username=None):
+        """
+        :param client: (DynaTapy) The client to share the connection pool, tokens and resources of.
+        :param tenant_id: (str) The tenant the view should interact with.
+        :param base_url: (str) The base_url of the tenant.
+        :param x_username: (str) For service clients, the user to make requests on behalf of.
+        """
+        # NOTE: DynaTapy.__init__ is intentionally not called.
+        self.client = client
+        self.tenant_id = tenant_id
+        self.base_url = base_url
+        self.x_tenant_id = client.x_tenant_id
+        self.x_username = client.x_username
+        if client.account_type == 'service':
+            self.x_tenant_id = tenant_id
+            self.x_username = x_username or client.username
+        elif x_username:
+            self.x_username = x_username
+        # the systems catalog of the client holds the systems of the client's tenant, so it is not shared with views
+        # of other tenants, and writes made through the view do not invalidate it.
+        self.systems_catalog = None
+        self._resource_views = {}
+        self.last_used = time.monotonic()
+
+    def __getattr__(self, name):
+        # only called for attributes not set on the view itself -
+        client = self.__dict__.get('client')
+        if client is None:
+            raise AttributeError(name)
+        value = getattr(client, name)
+        if isinstance(value, Resource):
+            view = self._resource_views.get(name)
+            # the client may have swapped in a new resource since the view was created (see update_specs()).
+            if view is None or view.resource is not value:
+                view = ResourceView(value, self)
+                self._resource_views[name] = view
+            return view
+        return value
+
+    def __getstate__(self):
+        return {'client': self.client, 'tenant_id': self.tenant_id, 'base_url': self.base_url,
+                'x_username': self.x_username}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    # tokens belong to the shared client, so getting, refreshing and setting them is delegated to it.
+    def get_tokens(self, **kwargs):
+        return self.client.get_tokens(**kwargs)
+
+    def refresh_tokens(self):
+        return self.client.refresh_tokens()
+
+    def set_access_token(self, token):
+        return self.client.set_access_token(token)
+
+    def set_refresh_token(self, token):
+        return self.client.set_refresh_token(token)
+
+    def set_jwt(self, jwt):
+        return self.client.set_jwt(jwt)
+
+    def update_specs(self):
+        return self.client.update_specs()
+
+    def _reset_connections(self):
+        return self.client._reset_connections()
+
+
+class DynaTapyPool(object):
+    """
+    Hands out DynaTapyView objects keyed by (tenant_id, x_username), keeping at most max_size of them and discarding
+    views that have not been used for idle_timeout seconds.
+    """
+    def __init__(self, client, max_size=128, idle_timeout=600):
+        """
+        :param client: (DynaTapy) The client whose connection pool, tokens and resources the views share.
+        :param max_size: (int) The maximum number of views to keep; the least recently used ones are discarded first.
+        :param idle_timeout: (float) Number of seconds after which an unused view is discarded.
+        """
+        self.client = client
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self._views = OrderedDict()
+        self._lock = threading.Lock()
+        # the base_url of each tenant, from the Tenants API; looked up once and again only for unknown tenants.
+        self._tenant_base_urls = {}
+        self._tenants_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._views)
+
+    def _tenant_base_url(self, tenant_id):
+        base_url = self._tenant_base_urls.get(tenant_id)
+        if base_url:
+            return base_url
+        with self._tenants_lock:
+            if tenant_id not in self._tenant_base_urls:
+                self._tenant_base_urls = {t.tenant_id: t.base_url for t in self.client.tenants.list_tenants()}
+        try:
+            return self._tenant_base_urls[tenant_id]
+        except KeyError:
+            raise tapy.errors.InvalidInputError(msg=f"Unknown tenant: {tenant_id}.")
+
+    def _evict_idle(self, now):
+        # the views are ordered from least to most recently used, so the idle ones are at the front.
+        while self._views:
+            key, view = next(iter(self._views.items()))
+            if now - view.last_used < self.idle_timeout:
+                break
+            del self._views[key]
+
+    def get(self, tenant_id, x_username=None, base_url=None):
+        """
+        Returns the view for a tenant and user, creating it if needed.
+        :param tenant_id: (str) The tenant to interact with.
+        :param x_username: (str) For service clients, the user to make requests on behalf of.
+        :param base_url: (str) The base_url of the tenant; looked up with the Tenants API if not passed.
+        :return: (DynaTapyView)
+        """
+        key = (tenant_id, x_username)
+        now = time.monotonic()
+        with self._lock:
+            self._evict_idle(now)
+            view = self._views.get(key)
+            if view:
+                self._views.move_to_end(key)
+                view.last_used = now
+                return view
+        view = DynaTapyView(self.client, tenant_id, base_url or self._tenant_base_url(tenant_id), x_username=x_username)
+        with self._lock:
+            # another thread may have created the same view in the meantime; keep theirs.
+            view = self._views.setdefault(key, view)
+            self._views.move_to_end(key)
+            while len(self._views) > self.max_size:
+                self._views.popitem(last=False)
+        return view
+
+    def clear(self):
+        """
+        Discard all the views in the pool.
+        """
+        with self._lock:
+            self._views.clear()
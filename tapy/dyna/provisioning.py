@@ -0,0 +1,272 @@
+"""
+Declarative, bulk provisioning of Security Kernel (SK) roles, permissions and user assignments.
+
+A Provisioner takes the desired state of a project -- its roles with their descriptions and permissions, and its users
+with their roles and permissions -- and fetches the current state of those roles and users from SK concurrently
+(sk.getRoleNames, sk.getRoleByName, sk.getRolePermissions, sk.getUserRoles and sk.getUserPerms). It then plans only
+the calls needed to reach the desired state and makes them from a thread pool, retrying the calls that fail with a
+transient error. Roles are created before anything that uses them, and the calls that need a role whose creation
+failed are skipped.
+
+The desired state is a dictionary, e.g., loaded from a JSON or YAML file:
+    {"roles": {"proj_admin": {"description": "Project admins", "permissions": ["files:tenant:*:proj-sys"]}},
+     "users": {"jdoe": {"roles": ["proj_admin"], "permissions": ["meta:tenant:GET:proj-db"]}}}
+
+Nothing is removed unless prune is set, and then only from the roles and users in the desired state: permissions
+assigned directly to a declared role but not declared for it are removed, and declared roles assigned to a declared
+user but not declared for the user are revoked. Permissions granted to users are never revoked, since SK only reports
+them together with the permissions users hold through their roles.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import concurrent.futures
+import threading
+import time
+
+import tapy.errors
+from tapy.dyna.ratelimit import retry_after
+
+# the phases of a plan: the roles are created first, since the other calls need them.
+CREATE_ROLES = 0
+ASSIGN = 1
+
+
+def _names(result):
+    """
+    Returns the names in a result of an SK operation returning a name array, such as sk.getRoleNames.
+    """
+    return set(getattr(result, 'names', None) or [])
+
+
+def _is_transient(exception):
+    """
+    Determine whether a failed call is worth retrying.
+    """
+    if isinstance(exception, (tapy.errors.ServerDownError, tapy.errors.TooManyRequestsError)):
+        return True
+    # the requests exceptions (connection errors, timeouts) and unexpected statuses are raised as the base class.
+    if type(exception) is tapy.errors.BaseTapyException:
+        return exception.response is None or exception.response.status_code in (502, 504)
+    return False
+
+
+class ProvisioningAction(object):
+    """
+    A single SK call of a provisioning plan.
+    """
+    def __init__(self, operation_id, arguments, phase=ASSIGN, roles=()):
+        # the sk operation to call, e.g., "grantRole", and the arguments to call it with.
+        self.operation_id = operation_id
+        self.arguments = arguments
+
+        # CREATE_ROLES or ASSIGN
+        self.phase = phase
+
+        # the roles the call needs to exist; it is skipped if one of them could not be created.
+        self.roles = set(roles)
+
+    def __repr__(self):
+        arguments = ', '.join(f'{k}={v!r}' for k, v in self.arguments.items() if k != 'tenant')
+        return f'<ProvisioningAction {self.operation_id}({arguments})>'
+
+
+class ProvisioningResult(object):
+    """
+    The outcome of Provisioner.run(): the actions planned, those completed, those that failed with their exceptions,
+    and those skipped because a role they need could not be created.
+    """
+    def __init__(self, actions, dry_run=False):
+        self.actions = actions
+        self.dry_run = dry_run
+        self.completed = []
+        self.errors = []
+        self.skipped = []
+        self.retries = 0
+        self.elapsed = 0
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f'<ProvisioningResult {self.stats()}>'
+
+    def _retried(self):
+        with self._lock:
+            self.retries += 1
+
+    def stats(self):
+        counts = {}
+        for action in self.actions:
+            counts[action.operation_id] = counts.get(action.operation_id, 0) + 1
+        return {'planned': counts,
+                'completed': len(self.completed),
+                'errors': len(self.errors),
+                'skipped': len(self.skipped),
+                'retries': self.retries,
+                'elapsed': self.elapsed}
+
+
+class Provisioner(object):
+    """
+    Brings the SK roles, permissions and user assignments of a tenant to a desired state, with concurrent calls.
+    """
+    def __init__(self, client, roles=None, users=None, tenant=None, user=None, prune=False, workers=8, retries=3,
+                 backoff=0.5):
+        """
+        :param client: (DynaTapy) The client to make requests with.
+        :param roles: (dict) The desired roles, by name: {"description": str, "permissions": [permSpec, ...]}; both
+        keys are optional.
+        :param users: (dict) The desired users, by name: {"roles": [roleName, ...], "permissions": [permSpec, ...]}.
+        :param tenant: (str) The tenant of the roles and users; defaults to the client's tenant.
+        :param user: (str) The user making the changes, as required by SK in the role requests; defaults to the
+        client's x_username or username.
+        :param prune: (bool) Whether to remove undeclared permissions from the declared roles and revoke undeclared
+        declared roles from the declared users.
+        :param workers: (int) The number of SK calls made concurrently.
+        :param retries: (int) The number of times a call failing with a transient error (a connection error, a
+        timeout, or a 429, 500, 502, 503 or 504 response) is retried.
+        :param backoff: (float) The number of seconds before the first retry of a call, doubled for every retry,
+        unless the response asks for a longer wait.
+        """
+        self.client = client
+        self.roles = {name: dict(role or {}) for name, role in (roles or {}).items()}
+        self.users = {name: dict(user_state or {}) for name, user_state in (users or {}).items()}
+        self.tenant = tenant or client.tenant_id
+        self.user = user or client.x_username or client.username
+        self.prune = prune
+        self.workers = workers
+        self.retries = retries
+        self.backoff = backoff
+
+    def _call(self, operation_id, result=None, **kwargs):
+        """
+        Call an sk operation, retrying transient errors.
+        :param result: (ProvisioningResult) The result to count the retries in, if any.
+        """
+        operation = getattr(self.client.sk, operation_id)
+        attempt = 0
+        while True:
+            try:
+                return operation(**kwargs)
+            except Exception as e:
+                if attempt >= self.retries or not _is_transient(e):
+                    raise
+                delay = self.backoff * 2 ** attempt
+                if e.response is not None:
+                    delay = max(delay, retry_after(e.response) or 0)
+                attempt += 1
+                if result is not None:
+                    result._retried()
+                time.sleep(delay)
+
+    def current_state(self):
+        """
+        Fetch the current state of the declared roles and users, concurrently.
+        :return: (dict) The names of the existing roles ("roles"), and, by name, the descriptions ("descriptions")
+        and direct permissions ("role_permissions") of the declared roles that exist, and the roles ("user_roles") and
+        permissions ("user_permissions") of the declared users.
+        """
+        existing = _names(self._call('getRoleNames', tenant=self.tenant))
+        declared = [name for name in self.roles if name in existing]
+        described = [name for name in declared if 'description' in self.roles[name]]
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            descriptions = executor.map(lambda name: getattr(self._call('getRoleByName', roleName=name,
+                                                                        tenant=self.tenant), 'description', None),
+                                        described)
+            role_permissions = executor.map(lambda name: _names(self._call('getRolePermissions', roleName=name,
+                                                                           tenant=self.tenant, immediate=True)),
+                                            declared)
+            user_roles = executor.map(lambda name: _names(self._call('getUserRoles', user=name, tenant=self.tenant)),
+                                      self.users)
+            with_permissions = [name for name in self.users if self.users[name].get('permissions')]
+            user_permissions = executor.map(lambda name: _names(self._call('getUserPerms', user=name,
+                                                                           tenant=self.tenant)),
+                                            with_permissions)
+            return {'roles': existing,
+                    'descriptions': dict(zip(described, descriptions)),
+                    'role_permissions': dict(zip(declared, role_permissions)),
+                    'user_roles': dict(zip(self.users, user_roles)),
+                    'user_permissions': dict(zip(with_permissions, user_permissions))}
+
+    def plan(self, current=None):
+        """
+        Plan the SK calls that bring the current state to the desired state.
+        :param current: (dict) The current state, as returned by current_state(); fetched if not passed.
+        :return: (list) The ProvisioningActions, in the order they are started.
+        """
+        if current is None:
+            current = self.current_state()
+        actions = []
+        for name, role in self.roles.items():
+            identity = {'tenant': self.tenant, 'user': self.user}
+            if name not in current['roles']:
+                actions.append(ProvisioningAction('createRole', dict(identity, roleName=name,
+                                                                     description=role.get('description', name)),
+                                                  phase=CREATE_ROLES))
+            elif 'description' in role and current['descriptions'].get(name) != role['description']:
+                actions.append(ProvisioningAction('updateRoleDescription', dict(identity, roleName=name,
+                                                                                description=role['description'])))
+            permissions = set(role.get('permissions') or [])
+            existing = current['role_permissions'].get(name, set())
+            for perm_spec in sorted(permissions - existing):
+                actions.append(ProvisioningAction('addRolePermission', dict(identity, roleName=name,
+                                                                            permSpec=perm_spec), roles=[name]))
+            if self.prune:
+                for perm_spec in sorted(existing - permissions):
+                    actions.append(ProvisioningAction('removeRolePermission', dict(identity, roleName=name,
+                                                                                   permSpec=perm_spec)))
+        for name, user_state in self.users.items():
+            roles = set(user_state.get('roles') or [])
+            existing = current['user_roles'].get(name, set())
+            for role_name in sorted(roles - existing):
+                actions.append(ProvisioningAction('grantRole', {'tenant': self.tenant, 'user': name,
+                                                                'roleName': role_name}, roles=[role_name]))
+            if self.prune:
+                for role_name in sorted((existing & set(self.roles)) - roles):
+                    actions.append(ProvisioningAction('revokeUserRole', {'tenant': self.tenant, 'user': name,
+                                                                         'roleName': role_name}))
+            permissions = set(user_state.get('permissions') or [])
+            for perm_spec in sorted(permissions - current['user_permissions'].get(name, set())):
+                actions.append(ProvisioningAction('grantUserPermission', {'tenant': self.tenant, 'user': name,
+                                                                          'permSpec': perm_spec}))
+        return actions
+
+    def run(self, dry_run=False):
+        """
+        Provision the desired state.
+        :param dry_run: (bool) Only fetch the current state and plan the actions; nothing is changed.
+        :return: (ProvisioningResult)
+        """
+        started = time.monotonic()
+        result = ProvisioningResult(self.plan(), dry_run=dry_run)
+        if not dry_run:
+            failed_roles = set()
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                for phase in (CREATE_ROLES, ASSIGN):
+                    futures = {}
+                    for action in result.actions:
+                        if action.phase != phase:
+                            continue
+                        if action.roles & failed_roles:
+                            result.skipped.append(action)
+                            continue
+                        futures[executor.submit(self._call, action.operation_id, result, **action.arguments)] = action
+                    for future in concurrent.futures.as_completed(futures):
+                        action = futures[future]
+                        try:
+                            future.result()
+                        except Exception as e:
+                            result.errors.append((action, e))
+                            if action.operation_id == 'createRole':
+                                failed_roles.add(action.arguments['roleName'])
+                            continue
+                        result.completed.append(action)
+        result.elapsed = time.monotonic() - started
+        return result
+
+
+def provision(client, desired, dry_run=False, **kwargs):
+    """
+    Bring the SK roles, permissions and user assignments of a tenant to a desired state; see Provisioner for the
+    parameters.
+    :param desired: (dict) The desired "roles" and "users".
+    :return: (ProvisioningResult)
+    """
+    return Provisioner(client, desired.get('roles'), desired.get('users'), **kwargs).run(dry_run=dry_run)
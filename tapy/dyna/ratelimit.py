@@ -0,0 +1,219 @@
+"""
+Client-side rate limiting and concurrency control for the requests a DynaTapy client makes.
+
+A RateLimiter holds a Limit for each resource ("files", "actors", ...) and, optionally, for individual operations
+("actors.sendMessage"). Each Limit combines a token bucket, which caps the rate of requests, with a semaphore, which
+caps the number of requests in flight. Limits are shared by all of the threads using a client (and by the views of a
+DynaTapyPool), so the aggregate load on each service stays within the configured bounds.
+
+Limits adapt to the services: when a service answers 429 (Too Many Requests) or 503 (Service Unavailable), the rate
+of the limit is cut (multiplicatively) and requests are paused for the time given in the Retry-After header, if any;
+the rate then recovers gradually with each successful request, back up to the configured rate.
+"""
+from contextlib import contextmanager
+import email.utils
+import threading
+import time
+
+# the response status codes that indicate the service is overloaded.
+THROTTLE_STATUS_CODES = (429, 503, )
+
+
+def retry_after(response):
+    """
+    Returns the number of seconds a response asks the client to wait before retrying, from its Retry-After header, or
+    None.
+    """
+    value = response.headers.get('Retry-After') if response is not None else None
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        return max(email.utils.parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+class Limit(object):
+    """
+    A rate and concurrency limit for the requests to a resource or operation.
+    """
+    def __init__(self, rate=None, burst=None, max_in_flight=None, min_rate=0.1, decrease=0.5, recovery=0.05,
+                 pause=1):
+        """
+        :param rate: (float) The maximum number of requests per second; None for no rate limit.
+        :param burst: (int) The number of requests that can be made at once after a quiet period; defaults to rate.
+        :param max_in_flight: (int) The maximum number of requests in flight; None for no limit.
+        :param min_rate: (float) The rate is never cut below this number of requests per second.
+        :param decrease: (float) The factor the rate is multiplied by when a request is throttled.
+        :param recovery: (float) The fraction of the configured rate the rate grows by with each successful request.
+        :param pause: (float) The number of seconds requests are paused for when a request is throttled without a
+        Retry-After header and there is no rate to cut.
+        """
+        self.rate = rate
+        self.burst = burst or max(1, rate or 1)
+        self.max_in_flight = max_in_flight
+        self.min_rate = min_rate
+        self.decrease = decrease
+        self.recovery = recovery
+        self.pause = pause
+        # the current, adapted, rate.
+        self.current_rate = rate
+        self._tokens = self.burst
+        self._refilled = time.monotonic()
+        # requests are held until this time after a throttled response.
+        self._paused_until = 0
+        self._last_decrease = 0
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_in_flight) if max_in_flight else None
+        self.requests = 0
+        self.throttled = 0
+
+    def __getstate__(self):
+        return {'rate': self.rate, 'burst': self.burst, 'max_in_flight': self.max_in_flight, 'min_rate': self.min_rate,
+                'decrease': self.decrease, 'recovery': self.recovery, 'pause': self.pause}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def __repr__(self):
+        return f'<Limit rate={self.current_rate}/{self.rate} max_in_flight={self.max_in_flight}>'
+
+    def _wait_time(self, now):
+        """
+        Take a token if one is available and return 0, or return the number of seconds to wait for one. Must be called
+        with the lock held.
+        """
+        if self._paused_until > now:
+            return self._paused_until - now
+        if not self.current_rate:
+            return 0
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled) * self.current_rate)
+        self._refilled = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0
+        return (1 - self._tokens) / self.current_rate
+
+    def acquire(self):
+        """
+        Block until a request can be made.
+        """
+        if self._slots:
+            self._slots.acquire()
+        while True:
+            with self._lock:
+                wait = self._wait_time(time.monotonic())
+                if not wait:
+                    self.requests += 1
+                    return
+            time.sleep(wait)
+
+    def release(self, response=None):
+        """
+        Release the slot taken by acquire() and adapt the rate to the response, if any.
+        :param response: (requests.Response) The response to the request, or None if no response was received.
+        """
+        if self._slots:
+            self._slots.release()
+        if response is None:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if response.status_code in THROTTLE_STATUS_CODES:
+                self.throttled += 1
+                delay = retry_after(response)
+                if delay is None and not self.rate:
+                    delay = self.pause
+                if delay:
+                    self._paused_until = max(self._paused_until, now + delay)
+                # only cut the rate once for the requests that were in flight together.
+                if self.rate and now - self._last_decrease > 1 / self.current_rate:
+                    self.current_rate = max(self.min_rate, self.current_rate * self.decrease)
+                    self._tokens = min(self._tokens, 1)
+                    self._last_decrease = now
+            elif self.rate and self.current_rate < self.rate:
+                self.current_rate = min(self.rate, self.current_rate + self.rate * self.recovery)
+
+    def stats(self):
+        return {'rate': self.rate,
+                'current_rate': self.current_rate,
+                'max_in_flight': self.max_in_flight,
+                'requests': self.requests,
+                'throttled': self.throttled}
+
+
+def _limit(limit):
+    if limit is None or isinstance(limit, Limit):
+        return limit
+    return Limit(**limit)
+
+
+class RateLimiter(object):
+    """
+    The limits on the requests made by a client, by resource and by operation. See the rate_limits parameter of the
+    DynaTapy constructor.
+    """
+    def __init__(self, limits=None, default=None):
+        """
+        :param limits: (dict) Limit objects, or dictionaries of arguments to Limit, keyed by resource name (e.g.,
+        "files") or by resource name and operation id (e.g., "actors.sendMessage"). A request is subject to both the
+        limit of its operation and the limit of its resource.
+        :param default: (Limit or dict) A limit shared by all of the resources that do not have one of their own.
+        """
+        self.limits = {key: _limit(limit) for key, limit in (limits or {}).items()}
+        self.default = _limit(default)
+
+    def __getstate__(self):
+        return {'limits': self.limits, 'default': self.default}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def limits_for(self, resource_name, operation_id):
+        """
+        Returns the limits that apply to an operation, resource limit first.
+        """
+        limits = []
+        resource_limit = self.limits.get(resource_name, self.default)
+        if resource_limit:
+            limits.append(resource_limit)
+        operation_limit = self.limits.get(f'{resource_name}.{operation_id}')
+        if operation_limit:
+            limits.append(operation_limit)
+        return limits
+
+    @contextmanager
+    def limit(self, resource_name, operation_id):
+        """
+        Context manager that holds the limits for a request to an operation for the duration of the request. The
+        response should be set as the "response" attribute of the object it yields, so that the limits adapt to it.
+        """
+        permit = _Permit()
+        # the limits are always acquired in the same order, so threads cannot deadlock on their semaphores.
+        acquired = []
+        try:
+            for limit in self.limits_for(resource_name, operation_id):
+                limit.acquire()
+                acquired.append(limit)
+            yield permit
+        finally:
+            for limit in reversed(acquired):
+                limit.release(permit.response)
+
+    def stats(self):
+        stats = {key: limit.stats() for key, limit in self.limits.items()}
+        if self.default:
+            stats['default'] = self.default.stats()
+        return stats
+
+
+class _Permit(object):
+    """
+    Carries the response of a request out of RateLimiter.limit().
+    """
+    def __init__(self):
+        self.response = None
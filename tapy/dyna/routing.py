@@ -0,0 +1,256 @@
+"""
+Routing of requests across equivalent Tapis endpoints, such as site-local gateways and a central one serving the same
+tenants.
+
+A RoutingTransport wraps another transport. Requests to a URL under any of its endpoints are sent to the endpoint with
+the best score: the moving average (EWMA) of its latency, inflated by the moving average of its error rate. Endpoints
+that fail failure_threshold times in a row are taken out of rotation for down_time seconds, or until a health probe
+succeeds. The probes are GETs of the healthCheck/readyCheck operations (see the probe_paths parameter), sent from a
+background thread every probe_interval seconds; they also keep the latencies of the endpoints not in use up to date.
+
+Idempotent requests (GET, HEAD, OPTIONS, PUT, DELETE) that fail with a connection error, a timeout or a 502, 503 or
+504 response are retried on the next best endpoint. Other requests are only retried when the connection could not be
+established, so they cannot have reached the service, and streamed request bodies are never retried.
+"""
+import threading
+import time
+
+import requests
+
+from tapy.dyna.transport import SessionTransport
+
+# the http methods whose requests can be sent again to another endpoint.
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE', )
+
+# response status codes that indicate a problem with the endpoint rather than the request.
+FAILOVER_STATUS_CODES = (502, 503, 504, )
+
+
+def _not_sent(exception):
+    """
+    Determine whether a request that raised an exception cannot have reached the server.
+    """
+    if isinstance(exception, requests.exceptions.ConnectTimeout):
+        return True
+    if isinstance(exception, requests.exceptions.ConnectionError):
+        reason = exception.args[0] if exception.args else None
+        reason = getattr(reason, 'reason', reason)
+        return 'NewConnectionError' in type(reason).__name__ or 'NameResolutionError' in type(reason).__name__
+    return False
+
+
+class Endpoint(object):
+    """
+    The health statistics of an endpoint.
+    """
+    def __init__(self, url):
+        self.url = url
+        # the moving averages of the latency, in seconds (None until measured), and of the error rate (0 to 1).
+        self.latency = None
+        self.error_rate = 0
+        # the number of consecutive failures, and the time until which the endpoint is out of rotation.
+        self.failures = 0
+        self.down_until = 0
+        self.requests = 0
+        self.errors = 0
+
+    def __repr__(self):
+        return f'<Endpoint {self.url} latency={self.latency} error_rate={self.error_rate:.2f}>'
+
+    def is_up(self, now):
+        return self.down_until <= now
+
+    def score(self, error_penalty):
+        # endpoints that have not been measured yet are tried first, so that they get measured.
+        return (self.latency or 0) * (1 + error_penalty * self.error_rate)
+
+    def stats(self):
+        return {'latency': self.latency,
+                'error_rate': self.error_rate,
+                'up': self.is_up(time.monotonic()),
+                'requests': self.requests,
+                'errors': self.errors}
+
+
+class RoutingTransport(object):
+    """
+    Routes the requests made to a set of equivalent endpoints to the healthiest and fastest one, failing over to the
+    others. See the endpoints parameter of the DynaTapy constructor.
+    """
+    def __init__(self, endpoints, transport=None, alpha=0.2, error_penalty=10, failure_threshold=3, down_time=30,
+                 probe_paths=(), probe_interval=30, probe_timeout=5):
+        """
+        :param endpoints: (list) The base URLs of the equivalent endpoints, such as "https://tacc.tapis.io".
+        :param transport: The transport used to actually send requests; defaults to a new SessionTransport.
+        :param alpha: (float) The weight of the latest measurement in the moving averages.
+        :param error_penalty: (float) How much the error rate of an endpoint inflates its latency when they are ranked;
+        an endpoint with a 10% error rate ranks like one twice as slow with the default.
+        :param failure_threshold: (int) The number of consecutive failures that take an endpoint out of rotation.
+        :param down_time: (float) The number of seconds an endpoint is out of rotation for, unless a probe succeeds.
+        :param probe_paths: (list) The paths, relative to an endpoint, of the health checks to probe it with; an
+        endpoint is healthy when all of them succeed. DynaTapy sets these from the healthCheck and readyCheck operations.
+        :param probe_interval: (float) The number of seconds between probes; None to disable probing.
+        :param probe_timeout: (float) The timeout, in seconds, of the probes.
+        """
+        self.endpoints = [Endpoint(url.rstrip('/')) for url in endpoints]
+        self.transport = transport or SessionTransport()
+        self.alpha = alpha
+        self.error_penalty = error_penalty
+        self.failure_threshold = failure_threshold
+        self.down_time = down_time
+        self.probe_paths = list(probe_paths)
+        self.probe_interval = probe_interval
+        self.probe_timeout = probe_timeout
+        self._verify = True
+        self._lock = threading.Lock()
+        self._probe_thread = None
+        self._closed = threading.Event()
+
+    def __getstate__(self):
+        return {'endpoints': [endpoint.url for endpoint in self.endpoints], 'transport': self.transport,
+                'alpha': self.alpha, 'error_penalty': self.error_penalty, 'failure_threshold': self.failure_threshold,
+                'down_time': self.down_time, 'probe_paths': self.probe_paths, 'probe_interval': self.probe_interval,
+                'probe_timeout': self.probe_timeout}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def _endpoint_for(self, url):
+        for endpoint in self.endpoints:
+            if url == endpoint.url or url.startswith(endpoint.url + '/') or url.startswith(endpoint.url + '?'):
+                return endpoint
+        return None
+
+    def ranked(self):
+        """
+        Returns the endpoints, best first: those in rotation by score, then those out of rotation, soonest back first.
+        """
+        now = time.monotonic()
+        with self._lock:
+            up = sorted((e for e in self.endpoints if e.is_up(now)), key=lambda e: e.score(self.error_penalty))
+            down = sorted((e for e in self.endpoints if not e.is_up(now)), key=lambda e: e.down_until)
+        return up + down
+
+    def _succeeded(self, endpoint, elapsed):
+        with self._lock:
+            endpoint.requests += 1
+            endpoint.latency = elapsed if endpoint.latency is None \
+                else (1 - self.alpha) * endpoint.latency + self.alpha * elapsed
+            endpoint.error_rate *= 1 - self.alpha
+            endpoint.failures = 0
+            endpoint.down_until = 0
+
+    def _failed(self, endpoint, elapsed=None):
+        with self._lock:
+            endpoint.requests += 1
+            endpoint.errors += 1
+            endpoint.error_rate = (1 - self.alpha) * endpoint.error_rate + self.alpha
+            if elapsed is not None and endpoint.latency is not None:
+                endpoint.latency = max(endpoint.latency, (1 - self.alpha) * endpoint.latency + self.alpha * elapsed)
+            endpoint.failures += 1
+            if endpoint.failures >= self.failure_threshold:
+                endpoint.down_until = time.monotonic() + self.down_time
+
+    def _start_probing(self):
+        with self._lock:
+            # a thread inherited through a fork is not running in the child.
+            if self.probe_paths and self.probe_interval and len(self.endpoints) > 1 \
+                    and not (self._probe_thread and self._probe_thread.is_alive()):
+                self._probe_thread = threading.Thread(target=self._probe_loop, daemon=True)
+                self._probe_thread.start()
+
+    def send(self, request, **kwargs):
+        endpoint = self._endpoint_for(request.url)
+        if endpoint is None:
+            return self.transport.send(request, **kwargs)
+        self._verify = kwargs.get('verify', self._verify)
+        self._start_probing()
+        path = request.url[len(endpoint.url):]
+        idempotent = request.method.upper() in IDEMPOTENT_METHODS
+        # a streamed body is consumed by the first attempt.
+        replayable = request.body is None or isinstance(request.body, (str, bytes, bytearray))
+        candidates = self.ranked()
+        for index, endpoint in enumerate(candidates):
+            last = index == len(candidates) - 1 or not replayable
+            attempt = request.copy()
+            attempt.url = endpoint.url + path
+            start = time.monotonic()
+            try:
+                response = self.transport.send(attempt, **kwargs)
+            except Exception as e:
+                self._failed(endpoint, time.monotonic() - start)
+                if last or not (idempotent or _not_sent(e)):
+                    raise
+                continue
+            elapsed = time.monotonic() - start
+            if response.status_code in FAILOVER_STATUS_CODES:
+                self._failed(endpoint, elapsed)
+                if last or not idempotent:
+                    return response
+                if kwargs.get('stream'):
+                    # release the connection of the response that is being discarded.
+                    response.close()
+                continue
+            self._succeeded(endpoint, elapsed)
+            return response
+
+    def warmup(self, url, connections=4, verify=True):
+        """
+        Warm up connections to every endpoint, if the inner transport supports it; see KeepAliveTransport.warmup().
+        """
+        if not hasattr(self.transport, 'warmup'):
+            return []
+        endpoint = self._endpoint_for(url)
+        if endpoint is None:
+            return self.transport.warmup(url, connections, verify)
+        path = url[len(endpoint.url):]
+        errors = []
+        for endpoint in self.endpoints:
+            errors.extend(self.transport.warmup(endpoint.url + path, connections, verify))
+        return errors
+
+    def probe(self):
+        """
+        Probe every endpoint with its health checks now, updating its statistics.
+        :return: (dict) Whether each endpoint is healthy, by URL.
+        """
+        results = {}
+        for endpoint in self.endpoints:
+            start = time.monotonic()
+            healthy = True
+            for path in self.probe_paths:
+                try:
+                    response = self.transport.send(requests.Request('GET', endpoint.url + path).prepare(),
+                                                   verify=self._verify, timeout=self.probe_timeout)
+                    healthy = healthy and 200 <= response.status_code < 300
+                except Exception:
+                    healthy = False
+                if not healthy:
+                    break
+            elapsed = (time.monotonic() - start) / max(len(self.probe_paths), 1)
+            if healthy:
+                self._succeeded(endpoint, elapsed)
+            else:
+                # a failed probe takes the endpoint out of rotation right away.
+                self._failed(endpoint)
+                with self._lock:
+                    endpoint.down_until = time.monotonic() + self.down_time
+            results[endpoint.url] = healthy
+        return results
+
+    def _probe_loop(self):
+        while not self._closed.wait(self.probe_interval):
+            self.probe()
+
+    def reset(self):
+        if hasattr(self.transport, 'reset'):
+            self.transport.reset()
+
+    def close(self):
+        self._closed.set()
+        if hasattr(self.transport, 'close'):
+            self.transport.close()
+
+    def stats(self):
+        with self._lock:
+            return {endpoint.url: endpoint.stats() for endpoint in self.endpoints}
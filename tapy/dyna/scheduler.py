@@ -0,0 +1,212 @@
+"""
+A priority-aware scheduler for the requests a DynaTapy client makes, separating interactive from batch traffic.
+
+A PriorityScheduler caps the number of requests a client has in flight (match it to the size of the connection pool,
+10 per host by default) and divides that capacity between priority classes, "interactive" and "batch" by default.
+Lower classes can only use part of the capacity: with max_in_flight=10 and reserved=2, batch requests can only start
+while fewer than 8 requests are in flight, so 2 connections are always available to interactive calls, however much
+batch work is queued. Requests that cannot start wait in a queue per class; a slot that frees up goes to the highest
+class with a waiting request it can start, and, within a class, to the operations with waiting requests in turn, so
+one long crawl does not starve the other batch jobs.
+
+The class of a call is given with the _tapis_priority argument to the operation, or otherwise by the class configured
+for the operation or its resource, or else the default class. stats() reports the queue depths and the wait times of
+each class.
+"""
+from collections import OrderedDict, deque
+import threading
+import time
+
+import tapy.errors
+
+# the default priority classes, highest first.
+PRIORITY_CLASSES = ('interactive', 'batch', )
+
+# the number of recent wait times kept per class, for the percentiles reported by stats().
+WAIT_SAMPLES = 1000
+
+
+def _percentile(samples, fraction):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class _Waiter(object):
+    def __init__(self):
+        self.event = threading.Event()
+        self.queued_at = time.monotonic()
+
+
+class _PriorityClass(object):
+    """
+    The queue and metrics of a priority class.
+    """
+    def __init__(self, name, limit):
+        self.name = name
+        # requests of this class only start while fewer than this number of requests are in flight.
+        self.limit = limit
+        # the waiting requests, by flow (operation), served round robin.
+        self.flows = OrderedDict()
+        self.depth = 0
+        self.max_depth = 0
+        self.in_flight = 0
+        self.started = 0
+        self.waits = deque(maxlen=WAIT_SAMPLES)
+
+    def enqueue(self, flow, waiter):
+        self.flows.setdefault(flow, deque()).append(waiter)
+        self.depth += 1
+        self.max_depth = max(self.max_depth, self.depth)
+
+    def dequeue(self):
+        # take the first waiter of the first flow, and move that flow to the back of the line.
+        flow, waiters = next(iter(self.flows.items()))
+        waiter = waiters.popleft()
+        del self.flows[flow]
+        if waiters:
+            self.flows[flow] = waiters
+        self.depth -= 1
+        return waiter
+
+    def stats(self):
+        waits = list(self.waits)
+        return {'limit': self.limit,
+                'queue_depth': self.depth,
+                'max_queue_depth': self.max_depth,
+                'in_flight': self.in_flight,
+                'started': self.started,
+                'wait_mean': sum(waits) / len(waits) if waits else None,
+                'wait_p50': _percentile(waits, 0.5),
+                'wait_p99': _percentile(waits, 0.99)}
+
+
+class PriorityScheduler(object):
+    """
+    Schedules the requests of a client by priority class. See the scheduler parameter of the DynaTapy constructor.
+    """
+    def __init__(self, max_in_flight=10, reserved=2, classes=PRIORITY_CLASSES, default=None, operations=None):
+        """
+        :param max_in_flight: (int) The maximum number of requests in flight.
+        :param reserved: (int) The number of slots each class reserves for the classes above it: requests of the k-th
+        class (counting from 0) only start while fewer than max_in_flight - k * reserved requests are in flight.
+        :param classes: (list) The names of the priority classes, highest first.
+        :param default: (str) The class of calls with no priority given or configured; defaults to the highest.
+        :param operations: (dict) The class of the calls to operations, keyed by resource name and operation id (e.g.,
+        "files.listFiles") or by resource name (e.g., "streams").
+        """
+        self.max_in_flight = max_in_flight
+        self.reserved = reserved
+        self.classes = list(classes)
+        self.default = default or self.classes[0]
+        self.operations = dict(operations or {})
+        for name in [self.default] + list(self.operations.values()):
+            if name not in self.classes:
+                raise tapy.errors.TapyClientConfigurationError(msg=f'Unknown priority class: {name}; the classes '
+                                                                   f'are: {self.classes}.')
+        self._classes = [_PriorityClass(name, max(1, max_in_flight - index * reserved))
+                         for index, name in enumerate(self.classes)]
+        self._by_name = {priority_class.name: priority_class for priority_class in self._classes}
+        self.in_flight = 0
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        return {'max_in_flight': self.max_in_flight, 'reserved': self.reserved, 'classes': self.classes,
+                'default': self.default, 'operations': self.operations}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def __repr__(self):
+        return f'<PriorityScheduler max_in_flight={self.max_in_flight} in_flight={self.in_flight}>'
+
+    def priority_for(self, resource_name, operation_id, priority=None):
+        """
+        Returns the priority class of a call.
+        :param priority: (str) The priority given for the call, if any.
+        """
+        if priority is None:
+            priority = self.operations.get(f'{resource_name}.{operation_id}',
+                                           self.operations.get(resource_name, self.default))
+        elif priority not in self._by_name:
+            raise tapy.errors.InvalidInputError(msg=f'Unknown priority class: {priority}; the classes are: '
+                                                    f'{self.classes}.')
+        return priority
+
+    def _can_start(self, priority_class):
+        # nothing starts ahead of the requests waiting in the same or a higher class.
+        for other in self._classes:
+            if other.depth:
+                return False
+            if other is priority_class:
+                break
+        return self.in_flight < priority_class.limit
+
+    def acquire(self, resource_name, operation_id, priority=None):
+        """
+        Block until a request to an operation can start.
+        :return: (str) The priority class of the request, to pass to release().
+        """
+        priority = self.priority_for(resource_name, operation_id, priority)
+        priority_class = self._by_name[priority]
+        with self._lock:
+            if self._can_start(priority_class):
+                self._start(priority_class, 0)
+                return priority
+            waiter = _Waiter()
+            priority_class.enqueue(f'{resource_name}.{operation_id}', waiter)
+        waiter.event.wait()
+        return priority
+
+    def _start(self, priority_class, wait):
+        self.in_flight += 1
+        priority_class.in_flight += 1
+        priority_class.started += 1
+        priority_class.waits.append(wait)
+
+    def release(self, priority):
+        """
+        Release the slot of a request that has completed and start the next waiting requests.
+        """
+        with self._lock:
+            self.in_flight -= 1
+            self._by_name[priority].in_flight -= 1
+            self._dispatch()
+
+    def _dispatch(self):
+        # must be called with the lock held.
+        now = time.monotonic()
+        for priority_class in self._classes:
+            while priority_class.depth and self.in_flight < priority_class.limit:
+                waiter = priority_class.dequeue()
+                self._start(priority_class, now - waiter.queued_at)
+                waiter.event.set()
+            if priority_class.depth:
+                # lower classes wait for this one.
+                return
+
+    def slot(self, resource_name, operation_id, priority=None):
+        """
+        Context manager holding a slot for a request to an operation for the duration of the request.
+        """
+        return _Slot(self, resource_name, operation_id, priority)
+
+    def stats(self):
+        with self._lock:
+            return {'in_flight': self.in_flight,
+                    'classes': {priority_class.name: priority_class.stats() for priority_class in self._classes}}
+
+
+class _Slot(object):
+    def __init__(self, scheduler, resource_name, operation_id, priority):
+        self.scheduler = scheduler
+        self.args = (resource_name, operation_id, priority)
+        self.priority = None
+
+    def __enter__(self):
+        self.priority = self.scheduler.acquire(*self.args)
+        return self
+
+    def __exit__(self, *exc):
+        self.scheduler.release(self.priority)
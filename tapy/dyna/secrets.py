@@ -0,0 +1,197 @@
+"""
+An in-memory cache for secrets read from the Security Kernel (SK).
+
+When a DynaTapy client is created with a SecretCache (the secret_cache parameter), sk.readSecret() calls made through
+the client are answered from the cache while the cached secret is fresh. Once its TTL has expired, a cached secret is
+revalidated with the cheaper sk.readSecretMeta() and only read again if a newer version has been written (or, for reads
+of a specific version, if that version has been deleted or destroyed). Concurrent reads of the same secret share a
+single request, and writeSecret, deleteSecret, undeleteSecret, destroySecret and destroySecretMeta calls made through
+the client invalidate the cached reads of the secret.
+
+Secret values are only ever held in memory: they are never written to disk, and they are dropped when a cache (or a
+client using it) is pickled.
+"""
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+import threading
+import time
+
+# operations that change a secret; cached reads of the secret are invalidated when one of them is called.
+WRITE_OPERATIONS = ('writeSecret', 'deleteSecret', 'undeleteSecret', 'destroySecret', 'destroySecretMeta', )
+
+# arguments to readSecret that do not identify the secret itself.
+NON_IDENTIFYING_ARGUMENTS = ('version', 'pretty', )
+
+
+class _Entry(object):
+    """
+    A cached secret.
+    """
+    def __init__(self, secret, value, expires_at):
+        # the (identity, secretType, secretName) the value is for; used for invalidation.
+        self.secret = secret
+        self.value = value
+        self.expires_at = expires_at
+        # the version of the secret, as reported in its metadata.
+        self.version = getattr(getattr(value, 'metadata', None), 'version', None)
+
+
+class SecretCache(object):
+    """
+    A thread-safe, memory-only cache of sk.readSecret() results with TTLs and version-aware revalidation.
+    """
+    def __init__(self, ttl=300, revalidate=True, max_entries=1024):
+        """
+        :param ttl: (float) The number of seconds a secret is served from the cache without checking with SK.
+        :param revalidate: (bool) Whether to revalidate an expired secret with readSecretMeta() instead of reading it
+        again.
+        :param max_entries: (int) The maximum number of secrets cached; the least recently used ones are dropped.
+        """
+        self.ttl = ttl
+        self.revalidate = revalidate
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        # futures for the secrets being read, so that concurrent reads of a secret make a single request.
+        self._loading = {}
+        # incremented on every invalidation, so that a read that raced with an invalidation is not cached.
+        self._generation = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+
+    def __getstate__(self):
+        # never serialize the secrets themselves.
+        return {'ttl': self.ttl, 'revalidate': self.revalidate, 'max_entries': self.max_entries}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def __repr__(self):
+        return f'<SecretCache: {len(self._entries)} secrets>'
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _identity(self, operation):
+        client = operation.tapis_client
+        return (client.base_url, client.tenant_id, client.username, client.x_tenant_id, client.x_username)
+
+    def call(self, operation, kwargs):
+        """
+        Make an sk operation call through the cache. Called by Operation.__call__ for the sk operations of clients
+        with a secret cache.
+        :param operation: (Operation) The sk operation.
+        :param kwargs: (dict) The arguments to the operation.
+        """
+        if operation.operation_id in WRITE_OPERATIONS:
+            try:
+                return operation(_tapis_cache=False, **kwargs)
+            finally:
+                # the state of the secret is unknown even if the call failed.
+                self.invalidate(kwargs.get('secretType'), kwargs.get('secretName'),
+                                identity=self._identity(operation))
+        # debug data and custom headers are only returned by or applied to actual requests.
+        if operation.operation_id != 'readSecret' or kwargs.get('_tapis_debug') or 'headers' in kwargs:
+            return operation(_tapis_cache=False, **kwargs)
+        return self._read(operation, kwargs)
+
+    def _read(self, operation, kwargs):
+        identity = self._identity(operation)
+        key = identity + tuple(sorted((k, str(v)) for k, v in kwargs.items() if k != 'pretty'))
+        secret = (identity, kwargs.get('secretType'), kwargs.get('secretName'))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                if entry.expires_at > time.monotonic():
+                    self.hits += 1
+                    return entry.value
+            future = self._loading.get(key)
+            loading = future is None
+            if loading:
+                future = Future()
+                self._loading[key] = future
+            generation = self._generation
+        if not loading:
+            return future.result()
+        try:
+            if entry is not None and self.revalidate and self._is_current(operation, kwargs, entry):
+                value = entry.value
+                with self._lock:
+                    self.revalidations += 1
+            else:
+                value = operation(_tapis_cache=False, **kwargs)
+                with self._lock:
+                    self.misses += 1
+            with self._lock:
+                if generation == self._generation:
+                    self._entries[key] = _Entry(secret, value, time.monotonic() + self.ttl)
+                    self._entries.move_to_end(key)
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+            future.set_result(value)
+            return value
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._loading.pop(key, None)
+
+    def _is_current(self, operation, kwargs, entry):
+        """
+        Determine, with readSecretMeta(), whether a cached secret is still the version SK would return.
+        """
+        meta_kwargs = {k: v for k, v in kwargs.items() if k not in NON_IDENTIFYING_ARGUMENTS}
+        try:
+            meta = operation.tapis_client.sk.readSecretMeta(**meta_kwargs)
+        except Exception:
+            # read the secret again, which raises the appropriate error if there is a problem with it.
+            return False
+        if 'version' in kwargs:
+            # a specific version never changes, but it can be deleted or destroyed.
+            for version in getattr(meta, 'versions', None) or []:
+                if str(getattr(version, 'version', None)) == str(kwargs['version']):
+                    return not getattr(version, 'destroyed', False) and not getattr(version, 'deletion_time', None)
+            return False
+        current_version = getattr(meta, 'current_version', None)
+        return current_version is not None and current_version == entry.version
+
+    def invalidate(self, secretType=None, secretName=None, identity=None):
+        """
+        Drop cached secrets. With no arguments, the whole cache is cleared.
+        :param secretType: (str) Only drop secrets of this type.
+        :param secretName: (str) Only drop secrets with this name.
+        :param identity: (tuple) Only drop secrets read by this client identity.
+        """
+        with self._lock:
+            self._generation += 1
+            for key, entry in list(self._entries.items()):
+                entry_identity, entry_type, entry_name = entry.secret
+                if (identity is None or identity == entry_identity) \
+                        and (secretType is None or secretType == entry_type) \
+                        and (secretName is None or secretName == entry_name):
+                    del self._entries[key]
+
+    def clear(self):
+        self.invalidate()
+
+    def prefetch(self, client, secrets, workers=8):
+        """
+        Read a set of secrets concurrently into the cache.
+        :param client: (DynaTapy) The client to read the secrets with; it must use this cache.
+        :param secrets: (list) The arguments to sk.readSecret() for each secret, as dictionaries.
+        :param workers: (int) The number of secrets read at the same time.
+        :return: (list) The secrets that could not be read, paired with the exception raised.
+        """
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [(secret, executor.submit(lambda kwargs: client.sk.readSecret(**kwargs), secret))
+                       for secret in secrets]
+        return [(secret, future.exception()) for secret, future in futures if future.exception()]
+
+    def stats(self):
+        return {'secrets': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'revalidations': self.revalidations}
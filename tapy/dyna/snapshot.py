@@ -0,0 +1,135 @@
+"""
+Snapshots of ready DynaTapy clients, for processes that start often and run briefly, such as Abaco actors and batch
+containers.
+
+A snapshot holds everything a client needed network calls and spec parsing for: its configuration (the state of a
+pickled client), the resolved tenant_id, its tokens and their expiry, and the operation tables of the resources that
+were built from spec files rather than generated ahead of time by tapy.dyna.codegen. Restoring a snapshot makes no
+requests and parses no specs; tokens that have expired, or are about to, are dropped, so the restored client gets new
+ones the usual way.
+
+A snapshot is a string, so it can be passed to a container in an environment variable (TAPY_SNAPSHOT by default), or
+saved to a file:
+    blob = snapshot(t)
+    t = restore(os.environ['TAPY_SNAPSHOT'])   # or restore_from_env()
+    save_snapshot(t, '/tmp/tapy.snapshot')
+    t = load_snapshot('/tmp/tapy.snapshot')
+
+A snapshot contains the client's credentials and tokens, and is a pickle: only restore snapshots from trusted sources.
+"""
+import base64
+import datetime
+import os
+import pickle
+import threading
+import zlib
+
+import tapy.errors
+from tapy.dyna.codegen import describe_operation
+from tapy.dyna.dynatapy import RESOURCES, DynaTapy, Operation, OperationDescription, StaticResource
+
+# the environment variable restore_from_env() reads a snapshot from by default.
+SNAPSHOT_ENV = 'TAPY_SNAPSHOT'
+
+# the prefix of snapshots in the current format.
+SNAPSHOT_PREFIX = 'tapy-snapshot-1:'
+
+# tokens valid for less than this many seconds are not restored.
+MIN_TOKEN_TTL = 30
+
+
+def _operation_table(resource):
+    """
+    Returns the descriptions of the operations of a resource built from a spec, as arguments to OperationDescription.
+    """
+    return {operation.operation_id: describe_operation(operation.op_desc)
+            for operation in vars(resource).values() if isinstance(operation, Operation)}
+
+
+def snapshot(client):
+    """
+    Returns a snapshot of a client.
+    :param client: (DynaTapy) The client.
+    :return: (str) The snapshot.
+    """
+    state = client.__getstate__()
+    # generated resources are described by their modules; the others by their operation tables.
+    state['operation_tables'] = {resource_name: _operation_table(getattr(client, resource_name))
+                                 for resource_name, _ in RESOURCES
+                                 if not isinstance(getattr(client, resource_name), StaticResource)}
+    payload = pickle.dumps({'created': datetime.datetime.now(datetime.timezone.utc).isoformat(), 'state': state})
+    return SNAPSHOT_PREFIX + base64.b64encode(zlib.compress(payload, 9)).decode('ascii')
+
+
+def _valid_token(token):
+    """
+    Returns a token description from a snapshot if the token is valid for at least MIN_TOKEN_TTL seconds, or None.
+    """
+    if not token or not token.get('expires_at'):
+        return token
+    expires_at = datetime.datetime.fromisoformat(token['expires_at'])
+    if not expires_at.tzinfo:
+        expires_at = expires_at.replace(tzinfo=datetime.timezone.utc)
+    if expires_at - datetime.datetime.now(datetime.timezone.utc) < datetime.timedelta(seconds=MIN_TOKEN_TTL):
+        return None
+    return token
+
+
+def restore(blob):
+    """
+    Restore a client from a snapshot, without making any request.
+    :param blob: (str) A snapshot returned by snapshot().
+    :return: (DynaTapy) The client.
+    """
+    if not isinstance(blob, str) or not blob.startswith(SNAPSHOT_PREFIX):
+        raise tapy.errors.TapyClientConfigurationError(msg='Not a DynaTapy snapshot, or a snapshot in an unsupported '
+                                                           'format.')
+    try:
+        payload = pickle.loads(zlib.decompress(base64.b64decode(blob[len(SNAPSHOT_PREFIX):])))
+    except Exception as e:
+        raise tapy.errors.TapyClientConfigurationError(msg=f'Could not read the DynaTapy snapshot. Exception: {e}')
+    state = payload['state']
+    state['access_token'] = _valid_token(state.get('access_token'))
+    state['refresh_token'] = _valid_token(state.get('refresh_token'))
+    state['operation_tables'] = {resource_name: {operation_id: OperationDescription(**description)
+                                                 for operation_id, description in table.items()}
+                                 for resource_name, table in state.get('operation_tables', {}).items()}
+    client = DynaTapy.__new__(DynaTapy)
+    client.__setstate__(state)
+    return client
+
+
+def save_snapshot(client, path):
+    """
+    Write a snapshot of a client to a file, readable by the owner only.
+    :param client: (DynaTapy) The client.
+    :param path: (str) The path of the file.
+    """
+    # write to a temporary file and rename it into place so readers never see a partial snapshot.
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w') as f:
+        f.write(snapshot(client))
+    os.replace(tmp_path, path)
+
+
+def load_snapshot(path):
+    """
+    Restore a client from a snapshot file written by save_snapshot().
+    :param path: (str) The path of the file.
+    :return: (DynaTapy) The client.
+    """
+    with open(path) as f:
+        return restore(f.read())
+
+
+def restore_from_env(name=SNAPSHOT_ENV):
+    """
+    Restore a client from a snapshot in an environment variable.
+    :param name: (str) The name of the variable.
+    :return: (DynaTapy) The client, or None if the variable is not set.
+    """
+    blob = os.environ.get(name)
+    if not blob:
+        return None
+    return restore(blob)
@@ -0,0 +1,224 @@
+"""
+Following the measurements of many Streams instruments as they arrive, for near-real-time dashboards.
+
+A MeasurementFollower polls streams.list_measurements for every instrument it follows from a single scheduler thread
+(see tapy.dyna.polling). Each instrument has a high-water mark, the timestamp of its latest measurement, and every poll
+only asks for the measurements from that timestamp on. Measurements at the high-water mark that were already seen are
+dropped, so points sharing the boundary timestamp are neither lost nor repeated. The interval between the polls of an
+instrument follows its data rate: it is set to the expected time until its next measurement, from a moving average of
+the rate measured by the polls, between min_interval and max_interval. A poll that returns a full page is followed by
+another one right away.
+
+The new measurements of all of the instruments are put on a single queue, which the follower iterates over:
+    with MeasurementFollower(t) as follower:
+        follower.follow('project-uuid', 'site-id', 'instrument-id')
+        for instrument, measurement in follower:
+            ...
+"""
+import datetime
+import json
+import queue
+import threading
+import time
+
+from tapy.dyna.dynatapy import _to_dict
+from tapy.dyna.polling import PollingScheduler
+
+# the number of measurements requested per poll.
+PAGE_SIZE = 1000
+
+
+def _timestamp(value):
+    """
+    Returns a comparable value for the datetime of a measurement: a timezone-aware datetime if it can be parsed, or
+    else the string itself.
+    """
+    if not isinstance(value, str):
+        return value
+    try:
+        parsed = datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        return value
+    if not parsed.tzinfo:
+        parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+    return parsed
+
+
+def _key(measurement):
+    """
+    Returns a key identifying a measurement among those with the same timestamp.
+    """
+    return json.dumps(_to_dict(measurement), sort_keys=True, default=str)
+
+
+class _Cursor(object):
+    """
+    The position of the follower in the measurements of an instrument.
+    """
+    def __init__(self, instrument, start_date):
+        # the (project_uuid, site_id, inst_id) of the instrument.
+        self.instrument = instrument
+
+        # the datetime of the latest measurement seen, as returned by the service, and the keys of the measurements
+        # seen with that datetime.
+        self.high_water_mark = start_date
+        self.seen = set()
+
+        # the moving average of the number of measurements per second, the time of the last poll, and whether it
+        # returned a full page.
+        self.rate = None
+        self.last_poll = None
+        self.full_page = False
+
+        # the number of measurements delivered.
+        self.delivered = 0
+
+
+class MeasurementFollower(PollingScheduler):
+    """
+    Follows the measurements of many instruments from a single scheduler thread, yielding the new ones as they arrive.
+    """
+    def __init__(self, client, page_size=PAGE_SIZE, alpha=0.3, max_queued=10000, min_interval=0.5, max_interval=60,
+                 **kwargs):
+        """
+        :param client: (DynaTapy) The client to make requests with.
+        :param page_size: (int) The number of measurements requested per poll.
+        :param alpha: (float) The weight of the latest poll in the moving average of the data rate of an instrument.
+        :param max_queued: (int) The maximum number of measurements waiting to be consumed; polling pauses beyond that.
+        :param min_interval: (float) The minimum number of seconds between polls of an instrument.
+        :param max_interval: (float) The maximum number of seconds between polls of an instrument.
+        :param kwargs: Other polling parameters; see PollingScheduler.
+        """
+        super().__init__(min_interval=min_interval, max_interval=max_interval, **kwargs)
+        self.client = client
+        self.page_size = page_size
+        self.alpha = alpha
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._cursors = {}
+        self._lock = threading.Lock()
+        # the exception that made the follower give up on an instrument, by instrument.
+        self.errors = {}
+
+    def follow(self, project_uuid, site_id, inst_id, start_date=None):
+        """
+        Start following the measurements of an instrument.
+        :param start_date: (str) The datetime to follow the measurements from, in the format of the Streams API; by
+        default, only measurements made from now on are followed.
+        """
+        instrument = (project_uuid, site_id, inst_id)
+        if start_date is None:
+            start_date = datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+        cursor = _Cursor(instrument, start_date)
+        with self._lock:
+            if instrument in self._cursors:
+                return
+            self._cursors[instrument] = cursor
+        self.track(cursor)
+
+    def poll(self, cursor):
+        project_uuid, site_id, inst_id = cursor.instrument
+        # the points already seen at the high-water mark are returned again, so there is room for them on top of the
+        # page; otherwise, a page filled with them would never get past the high-water mark.
+        limit = self.page_size + len(cursor.seen)
+        result = self.client.streams.list_measurements(project_uuid=project_uuid, site_id=site_id, inst_id=inst_id,
+                                                       start_date=cursor.high_water_mark, limit=limit)
+        now = time.monotonic()
+        # an empty result is returned as the raw JSON.
+        measurements = result if isinstance(result, list) else []
+        boundary = _timestamp(cursor.high_water_mark)
+        new = []
+        for measurement in measurements:
+            timestamp = _timestamp(getattr(measurement, 'datetime', None))
+            if timestamp is None:
+                continue
+            try:
+                if timestamp < boundary:
+                    continue
+            except TypeError:
+                # an unparseable datetime on either side; compare the strings.
+                if str(getattr(measurement, 'datetime')) < str(cursor.high_water_mark):
+                    continue
+            if timestamp == boundary and _key(measurement) in cursor.seen:
+                continue
+            new.append((timestamp, measurement))
+        new.sort(key=lambda item: item[0])
+        if new:
+            latest = new[-1][0]
+            latest_keys = {_key(measurement) for timestamp, measurement in new if timestamp == latest}
+            if latest == boundary:
+                cursor.seen |= latest_keys
+            else:
+                cursor.high_water_mark = getattr(new[-1][1], 'datetime')
+                cursor.seen = latest_keys
+        if cursor.last_poll is not None:
+            rate = len(new) / max(now - cursor.last_poll, 1e-3)
+            cursor.rate = rate if cursor.rate is None else (1 - self.alpha) * cursor.rate + self.alpha * rate
+        cursor.last_poll = now
+        cursor.full_page = len(measurements) >= limit
+        for _, measurement in new:
+            # a full queue holds up this poll, and so the polls of this instrument, until the consumer catches up.
+            while not self._closed:
+                try:
+                    self._queue.put((cursor.instrument, measurement), timeout=0.5)
+                    break
+                except queue.Full:
+                    continue
+        cursor.delivered += len(new)
+        return False, cursor.high_water_mark
+
+    def next_interval(self, cursor, previous_state, state, interval):
+        if cursor.full_page:
+            # there are more measurements waiting.
+            return 0
+        if not cursor.rate:
+            # no data yet; back off.
+            return min(max(interval, self.min_interval) * self.backoff, self.max_interval)
+        # the expected time until the next measurement.
+        return min(max(1 / cursor.rate, self.min_interval), self.max_interval)
+
+    def failed(self, cursor, exception):
+        self.errors[cursor.instrument] = exception
+        with self._lock:
+            self._cursors.pop(cursor.instrument, None)
+
+    def get(self, timeout=None):
+        """
+        Returns the next new measurement of any of the instruments, waiting for one if there are none.
+        :param timeout: (float) The maximum number of seconds to wait.
+        :return: (tuple) The (project_uuid, site_id, inst_id) of the instrument and the measurement, or None if the
+        timeout expired.
+        """
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def __iter__(self):
+        while not self._closed:
+            item = self.get(timeout=0.5)
+            if item is not None:
+                yield item
+
+    def stats(self):
+        with self._lock:
+            cursors = list(self._cursors.values())
+        return {'instruments': len(cursors),
+                'queued': self._queue.qsize(),
+                'failed': len(self.errors),
+                'delivered': sum(cursor.delivered for cursor in cursors),
+                'rates': {cursor.instrument: cursor.rate for cursor in cursors}}
+
+
+def follow_measurements(client, instruments, start_date=None, **kwargs):
+    """
+    Generator over the new measurements of many instruments as they arrive; see MeasurementFollower.
+    :param client: (DynaTapy) The client to make requests with.
+    :param instruments: (list) The (project_uuid, site_id, inst_id) of each instrument.
+    :param start_date: (str) The datetime to follow the measurements from; by default, from now on.
+    :param kwargs: Parameters of the MeasurementFollower.
+    :return: Yields the (project_uuid, site_id, inst_id) of the instrument and the measurement.
+    """
+    with MeasurementFollower(client, **kwargs) as follower:
+        for project_uuid, site_id, inst_id in instruments:
+            follower.follow(project_uuid, site_id, inst_id, start_date=start_date)
+        yield from follower
@@ -0,0 +1,395 @@
+"""
+Incremental synchronization of a local directory tree with a directory tree on a Tapis system.
+
+A Sync compares the files of a local tree (walked with os.walk) with the files of a remote tree (walked with
+tapy.dyna.walk, i.e., files.listFiles) and transfers only the files that differ, uploading, downloading and deleting
+from a thread pool. The state of both sides after each transfer is recorded in a local SQLite manifest, so that later
+runs only need to compare each side with its own recorded state, and so that an interrupted run picks up where it left
+off when run again.
+
+Files are compared by size and modification time; the Files API does not report checksums, so the optional sha256
+checksums are computed on the local side only, to avoid uploading files whose modification time changed but whose
+content did not. On the first run, a file present on both sides is only adopted as in sync when it has the same size on
+both and the copy on the destination is not older than the one on the source; otherwise it is transferred.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import concurrent.futures
+import datetime
+from fnmatch import fnmatch
+import hashlib
+import os
+import posixpath
+import sqlite3
+import time
+
+from tapy.dyna.walk import entry_path, is_dir, walk
+
+# default directory for the manifests; each sync pair gets its own SQLite database in it.
+SYNC_MANIFEST_DIR = os.path.join(os.path.expanduser('~'), '.tapy', 'sync')
+
+# the kinds of SyncAction.
+UPLOAD = 'upload'
+DOWNLOAD = 'download'
+DELETE_REMOTE = 'delete_remote'
+DELETE_LOCAL = 'delete_local'
+# the file is already in sync; only the manifest is updated.
+RECORD = 'record'
+
+
+def file_checksum(path, chunk_size=1024 * 1024):
+    """
+    Returns the hex sha256 digest of the content of a local file.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _last_modified_ns(last_modified):
+    """
+    Returns the lastModified of a remote file, as reported by files.listFiles (an ISO 8601 string, or a number of
+    seconds or milliseconds since the epoch), in nanoseconds since the epoch, or None if it cannot be parsed.
+    """
+    try:
+        value = float(last_modified)
+    except (TypeError, ValueError):
+        try:
+            parsed = datetime.datetime.fromisoformat(str(last_modified).replace('Z', '+00:00'))
+        except ValueError:
+            return None
+        if not parsed.tzinfo:
+            parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+        return int(parsed.timestamp() * 1e9)
+    # values this large are milliseconds.
+    if value > 1e11:
+        value /= 1000
+    return int(value * 1e9)
+
+
+def _same_size(remote_size, local_size):
+    """
+    Determine if a remote file has the same size as a local file. FileInfo documents size in kB, while some versions of
+    the Files API report bytes, so a size matching the local size in either unit is accepted.
+    """
+    if remote_size is None:
+        return False
+    return remote_size == local_size or remote_size in (local_size // 1024, -(-local_size // 1024))
+
+
+def _adopt(source_mtime_ns, destination_mtime_ns, local_size, remote_size):
+    """
+    Determine if a file found on both sides on the first run can be recorded as in sync without transferring it: it
+    must have the same size on both sides, and the copy on the destination must not be older than the source.
+    """
+    if source_mtime_ns is None or destination_mtime_ns is None:
+        return False
+    return _same_size(remote_size, local_size) and destination_mtime_ns >= source_mtime_ns
+
+
+class _Record(object):
+    """
+    The state of a file recorded in the manifest after it was last synchronized.
+    """
+    def __init__(self, path, local_size, local_mtime, local_checksum, remote_size, remote_mtime):
+        self.path = path
+        self.local = (local_size, local_mtime)
+        self.local_checksum = local_checksum
+        # None when the file was uploaded and the remote side has not been listed since.
+        self.remote = (remote_size, remote_mtime) if remote_size is not None else None
+
+
+class SyncAction(object):
+    """
+    A single step of a sync plan.
+    """
+    def __init__(self, kind, path, local=None, remote=None, checksum=None):
+        # one of UPLOAD, DOWNLOAD, DELETE_REMOTE, DELETE_LOCAL or RECORD
+        self.kind = kind
+
+        # the path of the file, relative to the roots of both trees, with "/" separators.
+        self.path = path
+
+        # the (size, mtime) of the file on each side when the plan was made, if it exists there.
+        self.local = local
+        self.remote = remote
+
+        # the local checksum, if it was computed
+        self.checksum = checksum
+
+    def __repr__(self):
+        return f'<SyncAction {self.kind} {self.path}>'
+
+
+class SyncResult(object):
+    """
+    The outcome of Sync.run(): the actions planned, those completed, and those that failed with their exceptions.
+    """
+    def __init__(self, actions, dry_run=False):
+        self.actions = actions
+        self.dry_run = dry_run
+        self.completed = []
+        self.errors = []
+        self.bytes_transferred = 0
+        self.elapsed = 0
+
+    def __repr__(self):
+        return f'<SyncResult {self.stats()}>'
+
+    def stats(self):
+        counts = {}
+        for action in self.actions:
+            counts[action.kind] = counts.get(action.kind, 0) + 1
+        return {'planned': counts,
+                'completed': len(self.completed),
+                'errors': len(self.errors),
+                'bytes_transferred': self.bytes_transferred,
+                'elapsed': self.elapsed}
+
+
+class Sync(object):
+    """
+    Synchronizes a local directory tree with a directory tree on a Tapis system, in one direction.
+
+    With direction='upload', the remote tree is made to match the local tree; with direction='download', the local
+    tree is made to match the remote tree. Files missing from the source are only deleted from the destination if
+    delete is set.
+    """
+    def __init__(self, client, local_path, system_id, remote_path, direction=UPLOAD, delete=False, checksum=False,
+                 exclude=None, workers=8, manifest_path=None):
+        """
+        :param client: (DynaTapy) The client to make requests with.
+        :param local_path: (str) The root of the local tree.
+        :param system_id: (str) The system the remote tree is on.
+        :param remote_path: (str) The root of the remote tree.
+        :param direction: (str) Either 'upload' or 'download'.
+        :param delete: (bool) Whether to delete files from the destination that are not in the source.
+        :param checksum: (bool) Whether to record the sha256 checksums of local files, and compare them before
+        uploading a file whose size is unchanged but whose modification time changed.
+        :param exclude: (str or list) Glob patterns; files and directories whose names match are ignored on both sides.
+        :param workers: (int) The number of transfers and deletes made concurrently.
+        :param manifest_path: (str) The SQLite database to record the state in; defaults to a file in
+        SYNC_MANIFEST_DIR named after the client's base_url, the system and both roots.
+        """
+        if direction not in (UPLOAD, DOWNLOAD):
+            raise ValueError(f"direction must be '{UPLOAD}' or '{DOWNLOAD}'; got {direction}.")
+        if isinstance(exclude, str):
+            exclude = [exclude]
+        self.client = client
+        self.local_path = os.path.abspath(local_path)
+        self.system_id = system_id
+        self.remote_path = remote_path
+        self.direction = direction
+        self.delete = delete
+        self.checksum = checksum
+        self.exclude = exclude or []
+        self.workers = workers
+        if not manifest_path:
+            os.makedirs(SYNC_MANIFEST_DIR, mode=0o700, exist_ok=True)
+            key = '|'.join([client.base_url or '', system_id, remote_path, self.local_path])
+            manifest_path = os.path.join(SYNC_MANIFEST_DIR, f"{hashlib.sha1(key.encode('utf-8')).hexdigest()}.sqlite")
+        self.manifest_path = manifest_path
+
+    def _connect(self):
+        db = sqlite3.connect(self.manifest_path)
+        db.execute('CREATE TABLE IF NOT EXISTS files ('
+                   'path TEXT PRIMARY KEY, '
+                   'local_size INTEGER, local_mtime INTEGER, local_checksum TEXT, '
+                   'remote_size INTEGER, remote_mtime TEXT)')
+        return db
+
+    def _records(self, db):
+        return {row[0]: _Record(*row) for row in db.execute('SELECT path, local_size, local_mtime, local_checksum, '
+                                                            'remote_size, remote_mtime FROM files')}
+
+    def _excluded(self, name):
+        return any(fnmatch(name, pattern) for pattern in self.exclude)
+
+    def local_files(self):
+        """
+        Returns the files of the local tree.
+        :return: (dict) The (size, mtime in nanoseconds) of each file, by relative path.
+        """
+        files = {}
+        for dir_path, dir_names, file_names in os.walk(self.local_path):
+            dir_names[:] = [name for name in dir_names if not self._excluded(name)]
+            for name in file_names:
+                if self._excluded(name):
+                    continue
+                full_path = os.path.join(dir_path, name)
+                stat = os.stat(full_path)
+                rel_path = os.path.relpath(full_path, self.local_path).replace(os.sep, '/')
+                files[rel_path] = (stat.st_size, stat.st_mtime_ns)
+        return files
+
+    def remote_files(self):
+        """
+        Returns the files of the remote tree.
+        :return: (dict) The (size, lastModified) of each file, as reported by files.listFiles, by relative path.
+        """
+        root = '/' + self.remote_path.strip('/')
+        files = {}
+        for entry in walk(self.client, self.system_id, self.remote_path, exclude=self.exclude or None,
+                          workers=self.workers):
+            if is_dir(entry):
+                continue
+            path = '/' + entry_path(entry, self.remote_path).lstrip('/')
+            rel_path = posixpath.relpath(path, root) if root != '/' else path.lstrip('/')
+            files[rel_path] = (getattr(entry, 'size', None), str(getattr(entry, 'lastModified', None)))
+        return files
+
+    def _local_unchanged(self, rel_path, local, record):
+        """
+        Determine if a local file is unchanged since it was recorded; returns the result and the checksum, if it was
+        computed.
+        """
+        if record is None:
+            return False, None
+        if local == record.local:
+            return True, record.local_checksum
+        if self.checksum and record.local_checksum and local[0] == record.local[0]:
+            checksum = file_checksum(os.path.join(self.local_path, rel_path))
+            return checksum == record.local_checksum, checksum
+        return False, None
+
+    def plan(self):
+        """
+        Compare both trees with each other and with the manifest and return the actions needed to synchronize them.
+        :return: (list) SyncAction objects; RECORD actions only update the manifest.
+        """
+        db = self._connect()
+        try:
+            records = self._records(db)
+        finally:
+            db.close()
+        local_files = self.local_files()
+        remote_files = self.remote_files()
+        actions = []
+        if self.direction == UPLOAD:
+            for rel_path, local in sorted(local_files.items()):
+                record = records.get(rel_path)
+                remote = remote_files.get(rel_path)
+                local_unchanged, checksum = self._local_unchanged(rel_path, local, record)
+                if remote is None:
+                    remote_unchanged = False
+                elif record is None:
+                    # first run: adopt a remote file of the same size that is not older than the local file.
+                    remote_unchanged = _adopt(local[1], _last_modified_ns(remote[1]), local[0], remote[0])
+                elif record.remote is None:
+                    # uploaded by the last run; adopt whatever the Files API now reports for it.
+                    remote_unchanged = True
+                else:
+                    remote_unchanged = remote == record.remote
+                if record is not None and local_unchanged and remote_unchanged:
+                    if record.remote is None or local != record.local:
+                        actions.append(SyncAction(RECORD, rel_path, local, remote, checksum))
+                    continue
+                kind = RECORD if record is None and remote_unchanged else UPLOAD
+                actions.append(SyncAction(kind, rel_path, local, remote, checksum))
+            if self.delete:
+                actions.extend(SyncAction(DELETE_REMOTE, rel_path, remote=remote)
+                               for rel_path, remote in sorted(remote_files.items()) if rel_path not in local_files)
+        else:
+            for rel_path, remote in sorted(remote_files.items()):
+                record = records.get(rel_path)
+                local = local_files.get(rel_path)
+                if local is None:
+                    local_unchanged = False
+                elif record is None:
+                    # first run: adopt a local file of the same size that is not older than the remote file.
+                    local_unchanged = _adopt(_last_modified_ns(remote[1]), local[1], local[0], remote[0])
+                else:
+                    local_unchanged = local == record.local
+                # a file this manifest last uploaded is adopted as it is now reported.
+                remote_unchanged = record is not None and record.remote in (None, remote)
+                if record is not None and local_unchanged and remote_unchanged:
+                    if record.remote is None:
+                        actions.append(SyncAction(RECORD, rel_path, local, remote))
+                    continue
+                kind = RECORD if record is None and local_unchanged else DOWNLOAD
+                actions.append(SyncAction(kind, rel_path, local, remote))
+            if self.delete:
+                actions.extend(SyncAction(DELETE_LOCAL, rel_path, local=local)
+                               for rel_path, local in sorted(local_files.items()) if rel_path not in remote_files)
+        return actions
+
+    def _remote_file_path(self, rel_path):
+        # paths are relative to the root directory of the system; a leading "/" would double the one in the url.
+        return posixpath.join(self.remote_path, rel_path).lstrip('/')
+
+    def _execute(self, action):
+        """
+        Carry out a single action; returns the number of bytes transferred and the new local state of the file.
+        """
+        local_file_path = os.path.join(self.local_path, *action.path.split('/'))
+        if action.kind == UPLOAD:
+            self.client.upload(local_file_path, self.system_id, self._remote_file_path(action.path))
+            return action.local[0], action.local
+        if action.kind == DOWNLOAD:
+            os.makedirs(os.path.dirname(local_file_path), exist_ok=True)
+            # download to a temporary file so that an interrupted download never leaves a partial file in place.
+            tmp_path = f'{local_file_path}.tapy-sync.tmp'
+            size = self.client.download(self.system_id, self._remote_file_path(action.path), tmp_path)
+            os.replace(tmp_path, local_file_path)
+            stat = os.stat(local_file_path)
+            return size, (stat.st_size, stat.st_mtime_ns)
+        if action.kind == DELETE_REMOTE:
+            self.client.files.delete(systemId=self.system_id, path=self._remote_file_path(action.path))
+        elif action.kind == DELETE_LOCAL:
+            os.remove(local_file_path)
+        return 0, action.local
+
+    def _record(self, db, action, local):
+        if action.kind in (DELETE_REMOTE, DELETE_LOCAL):
+            db.execute('DELETE FROM files WHERE path = ?', (action.path, ))
+            return
+        checksum = action.checksum
+        if self.checksum and checksum is None:
+            checksum = file_checksum(os.path.join(self.local_path, *action.path.split('/')))
+        # the remote state is only known when it was listed after the last change to the remote file.
+        remote = (None, None) if action.kind == UPLOAD or action.remote is None else action.remote
+        db.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)',
+                   (action.path, local[0], local[1], checksum, remote[0], remote[1]))
+
+    def run(self, dry_run=False):
+        """
+        Synchronize the trees. The manifest is updated as each action completes, so an interrupted run can be resumed
+        by running it again.
+        :param dry_run: (bool) Only plan the actions; nothing is transferred, deleted or recorded.
+        :return: (SyncResult)
+        """
+        started = time.monotonic()
+        result = SyncResult(self.plan(), dry_run=dry_run)
+        if dry_run:
+            result.elapsed = time.monotonic() - started
+            return result
+        db = self._connect()
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                futures = {executor.submit(self._execute, action): action for action in result.actions}
+                # record each action as soon as it completes, from this thread only (sqlite connections are not
+                # shared across threads).
+                for future in concurrent.futures.as_completed(futures):
+                    action = futures[future]
+                    try:
+                        size, local = future.result()
+                    except Exception as e:
+                        result.errors.append((action, e))
+                        continue
+                    self._record(db, action, local)
+                    db.commit()
+                    result.completed.append(action)
+                    result.bytes_transferred += size or 0
+        finally:
+            db.close()
+        result.elapsed = time.monotonic() - started
+        return result
+
+
+def sync(client, local_path, system_id, remote_path, direction=UPLOAD, dry_run=False, **kwargs):
+    """
+    Synchronize a local directory tree with a directory tree on a Tapis system; see Sync for the parameters.
+    :return: (SyncResult)
+    """
+    return Sync(client, local_path, system_id, remote_path, direction=direction, **kwargs).run(dry_run=dry_run)
@@ -0,0 +1,94 @@
+"""
+Token caches that can be shared by many DynaTapy clients, including clients in different processes.
+
+A token cache stores the tokens for an identity, keyed by the tuple (base_url, tenant_id, username, account_type), and
+provides a lock per key so that when many processes need tokens for the same identity at once, only one of them calls
+the Tokens or Authenticator API while the others wait and then read the result from the cache. See the token_cache
+parameter of the DynaTapy constructor.
+"""
+from contextlib import contextmanager
+import fcntl
+import hashlib
+import json
+import os
+import threading
+
+# default directory for the FileTokenCache.
+TOKEN_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.tapy', 'tokens')
+
+
+class FileTokenCache(object):
+    """
+    A token cache backed by files in a local directory, using advisory file locks (flock) for mutual exclusion.
+
+    Each key is stored in its own JSON file, named by a digest of the key, next to a lock file used to serialize token
+    requests for that key. The directory and files are created readable by the owner only, since they hold credentials.
+    """
+    def __init__(self, path=None):
+        """
+        :param path: (str) The directory to store the cache in; defaults to TOKEN_CACHE_DIR.
+        """
+        self.path = path or TOKEN_CACHE_DIR
+        os.makedirs(self.path, mode=0o700, exist_ok=True)
+        # flock locks are held per open file description, so threads of one process need their own lock as well.
+        self._thread_locks = {}
+        self._thread_locks_lock = threading.Lock()
+
+    def __getstate__(self):
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'])
+
+    def _file_name(self, key):
+        return hashlib.sha1(json.dumps(list(key)).encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """
+        Returns the tokens stored for a key.
+        :param key: (tuple) The (base_url, tenant_id, username, account_type) of the identity.
+        :return: (dict) The stored tokens, or None if there is no entry for the key.
+        """
+        entry_path = os.path.join(self.path, f'{self._file_name(key)}.json')
+        try:
+            with open(entry_path, 'r') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        # guard against digest collisions -
+        if entry.get('key') != list(key):
+            return None
+        return entry.get('tokens')
+
+    def put(self, key, tokens):
+        """
+        Store the tokens for a key, replacing any existing entry.
+        :param key: (tuple) The (base_url, tenant_id, username, account_type) of the identity.
+        :param tokens: (dict) A JSON-serializable description of the tokens.
+        :return:
+        """
+        entry_path = os.path.join(self.path, f'{self._file_name(key)}.json')
+        # write to a temporary file and rename it into place so readers never see a partial entry.
+        tmp_path = f'{entry_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'key': list(key), 'tokens': tokens}, f)
+        os.replace(tmp_path, entry_path)
+
+    @contextmanager
+    def lock(self, key):
+        """
+        Context manager holding an exclusive lock on a key, across threads and processes.
+        :param key: (tuple) The (base_url, tenant_id, username, account_type) of the identity.
+        """
+        file_name = self._file_name(key)
+        with self._thread_locks_lock:
+            thread_lock = self._thread_locks.setdefault(file_name, threading.Lock())
+        with thread_lock:
+            fd = os.open(os.path.join(self.path, f'{file_name}.lock'), os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                yield
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+                os.close(fd)
@@ -0,0 +1,244 @@
+"""
+A manager for submitting and monitoring many Files transfer tasks at once.
+
+TransferManager creates transfer tasks with files.createTransferTask from a thread pool, with a bound on the number of
+requests in flight, and watches all of them with files.getTransferTask from a single scheduler thread (see
+tapy.dyna.polling). Completion is exposed through a concurrent.futures.Future and optional callback on each
+TransferHandle, and the manager keeps aggregate statistics, including throughput, across all of its transfers.
+"""
+from concurrent.futures import Future, ThreadPoolExecutor
+import concurrent.futures
+import json
+import threading
+import time
+
+import tapy.errors
+from tapy.dyna.polling import PollingScheduler
+
+# statuses of a transfer task that has finished.
+TERMINAL_STATUSES = ('COMPLETED', 'CANCELLED', 'FAILED', )
+
+# the fields of a transfer task request; each entry of a manifest provides these.
+REQUEST_FIELDS = ('sourceSystemId', 'sourcePath', 'destinationSystemId', 'destinationPath', )
+
+
+def load_manifest(path):
+    """
+    Read a transfer manifest from a file, either a JSON array of transfer requests or NDJSON with one transfer request
+    per line. Each request is a dictionary with the sourceSystemId, sourcePath, destinationSystemId and destinationPath
+    fields.
+    :param path: (str) Path to the manifest file.
+    :return: (list) The transfer requests.
+    """
+    with open(path, 'r') as f:
+        content = f.read()
+    if content.lstrip().startswith('['):
+        return json.loads(content)
+    return [json.loads(line) for line in content.splitlines() if line.strip()]
+
+
+class TransferHandle(object):
+    """
+    Tracks a single transfer task. The future attribute is a concurrent.futures.Future that resolves to the handle
+    itself once the task has finished, whatever its final status, or to the exception that prevented the task from
+    being created or monitored.
+    """
+    def __init__(self, request, callback=None):
+        # the transfer request (see REQUEST_FIELDS)
+        self.request = request
+
+        # the uuid of the transfer task; None until the task has been created.
+        self.uuid = None
+
+        # the last known status of the transfer task
+        self.status = None
+
+        # the last transfer task description returned by the Files API
+        self.task = None
+
+        # the number of bytes transferred so far, and the total, as last reported by the Files API
+        self.bytes_transferred = 0
+        self.total_bytes = None
+
+        self.future = Future()
+        if callback:
+            self.future.add_done_callback(lambda future: callback(self))
+
+    def __repr__(self):
+        return f'<TransferHandle {self.uuid}: {self.status}>'
+
+    def done(self):
+        return self.future.done()
+
+    def wait(self, timeout=None):
+        """
+        Block until the transfer task has finished and return the handle.
+        :param timeout: (float) Maximum number of seconds to wait.
+        """
+        return self.future.result(timeout=timeout)
+
+
+class TransferManager(PollingScheduler):
+    """
+    Submits transfer tasks with bounded concurrency and monitors them all from a single scheduler thread.
+    """
+    def __init__(self, client, max_in_flight=8, **kwargs):
+        """
+        :param client: (DynaTapy) The client to make requests with.
+        :param max_in_flight: (int) Maximum number of createTransferTask and cancelTransferTask requests made at a time.
+        :param kwargs: Polling parameters; see PollingScheduler.
+        """
+        kwargs.setdefault('min_interval', 1)
+        super().__init__(**kwargs)
+        self.client = client
+        self._submitter = ThreadPoolExecutor(max_workers=max_in_flight)
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._handles = []
+        self._lock = threading.Lock()
+        self._started = None
+
+    def _create(self, handle):
+        try:
+            task = self.client.files.createTransferTask(**handle.request)
+        except Exception as e:
+            handle.status = 'FAILED'
+            handle.future.set_exception(e)
+            return
+        finally:
+            self._slots.release()
+        self._update(handle, task)
+        handle.uuid = getattr(task, 'uuid', None)
+        if handle.status in TERMINAL_STATUSES:
+            handle.future.set_result(handle)
+        elif not handle.uuid:
+            # there is nothing to monitor the task by.
+            handle.future.set_exception(tapy.errors.InvalidServerResponseError(
+                msg=f'The transfer task created for {handle.request} has no uuid.'))
+        else:
+            self.track(handle)
+
+    def _update(self, handle, task):
+        handle.task = task
+        handle.status = getattr(task, 'status', None)
+        handle.bytes_transferred = getattr(task, 'bytesTransferred', None) or handle.bytes_transferred
+        handle.total_bytes = getattr(task, 'totalBytes', None) or handle.total_bytes
+
+    def submit(self, sourceSystemId, sourcePath, destinationSystemId, destinationPath, callback=None):
+        """
+        Create a transfer task without waiting for it; blocks while max_in_flight requests are outstanding.
+        :param callback: (callable) Called with the TransferHandle once the task has finished.
+        :return: (TransferHandle)
+        """
+        handle = TransferHandle({'sourceSystemId': sourceSystemId,
+                                 'sourcePath': sourcePath,
+                                 'destinationSystemId': destinationSystemId,
+                                 'destinationPath': destinationPath}, callback=callback)
+        with self._lock:
+            if self._started is None:
+                self._started = time.monotonic()
+            self._handles.append(handle)
+        self._slots.acquire()
+        self._submitter.submit(self._create, handle)
+        return handle
+
+    def submit_manifest(self, manifest, callback=None):
+        """
+        Create a transfer task for each request in a manifest.
+        :param manifest: An iterable of transfer requests (dictionaries with the REQUEST_FIELDS), or the path to a
+        manifest file; see load_manifest().
+        :param callback: (callable) Called with each TransferHandle once its task has finished.
+        :return: (list) The TransferHandle objects, in order.
+        """
+        if isinstance(manifest, str):
+            manifest = load_manifest(manifest)
+        return [self.submit(callback=callback, **{field: request[field] for field in REQUEST_FIELDS})
+                for request in manifest]
+
+    def poll(self, handle):
+        self._update(handle, self.client.files.getTransferTask(transferTaskId=handle.uuid))
+        if handle.status in TERMINAL_STATUSES:
+            handle.future.set_result(handle)
+            return True, handle.status
+        return False, handle.status
+
+    def failed(self, handle, exception):
+        handle.future.set_exception(exception)
+
+    def abandoned(self, handle):
+        # the manager was closed before the task finished; wait() raises CancelledError rather than blocking. The
+        # transfer task itself is left running.
+        handle.future.cancel()
+
+    def history(self, handle):
+        """
+        Returns the history of a transfer task.
+        """
+        return self.client.files.getTransferTaskHistory(transferTaskId=handle.uuid)
+
+    def _cancel(self, handle):
+        try:
+            self.client.files.cancelTransferTask(transferTaskId=handle.uuid)
+        finally:
+            self._slots.release()
+
+    def cancel(self, handles=None):
+        """
+        Cancel transfer tasks concurrently; the tasks are still monitored until the Files API reports them finished.
+        :param handles: (list) The TransferHandle objects to cancel; defaults to all of the unfinished ones.
+        :return: (list) The handles for which the cancel request failed, paired with the exception raised.
+        """
+        if handles is None:
+            with self._lock:
+                handles = list(self._handles)
+        futures = {}
+        for handle in handles:
+            if handle.done() or not handle.uuid:
+                continue
+            self._slots.acquire()
+            futures[self._submitter.submit(self._cancel, handle)] = handle
+        concurrent.futures.wait(futures.keys())
+        return [(handle, future.exception()) for future, handle in futures.items() if future.exception()]
+
+    def wait(self, handles=None, timeout=None):
+        """
+        Block until the transfer tasks have finished, or the timeout expires.
+        :param handles: (list) The TransferHandle objects to wait for; defaults to all of them.
+        :param timeout: (float) Maximum number of seconds to wait.
+        :return: (tuple) The lists of finished and not finished handles.
+        """
+        if handles is None:
+            with self._lock:
+                handles = list(self._handles)
+        by_future = {handle.future: handle for handle in handles}
+        done, not_done = concurrent.futures.wait(by_future.keys(), timeout=timeout)
+        return [by_future[f] for f in done], [by_future[f] for f in not_done]
+
+    def stats(self):
+        """
+        Returns aggregate statistics for all of the transfers submitted to this manager: the number of tasks in each
+        status, the number of bytes transferred so far, and the throughput in bytes per second since the first task was
+        submitted.
+        """
+        with self._lock:
+            handles = list(self._handles)
+            started = self._started
+        statuses = {}
+        for handle in handles:
+            statuses[handle.status] = statuses.get(handle.status, 0) + 1
+        bytes_transferred = sum(handle.bytes_transferred or 0 for handle in handles)
+        elapsed = time.monotonic() - started if started else 0
+        return {'submitted': len(handles),
+                'finished': len([handle for handle in handles if handle.done()]),
+                'statuses': statuses,
+                'bytes_transferred': bytes_transferred,
+                'total_bytes': sum(handle.total_bytes or 0 for handle in handles),
+                'elapsed': elapsed,
+                'throughput': bytes_transferred / elapsed if elapsed else 0}
+
+    def close(self):
+        """
+        Wait for the requests being made, and stop monitoring the transfer tasks; the futures of the tasks that have
+        not finished yet are cancelled, but the tasks themselves are not.
+        """
+        self._submitter.shutdown(wait=True)
+        super().close()
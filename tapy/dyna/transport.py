@@ -0,0 +1,543 @@
+"""
+Pluggable transports for DynaTapy.
+
+A transport is any object with a `send(request, **kwargs)` method that accepts a requests.PreparedRequest and returns a
+requests.Response; this is the same contract as requests.Session.send(). Every HTTP exchange made by a DynaTapy client
+(each Operation call as well as the upload() convenience method) goes through the client's transport, so swapping the
+transport changes how (and whether) requests reach the network without touching the rest of the SDK.
+"""
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
+import os
+import socket
+import threading
+import time
+
+import requests
+import requests.adapters
+import urllib3
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+try:
+    import httpx
+except ImportError:
+    # httpx is an optional dependency, only needed for the HTTP2Transport.
+    httpx = None
+
+import tapy.errors
+
+# request headers that carry credentials; these are never written to a cassette file.
+SENSITIVE_HEADERS = ('x-tapis-token', 'authorization', 'cookie', )
+
+# response headers describing the wire encoding of the body; recorded bodies are already decoded, so these are dropped.
+ENCODING_HEADERS = ('content-encoding', 'transfer-encoding', )
+
+
+def _body_bytes(body):
+    """
+    Return the bytes of a prepared request body, or None if the body is empty or is a stream that cannot be read
+    without consuming it.
+    :param body: The body attribute of a requests.PreparedRequest.
+    :return: (bytes or None)
+    """
+    if body is None:
+        return None
+    if isinstance(body, str):
+        return body.encode('utf-8')
+    if isinstance(body, (bytes, bytearray, memoryview)):
+        return bytes(body)
+    return None
+
+
+def _digest(content):
+    """
+    Returns the hex digest used to name body blobs and to match requests on replay.
+    """
+    if content is None:
+        return None
+    return hashlib.sha1(content).hexdigest()
+
+
+class SessionTransport(object):
+    """
+    The default transport; sends each request over a requests.Session.
+    """
+    def __init__(self, session=None):
+        """
+        :param session: (requests.Session) The session to send requests with; a new one is created if not passed.
+        """
+        self.session = session or requests.Session()
+
+    def send(self, request, **kwargs):
+        return self.session.send(request, **kwargs)
+
+    def reset(self):
+        """
+        Start over with a new session, e.g., in a child process after a fork; the connections pooled by the old session
+        are left for the parent to use.
+        """
+        self.session = requests.Session()
+
+
+class DNSCache(object):
+    """
+    A thread-safe cache of host name resolutions with a time to live.
+    """
+    def __init__(self, ttl=300):
+        """
+        :param ttl: (float) The number of seconds a resolution is reused for.
+        """
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def resolve(self, host, port):
+        """
+        Returns the address to connect to for a host, resolving it if it is not cached or has expired.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get((host, port))
+        if entry and entry[0] > now:
+            return entry[1]
+        address = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)[0][4][0]
+        with self._lock:
+            self._entries[(host, port)] = (now + self.ttl, address)
+        return address
+
+    def invalidate(self, host, port):
+        with self._lock:
+            self._entries.pop((host, port), None)
+
+
+class _CachedDNSConnectionMixin(object):
+    """
+    Makes a urllib3 connection class connect to the address of its host in a DNSCache. The host itself is still used
+    for the Host header, SNI and certificate verification.
+    """
+    dns_cache = None
+
+    def _new_conn(self):
+        # urllib3 derives the host from _dns_host, so it is only swapped for the address while the socket is opened.
+        dns_host = self._dns_host
+        try:
+            self._dns_host = self.dns_cache.resolve(dns_host, self.port)
+        except OSError:
+            # let urllib3 resolve the host and report the error.
+            return super()._new_conn()
+        try:
+            return super()._new_conn()
+        except Exception:
+            # the address may be stale.
+            self.dns_cache.invalidate(dns_host, self.port)
+            raise
+        finally:
+            self._dns_host = dns_host
+
+
+class _KeepAliveAdapter(requests.adapters.HTTPAdapter):
+    """
+    An HTTPAdapter whose connections enable TCP keepalive probes and resolve hosts through a DNSCache.
+    """
+    def __init__(self, dns_cache=None, tcp_keepalive_idle=None, **kwargs):
+        self.dns_cache = dns_cache
+        self.tcp_keepalive_idle = tcp_keepalive_idle
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):
+        socket_options = list(urllib3.connection.HTTPConnection.default_socket_options)
+        if self.tcp_keepalive_idle:
+            socket_options.append((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1))
+            # the keepalive timing options are not available on every platform.
+            if hasattr(socket, 'TCP_KEEPIDLE'):
+                socket_options.append((socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, int(self.tcp_keepalive_idle)))
+            if hasattr(socket, 'TCP_KEEPINTVL'):
+                socket_options.append((socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, int(self.tcp_keepalive_idle)))
+        pool_kwargs['socket_options'] = socket_options
+        super().init_poolmanager(connections, maxsize, block=block, **pool_kwargs)
+        if self.dns_cache is None:
+            return
+        pool_classes = {}
+        for scheme, pool_class in self.poolmanager.pool_classes_by_scheme.items():
+            connection_class = type(pool_class.ConnectionCls.__name__, (_CachedDNSConnectionMixin,
+                                                                        pool_class.ConnectionCls),
+                                    {'dns_cache': self.dns_cache})
+            pool_classes[scheme] = type(pool_class.__name__, (pool_class, ), {'ConnectionCls': connection_class})
+        self.poolmanager.pool_classes_by_scheme = pool_classes
+
+
+class KeepAliveTransport(object):
+    """
+    A transport for latency-sensitive clients that keeps warm connections to the servers it talks to.
+
+    Connections are pooled by a requests.Session as with SessionTransport, but the transport can also open a number of
+    keep-alive connections to a server ahead of time (see warmup()), caches DNS resolutions, enables TCP keepalive
+    probes on its sockets, and, when it has been idle for keepalive_interval seconds, sends lightweight HEAD requests to
+    the servers it warmed up so that their pooled connections are not closed for inactivity.
+    """
+    def __init__(self, session=None, pool_maxsize=10, dns_ttl=300, tcp_keepalive_idle=60, keepalive_interval=30,
+                 warmup_timeout=5):
+        """
+        :param session: (requests.Session) The session to send requests with; a new one is created if not passed.
+        :param pool_maxsize: (int) The maximum number of connections kept per server.
+        :param dns_ttl: (float) The number of seconds DNS resolutions are cached for; None to disable the cache.
+        :param tcp_keepalive_idle: (int) The number of idle seconds after which TCP keepalive probes are sent; None to
+        disable them.
+        :param keepalive_interval: (float) The number of idle seconds after which the warmed up servers are pinged;
+        None to disable pings.
+        :param warmup_timeout: (float) The timeout, in seconds, of warmup and keepalive requests.
+        """
+        self.pool_maxsize = pool_maxsize
+        self.dns_ttl = dns_ttl
+        self.tcp_keepalive_idle = tcp_keepalive_idle
+        self.keepalive_interval = keepalive_interval
+        self.warmup_timeout = warmup_timeout
+        self.dns_cache = DNSCache(dns_ttl) if dns_ttl else None
+        self.session = session or requests.Session()
+        self._mount(self.session)
+        # the servers to keep warm: url -> (number of connections, verify).
+        self._warm = {}
+        self._last_used = time.monotonic()
+        self._lock = threading.Lock()
+        self._keepalive_thread = None
+        self._closed = threading.Event()
+
+    def __getstate__(self):
+        return {'pool_maxsize': self.pool_maxsize, 'dns_ttl': self.dns_ttl,
+                'tcp_keepalive_idle': self.tcp_keepalive_idle, 'keepalive_interval': self.keepalive_interval,
+                'warmup_timeout': self.warmup_timeout}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def _mount(self, session):
+        for prefix in ('https://', 'http://'):
+            session.mount(prefix, _KeepAliveAdapter(dns_cache=self.dns_cache,
+                                                    tcp_keepalive_idle=self.tcp_keepalive_idle,
+                                                    pool_maxsize=self.pool_maxsize))
+
+    def send(self, request, **kwargs):
+        self._last_used = time.monotonic()
+        return self.session.send(request, **kwargs)
+
+    def warmup(self, url, connections=4, verify=True):
+        """
+        Open keep-alive connections to a server, by sending concurrent HEAD requests to it, and keep them warm from
+        then on.
+        :param url: (str) A url on the server, such as the base_url of a client.
+        :param connections: (int) The number of connections to open; at most pool_maxsize are kept.
+        :param verify: (bool) Whether to verify the TLS certificate of the server.
+        :return: (list) The exceptions raised by the requests that failed.
+        """
+        connections = min(connections, self.pool_maxsize)
+        with self._lock:
+            self._warm[url] = (connections, verify)
+            # a thread inherited through a fork is not running in the child.
+            if self.keepalive_interval and not (self._keepalive_thread and self._keepalive_thread.is_alive()):
+                self._keepalive_thread = threading.Thread(target=self._keepalive, daemon=True)
+                self._keepalive_thread.start()
+        return self._ping(url, connections, verify)
+
+    def _ping(self, url, connections, verify):
+        # the requests are in flight at the same time, so each one needs a connection of its own. They are sent like
+        # the client's requests (rather than with session.head(), which merges in environment settings), so that they
+        # use the same connection pool.
+        session = self.session
+        with ThreadPoolExecutor(max_workers=connections) as executor:
+            futures = [executor.submit(session.send, requests.Request('HEAD', url).prepare(), verify=verify,
+                                       timeout=self.warmup_timeout)
+                       for _ in range(connections)]
+        return [future.exception() for future in futures if future.exception()]
+
+    def _keepalive(self):
+        while not self._closed.wait(self.keepalive_interval / 2):
+            if time.monotonic() - self._last_used < self.keepalive_interval:
+                continue
+            self._last_used = time.monotonic()
+            with self._lock:
+                warm = list(self._warm.items())
+            for url, (connections, verify) in warm:
+                self._ping(url, connections, verify)
+
+    def reset(self):
+        """
+        Start over with a new session and forget the servers to keep warm, e.g., in a child process after a fork.
+        """
+        self.session = requests.Session()
+        self._mount(self.session)
+        with self._lock:
+            self._warm = {}
+
+    def close(self):
+        self._closed.set()
+        self.session.close()
+
+
+class _HTTPXRaw(object):
+    """
+    Exposes a streamed httpx response as the raw attribute of a requests.Response, so that iter_content() works.
+    """
+    def __init__(self, response):
+        self._response = response
+        self._chunks = response.iter_bytes()
+        self._buffer = b''
+
+    def read(self, amt=None, **kwargs):
+        while amt is None or len(self._buffer) < amt:
+            try:
+                self._buffer += next(self._chunks)
+            except StopIteration:
+                break
+        if amt is None:
+            data, self._buffer = self._buffer, b''
+        else:
+            data, self._buffer = self._buffer[:amt], self._buffer[amt:]
+        if not data:
+            self.close()
+        return data
+
+    def close(self):
+        self._response.close()
+
+    def release_conn(self):
+        self.close()
+
+
+class HTTP2Transport(object):
+    """
+    Sends requests with httpx, multiplexing concurrent requests to a server over a few HTTP/2 connections.
+
+    HTTP/2 is negotiated with each server through ALPN; servers that do not support it are talked to over HTTP/1.1 on
+    the same connection pool. Responses are returned as requests.Response objects, so the transport can be used in
+    place of the default one. Requires the optional httpx package, with its http2 extra (pip install httpx[http2]).
+    """
+    def __init__(self, http2=True, max_connections=10, max_keepalive_connections=10, keepalive_expiry=30):
+        """
+        :param http2: (bool) Whether to offer HTTP/2 to servers.
+        :param max_connections: (int) The maximum number of connections, across servers.
+        :param max_keepalive_connections: (int) The maximum number of idle connections kept open.
+        :param keepalive_expiry: (float) The number of seconds idle connections are kept open for.
+        """
+        if httpx is None:
+            raise tapy.errors.TapyClientConfigurationError(
+                msg='The HTTP2Transport requires the httpx package; install it with: pip install httpx[http2]')
+        self.http2 = http2
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self.keepalive_expiry = keepalive_expiry
+        # an httpx.Client holds its TLS verification setting, so there is one client per verify value.
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        return {'http2': self.http2, 'max_connections': self.max_connections,
+                'max_keepalive_connections': self.max_keepalive_connections, 'keepalive_expiry': self.keepalive_expiry}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def _client(self, verify):
+        with self._lock:
+            client = self._clients.get(verify)
+            if client is None:
+                try:
+                    import h2
+                    http2 = self.http2
+                except ImportError:
+                    # without the http2 extra, httpx can only speak HTTP/1.1.
+                    http2 = False
+                limits = httpx.Limits(max_connections=self.max_connections,
+                                      max_keepalive_connections=self.max_keepalive_connections,
+                                      keepalive_expiry=self.keepalive_expiry)
+                client = httpx.Client(http2=http2, verify=verify, limits=limits)
+                self._clients[verify] = client
+            return client
+
+    def send(self, request, verify=True, stream=False, timeout=None, **kwargs):
+        if isinstance(timeout, tuple):
+            timeout = httpx.Timeout(timeout[1], connect=timeout[0])
+        else:
+            timeout = httpx.Timeout(timeout)
+        body = request.body
+        if isinstance(body, memoryview):
+            body = bytes(body)
+        # httpx frames the body itself, and HTTP/2 forbids connection-specific headers.
+        headers = {name: value for name, value in request.headers.items()
+                   if name.lower() not in ('transfer-encoding', 'connection')}
+        client = self._client(verify)
+        httpx_request = client.build_request(request.method, request.url, headers=headers, content=body,
+                                             timeout=timeout)
+        httpx_response = client.send(httpx_request, stream=stream)
+        response = requests.models.Response()
+        response.status_code = httpx_response.status_code
+        response.reason = httpx_response.reason_phrase
+        response.headers = CaseInsensitiveDict(httpx_response.headers.multi_items())
+        # the content is decoded by httpx.
+        for header in ENCODING_HEADERS:
+            response.headers.pop(header, None)
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.url = str(httpx_response.url)
+        response.request = request
+        # the HTTP version negotiated with the server, e.g., HTTP/2.
+        response.http_version = httpx_response.http_version
+        if stream:
+            response.raw = _HTTPXRaw(httpx_response)
+        else:
+            response._content = httpx_response.content
+            response._content_consumed = True
+        return response
+
+    def reset(self):
+        """
+        Start over with new connection pools, e.g., in a child process after a fork.
+        """
+        with self._lock:
+            self._clients = {}
+
+    def close(self):
+        with self._lock:
+            clients, self._clients = self._clients, {}
+        for client in clients.values():
+            client.close()
+
+
+class RecordingTransport(object):
+    """
+    Sends requests with an inner transport and records each request/response pair to a cassette.
+
+    A cassette is an NDJSON file with one line per exchange plus a sibling directory, `<cassette>.bodies`, holding the
+    request and response bodies as blobs named by their sha1 digest, so identical bodies are stored once. Credential
+    headers (see SENSITIVE_HEADERS) are not recorded.
+    """
+    def __init__(self, cassette_path, transport=None):
+        """
+        :param cassette_path: (str) Path to the NDJSON cassette file; new exchanges are appended to it.
+        :param transport: The transport used to actually send requests; defaults to a new SessionTransport.
+        """
+        self.cassette_path = cassette_path
+        self.bodies_path = f'{cassette_path}.bodies'
+        self.transport = transport or SessionTransport()
+        self._lock = threading.Lock()
+        os.makedirs(self.bodies_path, exist_ok=True)
+
+    def __getstate__(self):
+        return {'cassette_path': self.cassette_path, 'transport': self.transport}
+
+    def __setstate__(self, state):
+        self.__init__(state['cassette_path'], transport=state['transport'])
+
+    def reset(self):
+        if hasattr(self.transport, 'reset'):
+            self.transport.reset()
+
+    def _write_blob(self, content):
+        digest = _digest(content)
+        if digest:
+            blob_path = os.path.join(self.bodies_path, digest)
+            if not os.path.exists(blob_path):
+                with open(blob_path, 'wb') as f:
+                    f.write(content)
+        return digest
+
+    def send(self, request, **kwargs):
+        response = self.transport.send(request, **kwargs)
+        request_body = _body_bytes(request.body)
+        entry = {'method': request.method,
+                 'url': request.url,
+                 'request_headers': {k: v for k, v in request.headers.items()
+                                     if k.lower() not in SENSITIVE_HEADERS},
+                 'request_body': _digest(request_body),
+                 'status_code': response.status_code,
+                 'reason': response.reason,
+                 'headers': {k: v for k, v in response.headers.items() if k.lower() not in ENCODING_HEADERS},
+                 'elapsed': response.elapsed.total_seconds() if response.elapsed else None,
+                 }
+        with self._lock:
+            if request_body is not None:
+                self._write_blob(request_body)
+            entry['body'] = self._write_blob(response.content)
+            with open(self.cassette_path, 'a') as f:
+                f.write(json.dumps(entry, separators=(',', ':')) + '\n')
+        return response
+
+
+class ReplayTransport(object):
+    """
+    Serves responses from a cassette written by RecordingTransport without opening any sockets.
+
+    The whole cassette, including body blobs, is read into memory when the transport is created so that replaying is
+    free of file and network I/O. Requests are matched on method, URL and request body digest, falling back to method
+    and URL only; repeated requests are answered in the order they were recorded.
+    """
+    def __init__(self, cassette_path, cycle=False):
+        """
+        :param cassette_path: (str) Path to the NDJSON cassette file.
+        :param cycle: (bool) Whether to start over with the first recorded response once all the responses for a
+        request have been served; useful when replaying the same traffic repeatedly for profiling.
+        """
+        self.cassette_path = cassette_path
+        self.cycle = cycle
+        self._lock = threading.Lock()
+        self._blobs = {}
+        self._recorded = defaultdict(list)
+        bodies_path = f'{cassette_path}.bodies'
+        with open(cassette_path, 'r') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                digest = entry.get('body')
+                if digest and digest not in self._blobs:
+                    with open(os.path.join(bodies_path, digest), 'rb') as blob:
+                        self._blobs[digest] = blob.read()
+                self._recorded[(entry['method'], entry['url'])].append(entry)
+        # per (method, url) queues of the entries not yet served.
+        self._pending = {k: deque(v) for k, v in self._recorded.items()}
+
+    def __getstate__(self):
+        # the cassette is loaded again when unpickled, so replaying starts over from the first recorded response.
+        return {'cassette_path': self.cassette_path, 'cycle': self.cycle}
+
+    def __setstate__(self, state):
+        self.__init__(state['cassette_path'], cycle=state['cycle'])
+
+    def _next(self, method, url, digest):
+        """
+        Pop the next recorded entry for a request, preferring one whose request body matches.
+        """
+        key = (method, url)
+        queue = self._pending.get(key)
+        if queue is None:
+            return None
+        if not queue:
+            if not self.cycle:
+                return None
+            queue.extend(self._recorded[key])
+        for entry in queue:
+            if entry.get('request_body') == digest:
+                queue.remove(entry)
+                return entry
+        return queue.popleft()
+
+    def _build_response(self, entry, request):
+        response = requests.models.Response()
+        response.status_code = entry['status_code']
+        response.reason = entry.get('reason')
+        response.headers = CaseInsensitiveDict(entry.get('headers', {}))
+        response.encoding = get_encoding_from_headers(response.headers)
+        response._content = self._blobs.get(entry.get('body'), b'')
+        response._content_consumed = True
+        response.url = request.url
+        response.request = request
+        return response
+
+    def send(self, request, **kwargs):
+        digest = _digest(_body_bytes(request.body))
+        with self._lock:
+            entry = self._next(request.method, request.url, digest)
+        if entry is None:
+            raise LookupError(f"No recorded response in cassette {self.cassette_path} for {request.method} "
+                              f"{request.url}.")
+        return self._build_response(entry, request)
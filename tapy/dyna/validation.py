@@ -0,0 +1,398 @@
+"""
+Client-side validation of the arguments to DynaTapy operations against the parameter and request body schemas in the
+specs.
+
+The schemas of an operation are compiled, the first time the operation is validated, into a tree of small check
+functions (closures specialized for each schema: its type, enum, bounds, properties, items, ...), which are cached for
+the lifetime of the operation description, so validating a call costs microseconds and never walks the spec. All of the
+problems found are reported at once in a tapy.errors.RequestValidationError, each with the path of the offending value,
+such as "request_body[3].tags[0]".
+
+Validation is opt-in: see the validate_requests parameter of the DynaTapy constructor, the _tapis_validate argument to
+operations, and Operation.validate(). The "format" of string schemas is not checked.
+"""
+import numbers
+import re
+import threading
+import weakref
+
+import tapy.errors
+
+# arguments that operations accept besides their parameters and request body properties.
+SPECIAL_ARGUMENTS = ('headers', '_tapis_debug', '_tapis_priority', 'use_basic_auth', )
+
+# the most problems reported in a RequestValidationError.
+MAX_ERRORS = 20
+
+# the schema types that are checked.
+SCHEMA_TYPES = ('string', 'integer', 'number', 'boolean', 'array', 'object', )
+
+
+def _value(obj):
+    # openapi_core uses enums for schema types, parameter locations, etc.
+    return getattr(obj, 'value', obj)
+
+
+def schema_to_dict(schema, _converted=None, _converting=None):
+    """
+    Convert an openapi_core Schema object to a plain dictionary with the OpenAPI keywords ("type", "properties", ...),
+    the form the schemas take in the resources generated by tapy.dyna.codegen. Recursive references are replaced with
+    an empty (any value) schema.
+    :param schema: (openapi_core.schema.schemas.models.Schema) The schema, or None.
+    :return: (dict)
+    """
+    if schema is None:
+        return {}
+    if _converted is None:
+        _converted, _converting = {}, set()
+    if id(schema) in _converted:
+        return _converted[id(schema)]
+    if id(schema) in _converting:
+        return {}
+    _converting.add(id(schema))
+    result = {}
+    schema_type = _value(getattr(schema, 'type', None))
+    if schema_type and schema_type != 'any':
+        result['type'] = schema_type
+    if getattr(schema, 'nullable', False):
+        result['nullable'] = True
+    if getattr(schema, 'enum', None):
+        result['enum'] = list(schema.enum)
+    for key, attr in (('minimum', 'minimum'), ('maximum', 'maximum'), ('multipleOf', 'multiple_of'),
+                      ('minLength', 'min_length'), ('maxLength', 'max_length'), ('minItems', 'min_items'),
+                      ('maxItems', 'max_items'), ('minProperties', 'min_properties'),
+                      ('maxProperties', 'max_properties')):
+        if getattr(schema, attr, None) is not None:
+            result[key] = getattr(schema, attr)
+    for key, attr in (('exclusiveMinimum', 'exclusive_minimum'), ('exclusiveMaximum', 'exclusive_maximum'),
+                      ('uniqueItems', 'unique_items')):
+        if getattr(schema, attr, False):
+            result[key] = True
+    pattern = getattr(schema, 'pattern', None)
+    if pattern is not None:
+        result['pattern'] = getattr(pattern, 'pattern', pattern)
+    if getattr(schema, 'properties', None):
+        result['properties'] = {name: schema_to_dict(prop, _converted, _converting)
+                                for name, prop in schema.properties.items()}
+    if getattr(schema, 'required', None):
+        result['required'] = list(schema.required)
+    additional_properties = getattr(schema, 'additional_properties', True)
+    if additional_properties is False:
+        result['additionalProperties'] = False
+    elif additional_properties not in (True, None):
+        result['additionalProperties'] = schema_to_dict(additional_properties, _converted, _converting)
+    if getattr(schema, 'items', None) is not None:
+        result['items'] = schema_to_dict(schema.items, _converted, _converting)
+    for key, attr in (('allOf', 'all_of'), ('oneOf', 'one_of'), ('anyOf', 'any_of')):
+        if getattr(schema, attr, None):
+            result[key] = [schema_to_dict(s, _converted, _converting) for s in getattr(schema, attr)]
+    _converting.discard(id(schema))
+    _converted[id(schema)] = result
+    return result
+
+
+def operation_schemas(op_desc):
+    """
+    Returns the schemas of an operation as plain dictionaries: {"parameters": {name: schema}, "request_body":
+    {content type: schema}}.
+    :param op_desc: An openapi_core Operation, or an OperationDescription from a generated resource.
+    """
+    if hasattr(op_desc, 'schemas'):
+        # an OperationDescription; generated without schemas, no arguments can be checked but the required ones.
+        return op_desc.schemas or {'parameters': {}, 'request_body': {}}
+    converted, converting = {}, set()
+    parameters = {name: schema_to_dict(getattr(p, 'schema', None), converted, converting)
+                  for name, p in op_desc.parameters.items()}
+    request_body = {}
+    if op_desc.request_body is not None:
+        request_body = {content_type: schema_to_dict(getattr(media_type, 'schema', None), converted, converting)
+                        for content_type, media_type in op_desc.request_body.content.items()}
+    return {'parameters': parameters, 'request_body': request_body}
+
+
+def _type_name(value):
+    return type(value).__name__
+
+
+def _is_type(value, schema_type):
+    if schema_type == 'string':
+        return isinstance(value, str)
+    if schema_type == 'integer':
+        return isinstance(value, numbers.Integral) and not isinstance(value, bool)
+    if schema_type == 'number':
+        return isinstance(value, numbers.Real) and not isinstance(value, bool)
+    if schema_type == 'boolean':
+        return isinstance(value, bool)
+    if schema_type == 'array':
+        return isinstance(value, (list, tuple))
+    if schema_type == 'object':
+        return isinstance(value, dict)
+    return True
+
+
+def compile_schema(schema, _compiled=None):
+    """
+    Compile a schema into a check function, check(value, path, errors), which appends the (path, message) of each
+    problem with value to the errors list.
+    :param schema: (dict) The schema, as returned by schema_to_dict().
+    :return: (callable)
+    """
+    if _compiled is None:
+        _compiled = {}
+    if id(schema) in _compiled:
+        return _compiled[id(schema)]
+    checks = []
+    schema_type = schema.get('type')
+    nullable = schema.get('nullable', False)
+
+    if 'enum' in schema:
+        allowed = schema['enum']
+        if schema_type == 'string':
+            # YAML loads unquoted enum values such as true and false as booleans; compare their string forms.
+            allowed = [_to_string(v) for v in allowed]
+
+        def check_enum(value, path, errors):
+            if value not in allowed:
+                errors.append((path, f'must be one of {allowed}, not {value!r}'))
+        checks.append(check_enum)
+
+    if schema_type in ('integer', 'number'):
+        minimum, maximum = schema.get('minimum'), schema.get('maximum')
+        exclusive_minimum, exclusive_maximum = schema.get('exclusiveMinimum'), schema.get('exclusiveMaximum')
+        multiple_of = schema.get('multipleOf')
+        if minimum is not None or maximum is not None or multiple_of:
+            def check_bounds(value, path, errors):
+                if minimum is not None and (value <= minimum if exclusive_minimum else value < minimum):
+                    errors.append((path, f'must be {"greater than" if exclusive_minimum else "at least"} {minimum}'))
+                if maximum is not None and (value >= maximum if exclusive_maximum else value > maximum):
+                    errors.append((path, f'must be {"less than" if exclusive_maximum else "at most"} {maximum}'))
+                if multiple_of and value % multiple_of:
+                    errors.append((path, f'must be a multiple of {multiple_of}'))
+            checks.append(check_bounds)
+
+    if schema_type == 'string':
+        min_length, max_length = schema.get('minLength'), schema.get('maxLength')
+        pattern = schema.get('pattern')
+        if pattern is not None:
+            pattern = re.compile(pattern)
+        if min_length is not None or max_length is not None or pattern is not None:
+            def check_string(value, path, errors):
+                if min_length is not None and len(value) < min_length:
+                    errors.append((path, f'must be at least {min_length} characters long'))
+                if max_length is not None and len(value) > max_length:
+                    errors.append((path, f'must be at most {max_length} characters long'))
+                if pattern is not None and not pattern.search(value):
+                    errors.append((path, f'must match the pattern {pattern.pattern!r}'))
+            checks.append(check_string)
+
+    if schema_type == 'array' or 'items' in schema:
+        item_check = compile_schema(schema['items'], _compiled) if schema.get('items') else None
+        min_items, max_items = schema.get('minItems'), schema.get('maxItems')
+        unique_items = schema.get('uniqueItems')
+
+        def check_array(value, path, errors):
+            if not isinstance(value, (list, tuple)):
+                return
+            if min_items is not None and len(value) < min_items:
+                errors.append((path, f'must have at least {min_items} items'))
+            if max_items is not None and len(value) > max_items:
+                errors.append((path, f'must have at most {max_items} items'))
+            if unique_items and len({repr(item) for item in value}) < len(value):
+                errors.append((path, 'must not have duplicate items'))
+            if item_check is not None:
+                for index, item in enumerate(value):
+                    if len(errors) >= MAX_ERRORS:
+                        return
+                    item_check(item, f'{path}[{index}]', errors)
+        checks.append(check_array)
+
+    if schema_type == 'object' or 'properties' in schema or 'required' in schema:
+        property_checks = {name: compile_schema(prop, _compiled)
+                           for name, prop in schema.get('properties', {}).items()}
+        required = schema.get('required', [])
+        additional = schema.get('additionalProperties', True)
+        additional_check = compile_schema(additional, _compiled) if isinstance(additional, dict) else None
+        min_properties, max_properties = schema.get('minProperties'), schema.get('maxProperties')
+
+        def check_object(value, path, errors):
+            if not isinstance(value, dict):
+                return
+            prefix = f'{path}.' if path else ''
+            for name in required:
+                if name not in value:
+                    errors.append((f'{prefix}{name}', 'is required'))
+            if min_properties is not None and len(value) < min_properties:
+                errors.append((path, f'must have at least {min_properties} properties'))
+            if max_properties is not None and len(value) > max_properties:
+                errors.append((path, f'must have at most {max_properties} properties'))
+            for name, item in value.items():
+                if len(errors) >= MAX_ERRORS:
+                    return
+                if name in property_checks:
+                    property_checks[name](item, f'{prefix}{name}', errors)
+                elif additional is False:
+                    errors.append((f'{prefix}{name}', 'is not an allowed property'))
+                elif additional_check is not None:
+                    additional_check(item, f'{prefix}{name}', errors)
+        checks.append(check_object)
+
+    if schema.get('allOf'):
+        all_of_checks = [compile_schema(s, _compiled) for s in schema['allOf']]
+
+        def check_all_of(value, path, errors):
+            for check in all_of_checks:
+                check(value, path, errors)
+        checks.append(check_all_of)
+
+    for keyword in ('oneOf', 'anyOf'):
+        if schema.get(keyword):
+            alternative_checks = [compile_schema(s, _compiled) for s in schema[keyword]]
+
+            def check_alternatives(value, path, errors, keyword=keyword, alternative_checks=alternative_checks):
+                matches = 0
+                for check in alternative_checks:
+                    alternative_errors = []
+                    check(value, path, alternative_errors)
+                    matches += not alternative_errors
+                if matches == 0 or keyword == 'oneOf' and matches > 1:
+                    errors.append((path, f'must match {"exactly" if keyword == "oneOf" else "at least"} one of the '
+                                         f'{len(alternative_checks)} schemas in {keyword}; it matches {matches}'))
+            checks.append(check_alternatives)
+
+    expected = None
+    if schema_type in SCHEMA_TYPES:
+        expected = f'{"an" if schema_type[0] in "aeiou" else "a"} {schema_type}'
+
+    def check(value, path, errors):
+        if value is None:
+            if not nullable and expected:
+                errors.append((path, f'must be {expected}, not null'))
+            return
+        if expected and not _is_type(value, schema_type):
+            errors.append((path, f'must be {expected}, not {_type_name(value)}'))
+            return
+        for c in checks:
+            c(value, path, errors)
+
+    _compiled[id(schema)] = check
+    return check
+
+
+def _to_string(value):
+    """
+    Returns the string form of a value of a string parameter, with booleans in lower case, as in the specs.
+    """
+    if isinstance(value, bool):
+        return str(value).lower()
+    return str(value)
+
+
+def _coerce(value, schema):
+    """
+    Parameters are sent as strings, so a string is accepted for a numeric or boolean parameter if it converts, and a
+    boolean for a string parameter.
+    """
+    schema_type = schema.get('type')
+    if isinstance(value, bool) and schema_type == 'string':
+        return _to_string(value)
+    if not isinstance(value, str):
+        return value
+    try:
+        if schema_type == 'integer':
+            return int(value)
+        if schema_type == 'number':
+            return float(value)
+    except ValueError:
+        return value
+    if schema_type == 'boolean' and value.lower() in ('true', 'false'):
+        return value.lower() == 'true'
+    return value
+
+
+class OperationValidator(object):
+    """
+    The compiled validator of an operation's arguments.
+    """
+    def __init__(self, op_desc):
+        """
+        :param op_desc: An openapi_core Operation, or an OperationDescription from a generated resource.
+        """
+        schemas = operation_schemas(op_desc)
+        compiled = {}
+        self.parameters = [(p.name, bool(p.required), schemas['parameters'].get(p.name) or {})
+                           for _, p in op_desc.parameters.items() if _value(p.location) in ('path', 'query')]
+        self.parameter_checks = {name: compile_schema(schema, compiled) for name, _, schema in self.parameters}
+        self.body_schemas = schemas['request_body']
+        self.body_checks = {content_type: compile_schema(schema, compiled)
+                            for content_type, schema in self.body_schemas.items()}
+        self.property_checks = {}
+        for content_type, schema in self.body_schemas.items():
+            self.property_checks[content_type] = {name: compile_schema(prop, compiled)
+                                                  for name, prop in schema.get('properties', {}).items()}
+
+    def errors(self, kwargs, content_type=None):
+        """
+        Returns the (path, message) of each problem with the arguments to the operation.
+        :param kwargs: (dict) The arguments.
+        :param content_type: (str) The content type the request body would be sent as.
+        """
+        errors = []
+        known = set(SPECIAL_ARGUMENTS)
+        for name, required, schema in self.parameters:
+            known.add(name)
+            if name not in kwargs:
+                if required:
+                    errors.append((name, 'is required'))
+                continue
+            self.parameter_checks[name](_coerce(kwargs[name], schema), name, errors)
+        if content_type in self.body_schemas:
+            schema = self.body_schemas[content_type]
+            if content_type == 'application/octet-stream':
+                known.add('request_body')
+            elif content_type in ('application/json', '*/*') and not schema.get('properties'):
+                # the whole body is passed as request_body.
+                known.add('request_body')
+                if 'request_body' not in kwargs:
+                    errors.append(('request_body', 'is required'))
+                else:
+                    self.body_checks[content_type](kwargs['request_body'], 'request_body', errors)
+            else:
+                # the properties of the body are passed as arguments.
+                for name, check in self.property_checks[content_type].items():
+                    known.add(name)
+                    if name in kwargs:
+                        check(kwargs[name], name, errors)
+                    elif name in schema.get('required', []):
+                        errors.append((name, 'is required'))
+        for name in kwargs:
+            if name not in known:
+                errors.append((name, 'is not an argument of this operation'))
+        return errors[:MAX_ERRORS]
+
+    def validate(self, kwargs, content_type=None, operation_name=None):
+        """
+        Raise a tapy.errors.RequestValidationError if there are problems with the arguments to the operation.
+        """
+        errors = self.errors(kwargs, content_type)
+        if errors:
+            problems = '; '.join(f'{path} {message}' for path, message in errors)
+            raise tapy.errors.RequestValidationError(msg=f'Invalid arguments to {operation_name or "operation"}: '
+                                                         f'{problems}', errors=errors)
+
+
+# compiled validators, keyed by operation description; they are dropped with the spec they were compiled from.
+_VALIDATORS = weakref.WeakKeyDictionary()
+_VALIDATORS_LOCK = threading.Lock()
+
+
+def validator_for(op_desc):
+    """
+    Returns the compiled OperationValidator for an operation description, compiling it on first use.
+    """
+    with _VALIDATORS_LOCK:
+        validator = _VALIDATORS.get(op_desc)
+    if validator is None:
+        validator = OperationValidator(op_desc)
+        with _VALIDATORS_LOCK:
+            validator = _VALIDATORS.setdefault(op_desc, validator)
+    return validator
@@ -0,0 +1,147 @@
+"""
+Traversal of remote directory trees with the Files API.
+
+scandir() lists a single remote directory, page by page, and walk() traverses a whole tree breadth-first, listing many
+directories at once from a thread pool. Both are generators that yield the FileInfo entries (TapisResult objects)
+returned by files.listFiles as they arrive, so arbitrarily large trees can be traversed in bounded memory: walk() holds
+at most a page per worker, and goes depth-first rather than queue up the directories of a very wide tree.
+"""
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from fnmatch import fnmatch
+import posixpath
+import queue
+
+
+def is_dir(entry):
+    """
+    Determine if a FileInfo entry returned by files.listFiles is a directory: either the Files API reports its type, or,
+    for object stores, its name or path ends with a "/".
+    :param entry: (TapisResult) A FileInfo entry.
+    :return: (bool)
+    """
+    entry_type = getattr(entry, 'type', None)
+    if entry_type:
+        return entry_type in ('dir', 'directory')
+    return (getattr(entry, 'name', None) or '').endswith('/') or (getattr(entry, 'path', None) or '').endswith('/')
+
+
+def entry_path(entry, parent_path):
+    """
+    Returns the path of a FileInfo entry, falling back to the path of its parent directory joined with its name.
+    """
+    path = getattr(entry, 'path', None)
+    if path:
+        return path
+    return posixpath.join(parent_path, getattr(entry, 'name', '') or '')
+
+
+def _matches(entry, patterns):
+    name = (getattr(entry, 'name', None) or '').rstrip('/')
+    return any(fnmatch(name, pattern) for pattern in patterns)
+
+
+def _page(client, system_id, path, page_size, offset):
+    entries = client.files.listFiles(systemId=system_id, path=path, limit=page_size, offset=offset)
+    # an empty listing has no "result" and is returned as the raw JSON.
+    return entries if isinstance(entries, list) else []
+
+
+def scandir(client, system_id, path, page_size=1000):
+    """
+    Generator over the entries of a single remote directory, fetched with files.listFiles page_size entries at a time.
+    :param client: (DynaTapy) The client to make requests with.
+    :param system_id: (str) The system to list.
+    :param path: (str) The path of the directory.
+    :param page_size: (int) The number of entries to request per page.
+    """
+    offset = 0
+    while True:
+        entries = _page(client, system_id, path, page_size, offset)
+        yield from entries
+        if len(entries) < page_size:
+            return
+        offset += len(entries)
+
+
+def walk(client, system_id, path='/', max_depth=None, include=None, exclude=None, workers=8, page_size=1000,
+         max_pending=10000):
+    """
+    Generator over all the entries in a remote directory tree, traversed breadth-first with a pool of threads, each
+    fetching one page of a directory at a time.
+    :param client: (DynaTapy) The client to make requests with.
+    :param system_id: (str) The system to traverse.
+    :param path: (str) The root of the tree.
+    :param max_depth: (int) The maximum depth to descend to; entries of the root directory have depth 1.
+    :param include: (str or list) Glob patterns; only entries whose names match one of them are yielded (directories
+    are still traversed).
+    :param exclude: (str or list) Glob patterns; entries whose names match one of them are neither yielded nor, for
+    directories, traversed.
+    :param workers: (int) The number of pages fetched concurrently; at most as many pages are held in memory.
+    :param page_size: (int) The number of entries to request per page.
+    :param max_pending: (int) The number of pages waiting to be fetched (the first pages of the directories found, and
+    the next pages of the directories being listed) beyond which the traversal goes depth-first: the directories found
+    last are listed first, and the next pages of a directory wait until the subdirectories already found in it have
+    been listed. The number of waiting pages then grows with the depth of the tree, by at most a page of directories
+    per level, rather than with its width.
+    """
+    if isinstance(include, str):
+        include = [include]
+    if isinstance(exclude, str):
+        exclude = [exclude]
+    results = queue.Queue()
+    stopped = []
+
+    def _fetch(dir_path, depth, offset):
+        if stopped:
+            return
+        try:
+            entries = _page(client, system_id, dir_path, page_size, offset)
+        except Exception as e:
+            entries = e
+        results.put((dir_path, depth, offset, entries))
+
+    # the pages waiting to be fetched, as (path, depth, offset); at most workers are submitted to the executor at a
+    # time, so that the executor's queue does not grow with the number of directories.
+    pending = deque([(path, 1, 0)])
+    executor = ThreadPoolExecutor(max_workers=workers)
+    running = 0
+
+    def _submit():
+        nonlocal running
+        while pending and running < workers:
+            # breadth-first, unless too many pages are waiting.
+            executor.submit(_fetch, *(pending.popleft() if len(pending) < max_pending else pending.pop()))
+            running += 1
+
+    try:
+        while True:
+            _submit()
+            if not running:
+                return
+            dir_path, depth, offset, entries = results.get()
+            running -= 1
+            if isinstance(entries, Exception):
+                raise entries
+            if len(entries) == page_size:
+                # the next page goes before the subdirectories found in this one, so that it is fetched after them
+                # when going depth-first.
+                pending.append((dir_path, depth, offset + len(entries)))
+            found = []
+            for entry in entries:
+                if exclude and _matches(entry, exclude):
+                    continue
+                # some storage systems include the directory itself in its listing.
+                if entry_path(entry, dir_path).rstrip('/') == dir_path.rstrip('/'):
+                    continue
+                if is_dir(entry) and (max_depth is None or depth < max_depth):
+                    pending.append((entry_path(entry, dir_path), depth + 1, 0))
+                if not include or _matches(entry, include):
+                    found.append(entry)
+            # the next pages are fetched while this one is consumed.
+            _submit()
+            yield from found
+    finally:
+        # pages that have not been fetched yet are cancelled, so that no requests are made once the consumer is gone.
+        stopped.append(True)
+        executor.shutdown(wait=False, cancel_futures=True)
@@ -46,6 +46,16 @@ class InvalidInputError(BaseTapyException):
     pass
 
 
+class RequestValidationError(InvalidInputError):
+    """The arguments to an operation do not match its schemas; raised before any request is made."""
+    def __init__(self, msg=None, errors=None, **kwargs):
+        """
+        :param errors: (list) The (path, message) of each problem found, e.g., ("request_body[3].name", "is required").
+        """
+        super().__init__(msg=msg, **kwargs)
+        self.errors = errors or []
+
+
 class InvalidServerResponseError(BaseTapyException):
     """Tapy got a response from the Tapis service that it didn't understand."""
     pass
@@ -55,3 +65,12 @@ class ServerDownError(BaseTapyException):
     """Tapy got an error trying to communication with the Tapis server."""
     pass
 
+
+class ServiceUnavailableError(ServerDownError):
+    """The Tapis service is temporarily unable to handle the request (HTTP 503)."""
+    pass
+
+
+class TooManyRequestsError(BaseTapyException):
+    """The Tapis service is throttling the client's requests (HTTP 429)."""
+    pass
@@ -0,0 +1,117 @@
+# A benchmark of request and response compression (the compression parameter of DynaTapy).
+# It starts a local HTTP server standing in for the Meta API, which decodes compressed request bodies and compresses
+# responses when asked to, optionally throttled to simulate a WAN link, and measures the bytes on the wire and the
+# end-to-end time of bulk meta.createDocument and meta.listDocuments calls with and without compression.
+# Run it with: python test/benchmark-compression.py [--documents N] [--requests N] [--bandwidth MBIT_PER_SECOND]
+
+import argparse
+import gzip
+import http.server
+import json
+import threading
+import time
+
+from tapy.dyna import DynaTapy
+from tapy.dyna.compression import Compression, compress, zstandard
+
+def make_documents(count):
+    return [{'name': f'sensor-{i}', 'site': 'site-1', 'kind': 'temperature', 'units': 'celsius',
+             'tags': ['outdoor', 'calibrated'], 'value': i * 0.5, 'created': f'2020-01-01T00:00:{i % 60:02d}Z'}
+            for i in range(count)]
+
+
+class Server(http.server.ThreadingHTTPServer):
+    def __init__(self, documents, bandwidth):
+        super().__init__(('127.0.0.1', 0), Handler)
+        listing = json.dumps(documents).encode()
+        # the listing in each encoding, compressed ahead of time as a caching proxy would
+        self.listings = {None: listing, 'gzip': compress(listing, 'gzip')}
+        if zstandard:
+            self.listings['zstd'] = compress(listing, 'zstd')
+        # bytes per second, or None for no throttling
+        self.bandwidth = bandwidth * 125000 if bandwidth else None
+        self.bytes_received = 0
+        self.bytes_sent = 0
+        self.lock = threading.Lock()
+
+    def transfer(self, received=0, sent=0):
+        with self.lock:
+            self.bytes_received += received
+            self.bytes_sent += sent
+        if self.bandwidth:
+            time.sleep((received + sent) / self.bandwidth)
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def _respond(self, body, content_encoding=None):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        if content_encoding:
+            self.send_header('Content-Encoding', content_encoding)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.transfer(sent=len(body))
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.server.transfer(received=len(body))
+        encoding = self.headers.get('Content-Encoding')
+        if encoding == 'gzip':
+            body = gzip.decompress(body)
+        elif encoding == 'zstd':
+            body = zstandard.ZstdDecompressor().decompress(body)
+        json.loads(body)
+        self._respond(b'[]')
+
+    def do_GET(self):
+        accepted = [e.strip() for e in self.headers.get('Accept-Encoding', '').split(',')]
+        encoding = 'zstd' if 'zstd' in accepted and zstandard else 'gzip' if 'gzip' in accepted else None
+        self._respond(self.server.listings[encoding], encoding)
+
+
+def run(server, compression, documents, requests):
+    t = DynaTapy(base_url=f'http://127.0.0.1:{server.server_address[1]}', tenant_id='dev', jwt='abc',
+                 compression=compression)
+    server.bytes_received = server.bytes_sent = 0
+    start = time.perf_counter()
+    for _ in range(requests):
+        t.meta.createDocument(db='db', collection='sensors', request_body=documents)
+    write_time = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(requests):
+        t.meta.listDocuments(db='db', collection='sensors')
+    read_time = time.perf_counter() - start
+    return server.bytes_received, write_time, server.bytes_sent, read_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark DynaTapy request and response compression.')
+    parser.add_argument('--documents', type=int, default=5000, help='documents per request')
+    parser.add_argument('--requests', type=int, default=20, help='requests of each kind per configuration')
+    parser.add_argument('--bandwidth', type=float, default=100, help='simulated bandwidth in Mbit/s; 0 for none')
+    args = parser.parse_args()
+    documents = make_documents(args.documents)
+    # load the specs before timing anything
+    DynaTapy(base_url='http://127.0.0.1', tenant_id='dev')
+    server = Server(documents, args.bandwidth)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    configurations = [('none', Compression(accept_encoding=None)),
+                      ('gzip', Compression({'meta': 'gzip'}, accept_encoding='gzip'))]
+    if zstandard:
+        configurations.append(('zstd', Compression({'meta': 'zstd'})))
+    print(f'{args.requests} x {args.documents} documents, bandwidth: {args.bandwidth or "unlimited"} Mbit/s')
+    print(f'{"compression":<12}{"sent bytes":>14}{"write s":>10}{"received bytes":>16}{"read s":>10}')
+    for name, compression in configurations:
+        sent, write_time, received, read_time = run(server, compression, documents, args.requests)
+        print(f'{name:<12}{sent:>14}{write_time:>10.2f}{received:>16}{read_time:>10.2f}')
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
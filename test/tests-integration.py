@@ -2,11 +2,44 @@
 # Build the test docker image: docker build -t tapis/pysdk-tests -f Dockerfile-tests .
 # Run these tests using the built docker image: docker run -it --rm  tapis/pysdk-tests
 
+from concurrent.futures import ThreadPoolExecutor
+import concurrent.futures
+import datetime
+import gzip
+import hashlib
+import itertools
+import json
+import os
+import pickle
+import sys
+import threading
+import time
+import urllib.parse
+
 import pytest
+import requests
 
 from common.config import conf
-from tapy.dyna import DynaTapy
-from tapy.dyna.dynatapy import TapisResult
+import tapy.dyna.dynatapy
+import tapy.dyna.transport
+import tapy.errors
+from tapy.dyna import DynaTapy, DynaTapyPool
+from tapy.dyna.codegen import generate
+from tapy.dyna.compression import Compression
+from tapy.dyna.documents import export_documents, import_documents
+from tapy.dyna.dynatapy import RESOURCES, Operation, OperationDescription, StaticResource, TapisResult
+from tapy.dyna.messaging import ActorMessenger, ExecutionWaiter
+from tapy.dyna.provisioning import provision
+from tapy.dyna.pool import DynaTapyView
+from tapy.dyna.ratelimit import RateLimiter
+from tapy.dyna.secrets import SecretCache
+from tapy.dyna.snapshot import SNAPSHOT_ENV, load_snapshot, restore, restore_from_env, save_snapshot, snapshot
+from tapy.dyna.streams import MeasurementFollower, follow_measurements
+from tapy.dyna.sync import Sync
+from tapy.dyna.tokencache import FileTokenCache
+from tapy.dyna.transfers import TransferManager
+from tapy.dyna.transport import DNSCache, HTTP2Transport, KeepAliveTransport, RecordingTransport, ReplayTransport
+from tapy.dyna.walk import scandir, walk
 
 @pytest.fixture
 def client():
@@ -271,4 +304,1160 @@ def test_get_coll_names(client):
  #   assert 'testdoc' in str(result)
 
 
+# ---------------------
+# Transport tests -
+# ---------------------
+
+class StaticTransport(object):
+    """A transport that answers every request with the same Tapis JSON result, without any network access."""
+    def __init__(self, result):
+        self.result = result
+        self.sent = []
+
+    def send(self, request, **kwargs):
+        self.sent.append(request)
+        resp = requests.models.Response()
+        resp.status_code = 200
+        resp.headers['content-type'] = 'application/json'
+        resp._content = json.dumps({'result': self.result, 'status': 'success', 'version': 'test'}).encode()
+        resp.request = request
+        return resp
+
+def test_record_and_replay_transport(tmp_path):
+    cassette = str(tmp_path / 'cassette.ndjson')
+    inner = StaticTransport([{'tenant_id': 'dev', 'base_url': 'https://dev.example.org'}])
+    t = DynaTapy(base_url='https://dev.example.org', transport=RecordingTransport(cassette, transport=inner))
+    assert t.tenant_id == 'dev'
+    assert len(inner.sent) == 1
+    with open(cassette) as f:
+        entries = [json.loads(line) for line in f]
+    assert entries[0]['method'] == 'GET'
+    assert entries[0]['url'] == 'https://dev.example.org/v3/tenants'
+    # replaying the cassette produces the same client without sending anything -
+    t2 = DynaTapy(base_url='https://dev.example.org', transport=ReplayTransport(cassette))
+    assert t2.tenant_id == 'dev'
+    # the single recorded response has been used up -
+    with pytest.raises(Exception):
+        t2.tenants.list_tenants()
+
+
+# ---------------------
+# Connection warmup tests -
+# ---------------------
+
+def test_keepalive_transport_caches_dns():
+    cache = DNSCache(ttl=60)
+    address = cache.resolve('localhost', 443)
+    assert cache.resolve('localhost', 443) == address
+    cache.invalidate('localhost', 443)
+    transport = pickle.loads(pickle.dumps(KeepAliveTransport(pool_maxsize=4, dns_ttl=30)))
+    assert transport.pool_maxsize == 4
+    assert transport.dns_cache.ttl == 30
+
+class WarmupTransport(StaticTransport):
+    """A transport that records the order in which connections are warmed up and requests are sent."""
+    def __init__(self, result, delay=0, warmup_timeout=5):
+        super().__init__(result)
+        self.delay = delay
+        self.warmup_timeout = warmup_timeout
+        self.events = []
+
+    def warmup(self, url, connections=4, verify=True):
+        time.sleep(self.delay)
+        self.events.append(('warmup', url, connections))
+        return []
+
+    def send(self, request, **kwargs):
+        self.events.append(('send', request.url))
+        return super().send(request, **kwargs)
+
+def test_warmup_before_first_request():
+    transport = WarmupTransport([{'tenant_id': 'dev', 'base_url': 'https://dev.example.org'}], delay=0.2)
+    t = DynaTapy(base_url='https://dev.example.org', transport=transport, warmup_connections=4)
+    assert t.tenant_id == 'dev'
+    assert transport.events[0] == ('warmup', 'https://dev.example.org', 4)
+    assert transport.events[1][0] == 'send'
+    # a slow warmup holds up the first request for at most the warmup timeout -
+    transport = WarmupTransport([{'tenant_id': 'dev', 'base_url': 'https://dev.example.org'}], delay=2,
+                                warmup_timeout=0.1)
+    start = time.monotonic()
+    DynaTapy(base_url='https://dev.example.org', transport=transport, warmup_connections=4)
+    assert time.monotonic() - start < 1.5
+    assert transport.events[0][0] == 'send'
+
+# ---------------------
+# HTTP/2 transport tests -
+# ---------------------
+
+def test_http2_transport_pickles():
+    pytest.importorskip('httpx')
+    transport = pickle.loads(pickle.dumps(HTTP2Transport(max_connections=4)))
+    assert transport.http2
+    assert transport.max_connections == 4
+
+def _mock_httpx_clients(monkeypatch, handler):
+    """
+    Makes the HTTP2Transport send with an httpx.MockTransport; returns the arguments its clients are created with.
+    """
+    httpx = pytest.importorskip('httpx')
+    created = []
+    client_class = httpx.Client
+
+    def mock_client(**kwargs):
+        created.append(kwargs)
+        return client_class(transport=httpx.MockTransport(handler), **kwargs)
+    monkeypatch.setattr(tapy.dyna.transport.httpx, 'Client', mock_client)
+    return created
+
+def test_http2_transport_send(monkeypatch):
+    received = []
+
+    def handler(request):
+        received.append(request)
+        if request.url.path == '/stream':
+            return tapy.dyna.transport.httpx.Response(200, content=iter([b'chunk-1;', b'chunk-2;', b'chunk-3']))
+        return tapy.dyna.transport.httpx.Response(201, headers={'Content-Type': 'application/json; charset=utf-8',
+                                                                'Content-Encoding': 'gzip',
+                                                                'X-Tapis-Tenant': 'dev'},
+                                                  content=gzip.compress(b'{"result": "ok"}'))
+    created = _mock_httpx_clients(monkeypatch, handler)
+    transport = HTTP2Transport()
+    request = requests.Request('POST', 'https://dev.example.org/v3/things', json={'name': 'a'},
+                               headers={'X-Tapis-Token': 'abc', 'Transfer-Encoding': 'chunked'}).prepare()
+    response = transport.send(request, timeout=(3, 10))
+    assert isinstance(response, requests.Response)
+    assert response.status_code == 201
+    assert response.headers['x-tapis-tenant'] == 'dev'
+    # the body is decoded by httpx, so it is not advertised as gzip-encoded -
+    assert 'Content-Encoding' not in response.headers
+    assert response.encoding == 'utf-8'
+    assert response.json() == {'result': 'ok'}
+    assert response.request is request
+    assert response.url == 'https://dev.example.org/v3/things'
+    # the request was sent as prepared, framed by httpx -
+    assert received[0].method == 'POST'
+    assert received[0].headers['x-tapis-token'] == 'abc'
+    assert 'transfer-encoding' not in received[0].headers
+    assert received[0].headers['content-length'] == str(len(request.body))
+    assert json.loads(received[0].content) == {'name': 'a'}
+    # a streamed response is read as it is consumed -
+    response = transport.send(requests.Request('GET', 'https://dev.example.org/stream').prepare(), stream=True)
+    assert response.status_code == 200
+    assert b''.join(response.iter_content(chunk_size=4)) == b'chunk-1;chunk-2;chunk-3'
+    # both requests shared a single client, which offered HTTP/2 -
+    assert len(created) == 1
+    assert created[0]['http2']
+    transport.close()
+
+def test_http2_transport_without_h2(monkeypatch):
+    created = _mock_httpx_clients(monkeypatch, lambda request: tapy.dyna.transport.httpx.Response(200, content=b'ok'))
+    # importing h2 fails -
+    monkeypatch.setitem(sys.modules, 'h2', None)
+    transport = HTTP2Transport()
+    response = transport.send(requests.Request('GET', 'https://dev.example.org/').prepare())
+    assert response.status_code == 200
+    assert response.content == b'ok'
+    assert response.http_version == 'HTTP/1.1'
+    assert not created[0]['http2']
+    transport.close()
+
+# ---------------------
+# Token cache tests -
+# ---------------------
+
+def test_token_cache_shared_between_clients(tmp_path):
+    expires_at = (datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=1)).isoformat()
+    tokens = {'access_token': {'access_token': 'abc', 'jti': '1', 'expires_at': expires_at, 'expires_in': 3600},
+              'refresh_token': {'refresh_token': 'def', 'jti': '2', 'expires_at': expires_at, 'expires_in': 3600}}
+    cache = FileTokenCache(str(tmp_path))
+    clients = []
+    for _ in range(2):
+        transport = StaticTransport(tokens)
+        t = DynaTapy(base_url='https://dev.example.org', tenant_id='dev', username='pysdk', account_type='service',
+                     transport=transport, token_cache=cache)
+        t.get_tokens()
+        clients.append((t, transport))
+    # only the first client called the Tokens API; the second used the cached tokens -
+    assert len(clients[0][1].sent) == 1
+    assert len(clients[1][1].sent) == 0
+    assert clients[1][0].get_access_jwt() == 'abc'
+    assert clients[1][0].refresh_token.refresh_token == 'def'
+
+def test_token_cache_with_expiring_access_token(tmp_path):
+    now = datetime.datetime.now(datetime.timezone.utc)
+    expires_at = (now + datetime.timedelta(hours=1)).isoformat()
+    tokens = {'access_token': {'access_token': 'abc', 'jti': '1', 'expires_at': expires_at, 'expires_in': 3600},
+              'refresh_token': {'refresh_token': 'def', 'jti': '2', 'expires_at': expires_at, 'expires_in': 3600}}
+    transport = StaticTransport(tokens)
+    t = DynaTapy(base_url='https://dev.example.org', tenant_id='dev', username='pysdk', account_type='service',
+                 transport=transport, token_cache=FileTokenCache(str(tmp_path)))
+    # an access token about to expire, so the token call made under the cache lock would try to refresh it -
+    t.set_access_token(TapisResult(access_token='old', jti='0'))
+    t.access_token.expires_at = now + datetime.timedelta(seconds=2)
+    # set_access_token() only makes expires_in a function for tokens it can validate -
+    t.access_token.expires_in = lambda: t.access_token.expires_at - datetime.datetime.now(datetime.timezone.utc)
+    t.set_refresh_token(TapisResult(refresh_token='old', jti='3', expires_at=expires_at, expires_in=3600))
+    # a daemon thread, so that a deadlock fails the test rather than hanging it -
+    thread = threading.Thread(target=t.get_tokens, daemon=True)
+    thread.start()
+    thread.join(timeout=10)
+    assert not thread.is_alive()
+    assert t.get_access_jwt() == 'abc'
+    assert len(transport.sent) == 1
+
+
+# ---------------------
+# Pickling tests -
+# ---------------------
+
+def test_pickle_client():
+    t = DynaTapy(base_url='https://dev.example.org', tenant_id='dev', username='pysdk', account_type='service')
+    expires_at = (datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=1)).isoformat()
+    t.set_access_token(TapisResult(access_token='abc', jti='1', expires_at=expires_at, expires_in=3600))
+    t2 = pickle.loads(pickle.dumps(t))
+    assert t2.base_url == t.base_url
+    assert t2.tenant_id == 'dev'
+    assert t2.x_tenant_id == 'dev'
+    assert t2.get_access_jwt() == 'abc'
+    # resources are rebuilt and bound to the new client, which has its own session -
+    assert t2.tenants.list_tenants.tapis_client is t2
+    assert t2.requests_session is not t.requests_session
+
+
+# ---------------------
+# Snapshot tests -
+# ---------------------
+
+def test_snapshot_client(tmp_path, monkeypatch):
+    t = DynaTapy(base_url='https://dev.example.org', tenant_id='dev', username='pysdk', use_generated_resources=False)
+    now = datetime.datetime.now(datetime.timezone.utc)
+    expires_at = (now + datetime.timedelta(hours=1)).isoformat()
+    t.set_access_token(TapisResult(access_token='abc', jti='1', expires_at=expires_at, expires_in=3600))
+    t.set_refresh_token(TapisResult(refresh_token='def', expires_at=(now - datetime.timedelta(hours=1)).isoformat()))
+    save_snapshot(t, str(tmp_path / 'tapy.snapshot'))
+    t2 = load_snapshot(str(tmp_path / 'tapy.snapshot'))
+    assert t2.tenant_id == 'dev'
+    assert t2.get_access_jwt() == 'abc'
+    # expired tokens are dropped -
+    assert t2.refresh_token is None
+    # the resources are rebuilt from the operation tables in the snapshot rather than the specs -
+    assert isinstance(t2.files, StaticResource)
+    assert t2.files.listFiles.path == t.files.listFiles.path
+    operations = [name for name, value in vars(t.files).items() if isinstance(value, Operation)]
+    assert sorted(t2.files.operations) == sorted(operations)
+    transport = StaticTransport([])
+    t2.transport = transport
+    t2.files.listFiles(systemId='abc', path='/')
+    assert transport.sent[0].url == 'https://dev.example.org/v3/files/ops/abc//'
+    assert transport.sent[0].headers['X-Tapis-Token'] == 'abc'
+    monkeypatch.setenv(SNAPSHOT_ENV, snapshot(t))
+    assert restore_from_env().get_access_jwt() == 'abc'
+    with pytest.raises(tapy.errors.TapyClientConfigurationError):
+        restore('not a snapshot')
+
+
+# ---------------------
+# Client pool tests -
+# ---------------------
+
+def test_client_pool_views():
+    transport = StaticTransport([{'tenant_id': 'dev', 'base_url': 'https://dev.example.org'},
+                                 {'tenant_id': 'tacc', 'base_url': 'https://tacc.example.org'}])
+    t = DynaTapy(base_url='https://admin.example.org', tenant_id='admin', username='pysdk', account_type='service',
+                 jwt='abc', transport=transport)
+    pool = DynaTapyPool(t, max_size=2)
+    dev = pool.get('dev', x_username='testuser1')
+    assert pool.get('dev', x_username='testuser1') is dev
+    dev.systems.getSystems()
+    request = transport.sent[-1]
+    assert request.url == 'https://dev.example.org/v3/systems'
+    assert request.headers['X-Tapis-Tenant'] == 'dev'
+    assert request.headers['X-Tapis-User'] == 'testuser1'
+    assert request.headers['X-Tapis-Token'] == 'abc'
+    # the shared client is unchanged -
+    assert t.x_tenant_id == 'admin'
+    # the least recently used view is evicted once the pool is full -
+    pool.get('tacc', x_username='testuser2')
+    pool.get('tacc', x_username='testuser3')
+    assert len(pool) == 2
+    assert pool.get('dev', x_username='testuser1') is not dev
+
+
+# ---------------------
+# Request body tests -
+# ---------------------
+
+def test_send_message_body_content_types():
+    transport = StaticTransport({'executionId': 'abc'})
+    t = DynaTapy(base_url='https://dev.example.org', tenant_id='dev', transport=transport)
+    t.actors.sendMessage(actor_id='abc', request_body=b'some bytes')
+    assert transport.sent[-1].headers['Content-Type'] == 'application/octet-stream'
+    assert transport.sent[-1].body == b'some bytes'
+    t.actors.sendMessage(actor_id='abc', request_body=(chunk for chunk in [b'some ', b'bytes']))
+    assert transport.sent[-1].headers['Content-Type'] == 'application/octet-stream'
+    assert transport.sent[-1].headers['Transfer-Encoding'] == 'chunked'
+    t.actors.sendMessage(actor_id='abc', message='hello')
+    assert transport.sent[-1].headers['Content-Type'] == 'application/x-www-form-urlencoded'
+    assert transport.sent[-1].body == 'message=hello'
+    t.actors.sendMessage(actor_id='abc', request_body={'message': 'hello'})
+    assert transport.sent[-1].headers['Content-Type'] == 'application/json'
+
+
+
+# ---------------------
+# Latest spec tests -
+# ---------------------
+
+class FakeSpecServer(object):
+    """Stands in for requests.get for the spec downloads: serves the bundled spec files, with an ETag per version, and
+    answers conditional requests for the current version with a 304."""
+    def __init__(self):
+        self.urls = {url: resource_name for resource_name, url in RESOURCES}
+        self.versions = {resource_name: 0 for resource_name, _ in RESOURCES}
+        self.responses = []
+        self.offline = False
+
+    def content(self, resource_name):
+        with open(os.path.join(os.path.dirname(tapy.dyna.dynatapy.__file__), 'resources',
+                               f'openapi_v3-{resource_name}.yml'), 'rb') as f:
+            return f.read() + f'\n# version {self.versions[resource_name]}\n'.encode()
+
+    def get(self, url, headers=None, timeout=None):
+        if self.offline:
+            raise requests.exceptions.ConnectionError('offline')
+        resource_name = self.urls[url]
+        etag = f'"{resource_name}-{self.versions[resource_name]}"'
+        resp = requests.models.Response()
+        if (headers or {}).get('If-None-Match') == etag:
+            resp.status_code = 304
+        else:
+            resp.status_code = 200
+            resp._content = self.content(resource_name)
+            resp.headers['ETag'] = etag
+        self.responses.append((resource_name, resp.status_code))
+        return resp
+
+def test_latest_specs(tmp_path, monkeypatch):
+    server = FakeSpecServer()
+    monkeypatch.setattr(requests, 'get', server.get)
+    monkeypatch.setattr(tapy.dyna.dynatapy, 'LATEST_SPECS', {})
+    kwargs = dict(base_url='https://dev.example.org', tenant_id='dev', jwt='abc', transport=StaticTransport([]),
+                  download_latest_specs=True, spec_cache_dir=str(tmp_path))
+    t = DynaTapy(block_on_spec_download=True, **kwargs)
+    assert sorted(server.responses) == sorted((resource_name, 200) for resource_name, _ in RESOURCES)
+    assert t.tenants.resource_spec is tapy.dyna.dynatapy.LATEST_SPECS['tenants'][1].paths
+    # unchanged specs are revalidated with their ETags rather than downloaded and parsed again -
+    server.responses.clear()
+    tenants = t.tenants
+    assert t.update_specs() == []
+    assert {status for _, status in server.responses} == {304}
+    assert t.tenants is tenants
+    server.versions['tenants'] += 1
+    assert t.update_specs() == ['tenants']
+    assert t.tenants is not tenants
+    assert not t.spec_download_errors
+    # a new process starts on the specs cached on disk, even if they cannot be downloaded -
+    monkeypatch.setattr(tapy.dyna.dynatapy, 'LATEST_SPECS', {})
+    server.offline = True
+    t2 = DynaTapy(block_on_spec_download=True, **kwargs)
+    assert set(t2.spec_download_errors) == {resource_name for resource_name, _ in RESOURCES}
+    digest, spec = tapy.dyna.dynatapy.LATEST_SPECS['tenants']
+    assert digest == hashlib.sha1(server.content('tenants')).hexdigest()
+    assert t2.tenants.resource_spec is spec.paths
+    # by default, the latest specs are downloaded in the background and swapped in when they have changed -
+    server.offline = False
+    server.versions['tenants'] += 1
+    t3 = DynaTapy(**kwargs)
+    _wait_for(lambda: t3.tenants.resource_spec is not spec.paths, timeout=30)
+    assert t3.tenants.resource_spec is tapy.dyna.dynatapy.LATEST_SPECS['tenants'][1].paths
+
+
+# ---------------------
+# Generated resource tests -
+# ---------------------
+
+def test_generated_resources(tmp_path):
+    modules = generate(output=str(tmp_path / 'generated'))
+    assert 'systems' in modules
+    assert 'def getSystems(' in (tmp_path / 'generated' / 'systems.pyi').read_text()
+
+    class WidgetsResource(StaticResource):
+        resource_name = 'widgets'
+        spec_digest = 'abc'
+        operations = {'getWidget': OperationDescription('getWidget', 'get', '/widgets/{widgetId}',
+                                                        parameters=[('widgetId', 'path', True),
+                                                                    ('pretty', 'query', False)])}
+
+    transport = StaticTransport({'id': 'abc'})
+    t = DynaTapy(base_url='https://dev.example.org', tenant_id='dev', transport=transport)
+    widgets = WidgetsResource(t)
+    assert 'getWidget' in dir(widgets)
+    assert widgets.getWidget(widgetId='abc', pretty=True).id == 'abc'
+    assert transport.sent[-1].url == 'https://dev.example.org/v3/widgets/abc?pretty=True'
+    assert widgets.getWidget is widgets.getWidget
+    with pytest.raises(tapy.errors.InvalidInputError):
+        widgets.getWidget()
+
+
+# ---------------------
+# Request compression tests -
+# ---------------------
+
+def test_request_compression():
+    transport = StaticTransport([])
+    t = DynaTapy(base_url='https://dev.example.org', tenant_id='dev', transport=transport,
+                 compression=Compression({'meta': 'gzip'}, min_size=100))
+    documents = [{'name': f'doc-{i}'} for i in range(50)]
+    t.meta.createDocument(db='db', collection='coll', request_body=documents)
+    request = transport.sent[-1]
+    assert request.headers['Content-Encoding'] == 'gzip'
+    assert request.headers['Content-Length'] == str(len(request.body))
+    assert json.loads(gzip.decompress(request.body)) == documents
+    assert 'gzip' in request.headers['Accept-Encoding']
+    # small bodies, and bodies sent to other resources, are not compressed -
+    t.meta.createDocument(db='db', collection='coll', request_body=documents[:1])
+    assert 'Content-Encoding' not in transport.sent[-1].headers
+    t.actors.sendMessage(actor_id='abc', request_body={'message': 'x' * 1000})
+    assert 'Content-Encoding' not in transport.sent[-1].headers
+    assert t.compression.stats()['compressed'] == 1
+    with pytest.raises(tapy.errors.TapyClientConfigurationError):
+        Compression({'meta': 'lz4'})
+
+
+# ---------------------
+# Request validation tests -
+# ---------------------
+
+def test_strict_request_validation():
+    transport = StaticTransport([])
+    t = DynaTapy(base_url='https://dev.example.org', tenant_id='dev', transport=transport, validate_requests=True)
+    with pytest.raises(tapy.errors.RequestValidationError) as e:
+        t.systems.createSystem(systemType='BOGUS', host=5, defaultAccessMethod='PASSWORD', nosuchfield=1)
+    paths = [path for path, _ in e.value.errors]
+    assert 'systemType' in paths and 'host' in paths and 'nosuchfield' in paths
+    with pytest.raises(tapy.errors.RequestValidationError) as e:
+        t.files.listFiles(systemId='abc', path='/', limit='ten')
+    assert e.value.errors == [('limit', 'must be an integer, not str')]
+    assert not transport.sent
+    # strings are accepted for parameters if they convert, and validation can be turned off per call -
+    t.files.listFiles(systemId='abc', path='/', limit='10')
+    t.files.listFiles(systemId='abc', path='/', limit='ten', _tapis_validate=False)
+    assert len(transport.sent) == 2
+    # the enum of a string parameter is compared as strings, even though YAML loads [true, false] as booleans -
+    t.actors.sendMessage(actor_id='abc', message='hello', _abaco_synchronous='true')
+    t.actors.sendMessage(actor_id='abc', message='hello', _abaco_synchronous=False)
+    assert len(transport.sent) == 4
+    with pytest.raises(tapy.errors.RequestValidationError) as e:
+        t.actors.sendMessage(actor_id='abc', message='hello', _abaco_synchronous='yes')
+    assert e.value.errors == [('_abaco_synchronous', "must be one of ['true', 'false'], not 'yes'")]
+
+    class WidgetsResource(StaticResource):
+        resource_name = 'widgets'
+        spec_digest = 'abc'
+        operations = {'createWidget': OperationDescription(
+            'createWidget', 'post', '/widgets', request_body={'application/json': ([], [])},
+            schemas={'parameters': {}, 'request_body': {'application/json': {
+                'type': 'array', 'items': {'type': 'object', 'required': ['name'],
+                                           'properties': {'name': {'type': 'string'},
+                                                          'tags': {'type': 'array', 'items': {'type': 'string'}}}}}}})}
+
+    widgets = WidgetsResource(t)
+    with pytest.raises(tapy.errors.RequestValidationError) as e:
+        widgets.createWidget(request_body=[{'name': 'a'}, {'tags': ['b', 3]}])
+    assert e.value.errors == [('request_body[1].name', 'is required'),
+                              ('request_body[1].tags[1]', 'must be a string, not int')]
+
+
+# ---------------------
+# Walk tests -
+# ---------------------
+
+class FilesTreeTransport(StaticTransport):
+    """A StaticTransport standing in for files.listFiles on a tree of directories, honoring limit and offset."""
+    def __init__(self, tree, delay=0):
+        super().__init__(None)
+        # the entries of each directory, by path.
+        self.tree = tree
+        self.delay = delay
+
+    def send(self, request, **kwargs):
+        self.sent.append(request)
+        time.sleep(self.delay)
+        url = urllib.parse.urlparse(request.path_url)
+        path = '/' + url.path[len('/v3/files/ops/sys'):].strip('/')
+        query = dict(urllib.parse.parse_qsl(url.query))
+        offset = int(query.get('offset', 0))
+        result = self.tree.get(path, [])[offset:offset + int(query.get('limit', 1000))]
+        resp = requests.models.Response()
+        resp.status_code = 200
+        resp.headers['content-type'] = 'application/json'
+        resp._content = json.dumps({'result': result, 'status': 'success', 'message': '', 'version': 'test'}).encode()
+        resp.request = request
+        return resp
+
+def _tree(layout):
+    # {dir path: [names]} -> {dir path: [FileInfo entries]}; names ending with "/" are directories.
+    return {path: [{'name': name.rstrip('/'), 'path': f"{path.rstrip('/')}/{name.rstrip('/')}",
+                    'type': 'dir' if name.endswith('/') else 'file'} for name in names]
+            for path, names in layout.items()}
+
+def test_scandir_pages():
+    transport = FilesTreeTransport(_tree({'/data': [f'f{i}' for i in range(5)]}))
+    t = DynaTapy(base_url='https://dev.example.org', tenant_id='dev', jwt='abc', transport=transport)
+    assert [entry.name for entry in scandir(t, 'sys', '/data', page_size=2)] == ['f0', 'f1', 'f2', 'f3', 'f4']
+    # three pages, the last one partial -
+    assert [dict(urllib.parse.parse_qsl(urllib.parse.urlparse(r.path_url).query))['offset'] for r in transport.sent] \
+        == ['0', '2', '4']
+
+def test_walk():
+    transport = FilesTreeTransport(_tree({'/': ['a/', 'b/', 'top.txt'],
+                                          '/a': ['a1.txt', 'a2.log', 'deep/'],
+                                          '/a/deep': ['d.txt'],
+                                          '/b': ['b1.txt', '.git/'],
+                                          '/b/.git': ['config']}))
+    t = DynaTapy(base_url='https://dev.example.org', tenant_id='dev', jwt='abc', transport=transport)
+    assert sorted(entry.path for entry in walk(t, 'sys', '/', workers=2, page_size=2)) == [
+        '/a', '/a/a1.txt', '/a/a2.log', '/a/deep', '/a/deep/d.txt', '/b', '/b/.git', '/b/.git/config', '/b/b1.txt',
+        '/top.txt']
+    assert sorted(entry.path for entry in walk(t, 'sys', '/', max_depth=2)) == [
+        '/a', '/a/a1.txt', '/a/a2.log', '/a/deep', '/b', '/b/.git', '/b/b1.txt', '/top.txt']
+    # include only filters what is yielded; exclude also prunes the directories it matches -
+    assert sorted(entry.path for entry in walk(t, 'sys', '/', include='*.txt', exclude='.git')) == [
+        '/a/a1.txt', '/a/deep/d.txt', '/b/b1.txt', '/top.txt']
+    # depth-first once too many pages are waiting, with the same entries -
+    assert sorted(entry.path for entry in walk(t, 'sys', '/', max_pending=1, workers=1, page_size=2)) == sorted(
+        entry.path for entry in walk(t, 'sys', '/'))
+
+def test_walk_wide_directory():
+    transport = FilesTreeTransport(_tree(dict({'/': [f'd{i}/' for i in range(50)]},
+                                              **{f'/d{i}': ['f.txt'] for i in range(50)})))
+    t = DynaTapy(base_url='https://dev.example.org', tenant_id='dev', jwt='abc', transport=transport)
+    assert len(list(walk(t, 'sys', '/', workers=1, page_size=5, max_pending=5))) == 100
+    urls = [urllib.parse.urlparse(r.path_url) for r in transport.sent]
+    listed = [('/' + url.path[len('/v3/files/ops/sys'):].strip('/'), dict(urllib.parse.parse_qsl(url.query))['offset'])
+              for url in urls]
+    # the rest of the root is only listed once the directories found in its first pages have been -
+    assert listed.index(('/', '10')) > listed.index(('/d0', '0'))
+    assert len(set(listed)) == len(listed) == 61
+
+def test_walk_early_close():
+    transport = FilesTreeTransport(_tree(dict({'/': [f'd{i}/' for i in range(20)]},
+                                              **{f'/d{i}': ['f.txt'] for i in range(20)})), delay=0.05)
+    t = DynaTapy(base_url='https://dev.example.org', tenant_id='dev', jwt='abc', transport=transport)
+    entries = walk(t, 'sys', '/', workers=2)
+    assert [entry.name for entry in itertools.islice(entries, 5)] == ['d0', 'd1', 'd2', 'd3', 'd4']
+    entries.close()
+    time.sleep(0.3)
+    # the root listing and at most one listing per worker were made; the other directories were never submitted -
+    assert len(transport.sent) <= 3
+
+
+# ---------------------
+# Sync tests -
+# ---------------------
+
+def test_sync_upload_plan_and_run(tmp_path):
+    modified = (datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(minutes=1)).isoformat()
+    transport = StaticTransport([{'name': 'a.txt', 'path': '/data/a.txt', 'type': 'file', 'size': 10,
+                                  'lastModified': modified},
+                                 {'name': 'b.txt', 'path': '/data/b.txt', 'type': 'file', 'size': 5}])
+    t = DynaTapy(base_url='https://dev.example.org', tenant_id='dev', jwt='abc', transport=transport)
+    local = tmp_path / 'local'
+    local.mkdir()
+    (local / 'a.txt').write_bytes(b'0123456789')
+    (local / 'c.txt').write_bytes(b'new')
+    s = Sync(t, str(local), 'sys', '/data', delete=True, manifest_path=str(tmp_path / 'manifest.sqlite'))
+    result = s.run(dry_run=True)
+    # a.txt is already on the system with the same size and a newer copy, so it is only recorded in the manifest -
+    assert [(action.kind, action.path) for action in result.actions] == [('record', 'a.txt'),
+                                                                         ('upload', 'c.txt'),
+                                                                         ('delete_remote', 'b.txt')]
+    assert not result.completed
+    sent = len(transport.sent)
+    result = s.run()
+    assert len(result.completed) == 3
+    assert not result.errors
+    assert sorted((r.method, r.url) for r in transport.sent[sent:] if r.method != 'GET') == [
+        ('DELETE', 'https://dev.example.org/v3/files/ops/sys/data/b.txt'),
+        ('POST', 'https://dev.example.org/v3/files/ops/sys/data/c.txt')]
+
+def test_sync_first_run_does_not_adopt_stale_files(tmp_path):
+    # same size as the local file, but an older copy with different content -
+    transport = StaticTransport([{'name': 'a.txt', 'path': '/data/a.txt', 'type': 'file', 'size': 10,
+                                  'lastModified': '2020-01-01T00:00:00Z'}])
+    t = DynaTapy(base_url='https://dev.example.org', tenant_id='dev', jwt='abc', transport=transport)
+    local = tmp_path / 'local'
+    local.mkdir()
+    (local / 'a.txt').write_bytes(b'0123456789')
+    s = Sync(t, str(local), 'sys', '/data', manifest_path=str(tmp_path / 'upload.sqlite'))
+    assert [(action.kind, action.path) for action in s.plan()] == [('upload', 'a.txt')]
+    # the other way around, the local copy is newer than the remote one, so it is adopted when downloading -
+    s = Sync(t, str(local), 'sys', '/data', direction='download', manifest_path=str(tmp_path / 'download.sqlite'))
+    assert [(action.kind, action.path) for action in s.plan()] == [('record', 'a.txt')]
+    # ... unless it is older, or its size differs (the documented unit of size is kB) -
+    os.utime(local / 'a.txt', (0, 0))
+    assert [(action.kind, action.path) for action in s.plan()] == [('download', 'a.txt')]
+    (local / 'a.txt').write_bytes(b'0' * 2048)
+    transport.result[0]['size'] = 2
+    assert [(action.kind, action.path) for action in s.plan()] == [('record', 'a.txt')]
+    transport.result[0]['size'] = 3
+    assert [(action.kind, action.path) for action in s.plan()] == [('download', 'a.txt')]
+
+
+# ---------------------
+# Actor messaging tests -
+# ---------------------
+
+def test_actor_messenger_send_many():
+    transport = StaticTransport({'executionId': 'e1', 'status': 'COMPLETE', 'logs': 'done'})
+    t = DynaTapy(base_url='https://dev.example.org', tenant_id='dev', jwt='abc', transport=transport)
+    with ActorMessenger(t, max_in_flight=2, min_interval=0.01, jitter=0) as messenger:
+        handles = messenger.send_many('actor', ({'message': m} for m in ('a', 'b', 'c')))
+        assert [handle.wait(timeout=5).status for handle in handles] == ['COMPLETE'] * 3
+    assert [handle.logs for handle in handles] == ['done'] * 3
+    assert [handle.execution_id for handle in handles] == ['e1'] * 3
+    # a message, a getExecution and a getExecutionLogs request per message -
+    assert sorted(r.method for r in transport.sent) == ['GET'] * 6 + ['POST'] * 3
+
+def test_actor_messenger_close_cancels_pending_executions():
+    transport = StaticTransport({'executionId': 'e1', 'status': 'RUNNING'})
+    t = DynaTapy(base_url='https://dev.example.org', tenant_id='dev', jwt='abc', transport=transport)
+    with ActorMessenger(t, min_interval=60) as messenger:
+        handles = messenger.send_many('actor', [{'message': 'a'}, {'message': 'b'}])
+    # the executions had not finished when the messenger was closed -
+    for handle in handles:
+        assert handle.status == 'SUBMITTED'
+        with pytest.raises(concurrent.futures.CancelledError):
+            handle.wait(timeout=5)
+    # an execution waiter on its own -
+    waiter = ExecutionWaiter(t, min_interval=0.01, jitter=0)
+    handle = waiter.watch_execution('actor', 'e1')
+    done, not_done = waiter.wait([handle], timeout=0.2)
+    assert not done and not_done == [handle]
+    assert handle.status == 'RUNNING'
+    waiter.close()
+    assert handle.future.cancelled()
+
+
+# ---------------------
+# Transfer manager tests -
+# ---------------------
+
+class TransfersTransport(StaticTransport):
+    """A StaticTransport standing in for the Files transfers API. Each task is reported IN_PROGRESS, then COMPLETED,
+    except those with a "slow" sourcePath, which stay IN_PROGRESS until they are cancelled; tasks with a "no-uuid"
+    sourcePath are created without a uuid."""
+    def __init__(self):
+        super().__init__(None)
+        self.tasks = {}
+
+    def send(self, request, **kwargs):
+        self.sent.append(request)
+        task_id = request.path_url.split('?')[0][len('/v3/files/transfers'):].strip('/')
+        if request.method == 'POST':
+            task = dict(json.loads(request.body), uuid=f't{len(self.tasks)}', status='ACCEPTED', totalBytes=100)
+            self.tasks[task['uuid']] = task
+            result = {k: v for k, v in task.items() if k != 'uuid' or task['sourcePath'] != 'no-uuid'}
+        elif request.method == 'DELETE':
+            self.tasks[task_id]['status'] = 'CANCELLED'
+            result = None
+        else:
+            task = self.tasks[task_id]
+            if task['status'] == 'ACCEPTED':
+                task.update(status='IN_PROGRESS', bytesTransferred=50)
+            elif task['status'] == 'IN_PROGRESS' and task['sourcePath'] != 'slow':
+                task.update(status='COMPLETED', bytesTransferred=100)
+            result = task
+        resp = requests.models.Response()
+        resp.status_code = 200
+        resp.headers['content-type'] = 'application/json'
+        resp._content = json.dumps({'result': result, 'status': 'success', 'message': '', 'version': 'test'}).encode()
+        resp.request = request
+        return resp
+
+def _wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+def test_transfer_manager(tmp_path):
+    transport = TransfersTransport()
+    t = DynaTapy(base_url='https://dev.example.org', tenant_id='dev', jwt='abc', transport=transport)
+    manifest = tmp_path / 'manifest.ndjson'
+    manifest.write_text('\n'.join(json.dumps({'sourceSystemId': 'a', 'sourcePath': path, 'destinationSystemId': 'b',
+                                              'destinationPath': path}) for path in ('fast', 'slow', 'no-uuid')))
+    finished = []
+    with TransferManager(t, min_interval=0.01, jitter=0) as manager:
+        fast, slow, no_uuid = manager.submit_manifest(str(manifest), callback=finished.append)
+        assert fast.wait(timeout=5).status == 'COMPLETED'
+        assert fast.bytes_transferred == 100
+        # a task created without a uuid cannot be monitored, so it fails right away -
+        with pytest.raises(tapy.errors.InvalidServerResponseError):
+            no_uuid.wait(timeout=5)
+        _wait_for(lambda: slow.status == 'IN_PROGRESS')
+        assert manager.cancel() == []
+        assert slow.wait(timeout=5).status == 'CANCELLED'
+        assert [r.method for r in transport.sent].count('DELETE') == 1
+        stats = manager.stats()
+    assert sorted(handle.request['sourcePath'] for handle in finished) == ['fast', 'no-uuid', 'slow']
+    assert stats['submitted'] == 3 and stats['finished'] == 3
+    assert stats['statuses'] == {'COMPLETED': 1, 'CANCELLED': 1, 'ACCEPTED': 1}
+    assert stats['bytes_transferred'] == 150
+    assert stats['total_bytes'] == 300
+
+def test_transfer_manager_close_cancels_pending_handles():
+    t = DynaTapy(base_url='https://dev.example.org', tenant_id='dev', jwt='abc', transport=TransfersTransport())
+    with TransferManager(t, min_interval=0.01, jitter=0) as manager:
+        handle = manager.submit('a', 'slow', 'b', 'slow')
+        _wait_for(lambda: handle.status == 'IN_PROGRESS')
+    with pytest.raises(concurrent.futures.CancelledError):
+        handle.wait(timeout=5)
+
+
+# ---------------------
+# Meta bulk tests -
+# ---------------------
+
+def test_import_and_export_documents(tmp_path):
+    transport = StaticTransport([{'name': 'doc1'}, {'name': 'doc2'}, {'name': 'doc3'}])
+    t = DynaTapy(base_url='https://dev.example.org', tenant_id='dev', jwt='abc', transport=transport)
+    source = tmp_path / 'docs.ndjson'
+    source.write_text('\n'.join(json.dumps({'name': f'doc{i}'}) for i in range(5)))
+    stats = import_documents(t, 'db', 'coll', str(source), batch_size=2)
+    assert stats.documents == 5
+    assert stats.batches == 3
+    bodies = sorted((json.loads(r.body) for r in transport.sent), key=lambda body: body[0]['name'])
+    assert bodies == [[{'name': 'doc0'}, {'name': 'doc1'}], [{'name': 'doc2'}, {'name': 'doc3'}], [{'name': 'doc4'}]]
+    dest = tmp_path / 'export.ndjson'
+    stats = export_documents(t, 'db', 'coll', str(dest), pagesize=10, prefetch=0)
+    assert stats.documents == 3
+    assert [json.loads(line) for line in dest.read_text().splitlines()] == [{'name': 'doc1'}, {'name': 'doc2'},
+                                                                          {'name': 'doc3'}]
+
+class FailingTransport(StaticTransport):
+    """A StaticTransport that answers every request with a server error."""
+    def send(self, request, **kwargs):
+        resp = super().send(request, **kwargs)
+        resp.status_code = 500
+        return resp
+
+def test_import_documents_stop_on_error():
+    transport = FailingTransport([])
+    t = DynaTapy(base_url='https://dev.example.org', tenant_id='dev', jwt='abc', transport=transport)
+    documents = ({'name': f'doc{i}'} for i in range(10))
+    stats = import_documents(t, 'db', 'coll', documents, batch_size=2, max_in_flight=1, stop_on_error=True)
+    assert len(transport.sent) == 1
+    assert stats.failed_documents == 2
+    # the batch read while the first one was being written is skipped, and the rest of the source is not read -
+    assert stats.skipped_documents == 2
+    assert stats.stopped
+    assert stats.documents == 0
+    assert next(documents) == {'name': 'doc4'}
+
+def test_import_documents_with_validation():
+    transport = StaticTransport([])
+    t = DynaTapy(base_url='https://dev.example.org', tenant_id='dev', jwt='abc', transport=transport,
+                 validate_requests=True)
+    stats = import_documents(t, 'db', 'coll', [{'name': 'doc0'}, {'name': 'doc1'}, {'name': 'doc2'}], batch_size=2)
+    assert stats.failed_documents == 0
+    assert stats.documents == 3
+    assert len(transport.sent) == 2
+
+
+# ---------------------
+# Secret cache tests -
+# ---------------------
+
+def test_secret_cache():
+    transport = StaticTransport({'secretMap': {'password': 'abc123'}, 'metadata': {'version': 1}})
+    cache = SecretCache(ttl=600)
+    t = DynaTapy(base_url='https://dev.example.org', tenant_id='dev', jwt='abc', transport=transport,
+                 secret_cache=cache)
+    secret = t.sk.readSecret(secretType='service', secretName='db')
+    assert secret.secretMap.password == 'abc123'
+    assert t.sk.readSecret(secretType='service', secretName='db') is secret
+    assert len(transport.sent) == 1
+    # writing the secret through the client invalidates it -
+    t.sk.writeSecret(secretType='service', secretName='db', data={'password': 'def456'})
+    t.sk.readSecret(secretType='service', secretName='db')
+    assert [r.method for r in transport.sent] == ['GET', 'POST', 'GET']
+    # the secrets are not pickled -
+    assert len(pickle.loads(pickle.dumps(t)).secret_cache) == 0
+
+
+# ---------------------
+# Rate limit tests -
+# ---------------------
+
+class ThrottlingTransport(StaticTransport):
+    """A StaticTransport that answers every request with a 429."""
+    def send(self, request, **kwargs):
+        resp = super().send(request, **kwargs)
+        resp.status_code = 429
+        resp.headers['Retry-After'] = '0'
+        return resp
+
+def test_rate_limits_slow_down_on_429():
+    limiter = RateLimiter({'actors': {'rate': 100, 'max_in_flight': 4}, 'actors.sendMessage': {'max_in_flight': 1}})
+    t = DynaTapy(base_url='https://dev.example.org', tenant_id='dev', jwt='abc', transport=ThrottlingTransport({}),
+                 rate_limits=limiter)
+    assert [limit.max_in_flight for limit in limiter.limits_for('actors', 'sendMessage')] == [4, 1]
+    with pytest.raises(tapy.errors.TooManyRequestsError):
+        t.actors.listActors()
+    stats = limiter.stats()['actors']
+    assert stats['throttled'] == 1
+    assert stats['current_rate'] < 100
+
+
+# ---------------------
+# Endpoint failover tests -
+# ---------------------
+
+class UnreachableTransport(StaticTransport):
+    """A StaticTransport that cannot connect to some hosts."""
+    def __init__(self, result, unreachable):
+        super().__init__(result)
+        self.unreachable = unreachable
+
+    def send(self, request, **kwargs):
+        if request.url.startswith(self.unreachable):
+            self.sent.append(request)
+            raise requests.exceptions.ConnectionError('connection refused')
+        return super().send(request, **kwargs)
+
+def test_endpoint_failover():
+    transport = UnreachableTransport([], unreachable='https://site.example.org')
+    t = DynaTapy(endpoints=['https://site.example.org', 'https://central.example.org'], tenant_id='dev',
+                 transport=transport)
+    assert t.base_url == 'https://site.example.org'
+    assert t.transport.probe_paths == ['/v3/systems/readycheck', '/v3/files/healthcheck']
+    for _ in range(5):
+        t.systems.getSystems()
+    urls = [request.url for request in transport.sent]
+    assert urls[-1] == 'https://central.example.org/v3/systems'
+    # the unreachable endpoint is taken out of rotation after 3 failures -
+    assert len([url for url in urls if url.startswith('https://site.example.org')]) == 3
+    stats = t.transport.stats()
+    assert not stats['https://site.example.org']['up']
+    assert stats['https://central.example.org']['requests'] == 5
+    assert t.transport.probe() == {'https://site.example.org': False, 'https://central.example.org': True}
+
+
+# ---------------------
+# Request coalescing tests -
+# ---------------------
+
+class SlowTransport(StaticTransport):
+    """A StaticTransport that takes a while to answer."""
+    def send(self, request, **kwargs):
+        time.sleep(0.2)
+        return super().send(request, **kwargs)
+
+def test_coalesce_identical_gets():
+    transport = SlowTransport({'id': 'abc'})
+    t = DynaTapy(base_url='https://dev.example.org', tenant_id='dev', jwt='abc', transport=transport,
+                 coalesce_requests=True)
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lambda _: t.systems.getSystemByName(systemName='abc'), range(8)))
+    assert len(transport.sent) == 1
+    assert all(result is results[0] for result in results)
+    assert t.coalesce_requests.stats()['coalesced'] == 7
+    # different requests, and requests made after the first one completed, are not coalesced -
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        list(executor.map(lambda name: t.systems.getSystemByName(systemName=name), ['abc', 'def']))
+    assert len(transport.sent) == 3
+
+# ---------------------
+# Priority scheduler tests -
+# ---------------------
+
+def test_scheduler_reserves_capacity_for_interactive_calls():
+    transport = SlowTransport([])
+    t = DynaTapy(base_url='https://dev.example.org', tenant_id='dev', jwt='abc', transport=transport,
+                 scheduler={'max_in_flight': 2, 'reserved': 1, 'operations': {'files.listFiles': 'batch'}})
+    with ThreadPoolExecutor(max_workers=5) as executor:
+        batch = [executor.submit(t.files.listFiles, systemId='abc', path=f'dir{i}') for i in range(4)]
+        time.sleep(0.05)
+        # batch calls only use one of the two slots, so an interactive call starts right away -
+        start = time.monotonic()
+        t.systems.getSystemByName(systemName='abc')
+        assert time.monotonic() - start < 0.35
+        for future in batch:
+            future.result()
+    stats = t.scheduler.stats()
+    assert stats['classes']['batch']['started'] == 4
+    assert stats['classes']['batch']['max_queue_depth'] == 3
+    assert stats['classes']['interactive']['wait_p99'] == 0
+    assert stats['in_flight'] == 0
+    # the class can also be set per call -
+    t.systems.getSystemByName(systemName='abc', _tapis_priority='batch')
+    assert t.scheduler.stats()['classes']['batch']['started'] == 5
+    with pytest.raises(tapy.errors.InvalidInputError):
+        t.systems.getSystemByName(systemName='abc', _tapis_priority='urgent')
+    t2 = pickle.loads(pickle.dumps(t))
+    assert t2.scheduler.operations == {'files.listFiles': 'batch'}
+
+def test_scheduler_with_rate_limits():
+    transport = SlowTransport([])
+    # an in-flight limit shared by files and systems, as large as the scheduler's capacity -
+    t = DynaTapy(base_url='https://dev.example.org', tenant_id='dev', jwt='abc', transport=transport,
+                 rate_limits=RateLimiter(default={'max_in_flight': 2}),
+                 scheduler={'max_in_flight': 2, 'reserved': 1, 'operations': {'files.listFiles': 'batch'}})
+    with ThreadPoolExecutor(max_workers=5) as executor:
+        batch = [executor.submit(t.files.listFiles, systemId='abc', path=f'dir{i}') for i in range(4)]
+        time.sleep(0.05)
+        # the batch calls waiting for a scheduler slot do not hold in-flight permits, so an interactive call still
+        # starts right away -
+        start = time.monotonic()
+        t.systems.getSystemByName(systemName='abc')
+        assert time.monotonic() - start < 0.35
+        for future in batch:
+            future.result()
+    assert t.scheduler.stats()['in_flight'] == 0
+
+
+# ---------------------
+# SK provisioning tests -
+# ---------------------
+
+class SKTransport(StaticTransport):
+    """A StaticTransport standing in for the role and permission operations of SK, with an in-memory state."""
+    def __init__(self, roles, user_roles, unavailable=()):
+        super().__init__(None)
+        self.roles = roles
+        self.user_roles = user_roles
+        # operations (last path segment) answered with a 503 the first time they are called.
+        self.unavailable = set(unavailable)
+
+    def send(self, request, **kwargs):
+        path = request.path_url.split('?')[0][len('/v3/security/'):]
+        body = json.loads(request.body) if request.body else {}
+        if path.split('/')[-1] in self.unavailable:
+            self.unavailable.discard(path.split('/')[-1])
+            resp = super().send(request, **kwargs)
+            resp.status_code = 503
+            return resp
+        if path == 'role' and request.method == 'GET':
+            self.result = {'names': sorted(self.roles)}
+        elif path.startswith('role/') and path.endswith('/perms'):
+            self.result = {'names': sorted(self.roles[path.split('/')[1]])}
+        elif path.startswith('user/roles/'):
+            self.result = {'names': sorted(self.user_roles.get(path.split('/')[-1], []))}
+        elif path == 'role':
+            self.roles.setdefault(body['roleName'], set())
+        elif path == 'role/addPerm':
+            self.roles[body['roleName']].add(body['permSpec'])
+        elif path == 'role/removePerm':
+            self.roles[body['roleName']].discard(body['permSpec'])
+        elif path == 'user/grantRole':
+            self.user_roles.setdefault(body['user'], set()).add(body['roleName'])
+        elif path == 'user/revokeUserRole':
+            self.user_roles[body['user']].discard(body['roleName'])
+        return super().send(request, **kwargs)
+
+def test_provision_sk_roles():
+    transport = SKTransport(roles={'proj_user': {'meta:dev:GET:db', 'meta:dev:*:old'}, 'other': set()},
+                            user_roles={'alice': {'proj_user', 'other'}, 'bob': {'proj_admin'}},
+                            unavailable=['grantRole'])
+    t = DynaTapy(base_url='https://dev.example.org', tenant_id='dev', username='admin', jwt='abc', transport=transport)
+    desired = {'roles': {'proj_admin': {'permissions': ['files:dev:*:sys']},
+                         'proj_user': {'permissions': ['meta:dev:GET:db']}},
+               'users': {'alice': {'roles': ['proj_user', 'proj_admin']}, 'bob': {'roles': ['proj_user']}}}
+    plan = provision(t, desired, prune=True, dry_run=True)
+    assert sorted(str(action) for action in plan.actions) == [
+        "<ProvisioningAction addRolePermission(user='admin', roleName='proj_admin', permSpec='files:dev:*:sys')>",
+        "<ProvisioningAction createRole(user='admin', roleName='proj_admin', description='proj_admin')>",
+        "<ProvisioningAction grantRole(user='alice', roleName='proj_admin')>",
+        "<ProvisioningAction grantRole(user='bob', roleName='proj_user')>",
+        "<ProvisioningAction removeRolePermission(user='admin', roleName='proj_user', permSpec='meta:dev:*:old')>",
+        "<ProvisioningAction revokeUserRole(user='bob', roleName='proj_admin')>"]
+    assert 'proj_admin' not in transport.roles
+    result = provision(t, desired, prune=True, backoff=0)
+    assert result.stats()['completed'] == 6
+    assert result.retries == 1
+    assert transport.roles['proj_admin'] == {'files:dev:*:sys'}
+    assert transport.roles['proj_user'] == {'meta:dev:GET:db'}
+    # roles that are not declared are left alone -
+    assert transport.user_roles == {'alice': {'proj_user', 'proj_admin', 'other'}, 'bob': {'proj_user'}}
+    # once provisioned, nothing is left to do -
+    assert provision(t, desired, prune=True).actions == []
+
+
+# ---------------------
+# Systems catalog tests -
+# ---------------------
+
+class SystemsTransport(StaticTransport):
+    """A StaticTransport standing in for the Systems API, with an in-memory set of systems."""
+    def __init__(self, systems):
+        super().__init__(None)
+        self.systems = {system['name']: system for system in systems}
+
+    def send(self, request, **kwargs):
+        self.sent.append(request)
+        name = request.path_url.split('?')[0][len('/v3/systems'):].strip('/')
+        status, result = 200, None
+        if request.method == 'GET' and not name:
+            result = sorted(self.systems.values(), key=lambda system: system['name'])
+        elif request.method == 'GET':
+            status, result = (200, self.systems[name]) if name in self.systems else (404, None)
+        elif request.method == 'POST':
+            system = json.loads(request.body)
+            self.systems[system['name']] = system
+        elif request.method == 'PATCH':
+            self.systems[name].update(json.loads(request.body))
+        elif request.method == 'DELETE':
+            del self.systems[name]
+        resp = requests.models.Response()
+        resp.status_code = status
+        resp.headers['content-type'] = 'application/json'
+        resp._content = json.dumps({'result': result, 'status': 'success', 'message': '', 'version': 'test'}).encode()
+        resp.request = request
+        return resp
+
+def test_systems_catalog(tmp_path):
+    transport = SystemsTransport([{'name': 'a', 'host': 'h1', 'owner': 'jdoe', 'systemType': 'LINUX', 'tags': ['hpc']},
+                                  {'name': 'b', 'host': 'h2', 'owner': 'jdoe', 'systemType': 'LINUX', 'tags': []},
+                                  {'name': 'c', 'host': 'h1', 'owner': 'asmith', 'systemType': 'OBJECT_STORE'}])
+    path = str(tmp_path / 'systems.db')
+    t = DynaTapy(base_url='https://dev.example.org', tenant_id='dev', jwt='abc', transport=transport,
+                 systems_catalog={'refresh_interval': None, 'path': path})
+    catalog = t.systems_catalog
+    assert [system.name for system in catalog.find(host='h1')] == ['a', 'c']
+    assert [system.name for system in catalog.find(owner='jdoe', systemType='LINUX')] == ['a', 'b']
+    assert [system.name for system in catalog.find(tags='hpc')] == ['a']
+    assert catalog.get('b').host == 'h2'
+    assert catalog.get('z') is None
+    # every query was answered from the single listing -
+    assert len(transport.sent) == 1
+    # writes through the client invalidate the systems they change -
+    t.systems.updateSystem(systemName='b', host='h1')
+    assert catalog.get('b').host == 'h1'
+    assert [system.name for system in catalog.find(host='h1')] == ['a', 'b', 'c']
+    t.systems.deleteSystemByName(systemName='c')
+    assert catalog.get('c') is None
+    assert catalog.find(owner='asmith') == []
+    # a refresh only applies the changes -
+    transport.systems['d'] = {'name': 'd', 'host': 'h3', 'owner': 'jdoe', 'systemType': 'LINUX'}
+    transport.systems['a']['owner'] = 'asmith'
+    assert catalog.refresh() == {'added': 1, 'updated': 1, 'removed': 0}
+    assert [system.name for system in catalog.find(owner='asmith')] == ['a']
+    # a new catalog is loaded from the database without any request -
+    sent = len(transport.sent)
+    t2 = DynaTapy(base_url='https://dev.example.org', tenant_id='dev', jwt='abc', transport=transport,
+                  systems_catalog={'refresh_interval': None, 'path': path})
+    assert t2.systems_catalog.names() == ['a', 'b', 'd']
+    assert t2.systems_catalog.get('d').host == 'h3'
+    catalog.close()
+    t2.systems_catalog.close()
+    assert len(transport.sent) - sent <= 1
+
+def test_systems_catalog_refresh_does_not_undo_invalidations():
+    transport = SystemsTransport([{'name': 'a', 'host': 'h1'}, {'name': 'b', 'host': 'h1'}])
+    t = DynaTapy(base_url='https://dev.example.org', tenant_id='dev', jwt='abc', transport=transport,
+                 systems_catalog={'refresh_interval': None})
+    catalog = t.systems_catalog
+    assert catalog.get('b').host == 'h1'
+    send = transport.send
+
+    def send_racing_write(request, **kwargs):
+        response = send(request, **kwargs)
+        if request.path_url == '/v3/systems':
+            # the system changes, and is fetched again, after the listing was made and before it is applied -
+            transport.send = send
+            t.systems.updateSystem(systemName='b', host='h2')
+            catalog._fetch('b')
+        return response
+    transport.send = send_racing_write
+    catalog.refresh()
+    assert catalog.get('b').host == 'h2'
+    assert [system.name for system in catalog.find(host='h2')] == ['b']
+    # pool views of other tenants neither see the client's catalog nor invalidate it -
+    view = DynaTapyView(t, 'other', 'https://other.example.org')
+    assert view.systems_catalog is None
+    invalidations = catalog.invalidations
+    view.systems.updateSystem(systemName='a', host='h3')
+    assert catalog.invalidations == invalidations
+    catalog.close()
+
+def test_systems_catalog_keeps_systems_on_bad_requests():
+    transport = SystemsTransport([{'name': 'a', 'host': 'h1'}])
+    t = DynaTapy(base_url='https://dev.example.org', tenant_id='dev', jwt='abc', transport=transport,
+                 systems_catalog={'refresh_interval': None})
+    catalog = t.systems_catalog
+    assert catalog.get('a').host == 'h1'
+    send = transport.send
+
+    def send_bad_request(request, **kwargs):
+        response = send(request, **kwargs)
+        if request.method == 'GET' and request.path_url == '/v3/systems/a':
+            response.status_code = 400
+        return response
+    transport.send = send_bad_request
+    catalog.invalidate('a')
+    # only a 404 means that the system was deleted -
+    with pytest.raises(tapy.errors.InvalidInputError):
+        catalog.get('a')
+    transport.send = send
+    assert catalog.get('a').host == 'h1'
+    assert catalog.names() == ['a']
+    catalog.close()
+
+
+# ---------------------
+# Streams follow tests -
+# ---------------------
+
+class StreamsTransport(StaticTransport):
+    """A StaticTransport standing in for the Streams API, returning the measurements of an instrument from start_date
+    on (inclusive), up to limit."""
+    def __init__(self, measurements):
+        super().__init__(None)
+        # the measurements, by instrument id.
+        self.measurements = measurements
+
+    def send(self, request, **kwargs):
+        self.sent.append(request)
+        url = urllib.parse.urlparse(request.path_url)
+        inst_id = url.path.split('/')[-2]
+        query = dict(urllib.parse.parse_qsl(url.query))
+        result = [m for m in self.measurements.get(inst_id, []) if m['datetime'] >= query.get('start_date', '')]
+        result = result[:int(query.get('limit', len(result)))]
+        resp = requests.models.Response()
+        resp.status_code = 200
+        resp.headers['content-type'] = 'application/json'
+        resp._content = json.dumps({'result': result, 'status': 'success', 'message': '', 'version': 'test'}).encode()
+        resp.request = request
+        return resp
 
+def test_follow_measurements():
+    transport = StreamsTransport({'i1': [{'datetime': '2024-01-01T00:00:00Z', 'temp': 1},
+                                         {'datetime': '2024-01-01T00:00:01Z', 'temp': 2},
+                                         {'datetime': '2024-01-01T00:00:01Z', 'temp': 3}],
+                                  'i2': [{'datetime': '2024-01-01T00:00:05Z', 'rh': 50}]})
+    t = DynaTapy(base_url='https://dev.example.org', tenant_id='dev', jwt='abc', transport=transport)
+    with MeasurementFollower(t, page_size=2, min_interval=60) as follower:
+        follower.follow('p', 's', 'i1', start_date='2024-01-01T00:00:00Z')
+        cursor = follower._cursors[('p', 's', 'i1')]
+        # a full page, so the next poll is due right away -
+        follower.poll(cursor)
+        assert cursor.full_page and follower.next_interval(cursor, None, None, 60) == 0
+        assert cursor.high_water_mark == '2024-01-01T00:00:01Z'
+        # the point at the high-water mark is not delivered again, the other one at the same time is -
+        follower.poll(cursor)
+        assert [m.temp for _, m in [follower.get(timeout=1) for _ in range(3)]] == [1, 2, 3]
+        follower.poll(cursor)
+        assert follower.get(timeout=0) is None
+        # only the points after the high-water mark are delivered -
+        transport.measurements['i1'].append({'datetime': '2024-01-01T00:00:09Z', 'temp': 4})
+        follower.poll(cursor)
+        assert follower.get(timeout=1)[1].temp == 4
+        assert transport.sent[-1].path_url.count('start_date=2024-01-01T00%3A00%3A01Z') == 1
+        assert cursor.rate > 0
+    # many instruments from one follower -
+    points = follow_measurements(t, [('p', 's', 'i1'), ('p', 's', 'i2')], start_date='2024-01-01T00:00:05Z',
+                                 min_interval=0.05, jitter=0)
+    received = sorted((instrument[2], m.datetime) for instrument, m in itertools.islice(points, 2))
+    points.close()
+    assert received == [('i1', '2024-01-01T00:00:09Z'), ('i2', '2024-01-01T00:00:05Z')]